@@ -1,48 +1,53 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Blueprint, Flask, Response, request, jsonify, render_template, send_from_directory, url_for, g
 import requests
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 import os
-import PyPDF2
 import logging
 from flask_cors import CORS
 import json
-import sqlite3
-import random
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-import sys
-import re  # Import regular expressions
-
-app = Flask(__name__)
-CORS(app)
-
-# Configure Logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("app.log", encoding='utf-8'),
-        logging.StreamHandler(sys.stdout)
-    ]
+import hashlib
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from jobs import job_queue, JobQueueFull, JOBS_DATABASE
+from db import claim_periodic_task
+from generation_cache import generation_cache, make_cache_key
+from question_parser import QuestionStreamParser
+from ollama_client import ollama_client, OllamaUnavailable
+from paper_renderer import render_papers
+from paper_assembler import PaperConstraints, AssemblyError, assemble_papers
+from question_bank import (
+    init_db, start_run, fail_run, store_questions, get_questions_by_unit, get_bank_summary, compact_bank,
+    get_duplicate_clusters, reindex_near_duplicates, describe_scope, list_uploads, DEFAULT_COURSE
 )
+from upload_store import (
+    UploadError, store_upload, collect_garbage, create_paper_set, paper_set_dir, PAPER_FILENAME_PATTERN
+)
+from metrics import metrics, THROUGHPUT_BUCKETS
+from blueprint import BlueprintError, load_blueprint, list_blueprints, save_blueprint
+from paper_bundle import stream_zip, bundle_etag, bundle_last_modified
+from pdf_text import page_cache
+from syllabus_index import load_syllabus
+from prompt_builder import prepare_syllabus, build_prompt
+from log_config import configure_logging, LogSampler
+from profiling import (Profile, ProfileNotFound, PROFILE_TOKEN, profile_trigger, profile_access_allowed, list_profiles, load_profile,
+                       compare_profiles, profile_path)
+
+# Routes and request hooks; create_app() builds the Flask application around them
+routes = Blueprint('qpg', __name__)
 
 # Constants and Configuration
-SYSTEM_PROMPT = (
+# Question counts and the format example are filled in from the paper blueprint (build_system_prompt)
+SYSTEM_PROMPT_TEMPLATE = (
     "As an AI assistant, your task is to generate exam questions from the provided text. "
-    "For each unit listed in the 'Units' section below, you must generate exactly 6 questions: "
-    "3 four-mark questions and 3 six-mark questions. "
+    "For each unit listed in the 'Units' section below, you must generate exactly {question_total} questions: "
+    "{quota_text}. "
     "Do not generate more or fewer questions for any unit. "
     "Each question should be relevant to the corresponding unit and cover key concepts. "
     "Use the following strict format for each unit and question:\n\n"
     "Unit X:\n"
-    "1. Question text [CO:X] [BT:Y] (4 marks).\n"
-    "2. Question text [CO:X] [BT:Y] (4 marks).\n"
-    "3. Question text [CO:X] [BT:Y] (4 marks).\n"
-    "4. Question text [CO:X] [BT:Y] (6 marks).\n"
-    "5. Question text [CO:X] [BT:Y] (6 marks).\n"
-    "6. Question text [CO:X] [BT:Y] (6 marks).\n\n"
+    "{format_lines}\n\n"
     "Important Guidelines:\n"
     "- **CO Number Must Match Unit Number:** For each question, the [CO:X] must be the same as the unit number. For example, questions in Unit 1 must have [CO:1].\n"
     "- **Single CO Number:** Only a single CO number is allowed. Do not include multiple CO numbers or ranges.\n"
@@ -57,90 +62,111 @@ SYSTEM_PROMPT = (
     "- **Non-Compliance:** If you cannot comply with these instructions, do not generate any output."
 )
 
+# The model comes from the Ollama client configuration; num_ctx and num_predict are sized per prompt
+# (prompt_builder). The model and each request's options are part of the cache key
+OLLAMA_MODEL = ollama_client.model
+
+# 'single' sends the whole syllabus in one prompt; 'per-unit' fans out one prompt per unit
+GENERATION_MODES = ('single', 'per-unit')
+GENERATION_MODE = os.environ.get('QPG_GENERATION_MODE', 'single')
+UNIT_CONCURRENCY = int(os.environ.get('QPG_UNIT_CONCURRENCY', 4))
+UNIT_TIMEOUT = float(os.environ.get('QPG_UNIT_TIMEOUT', 300))
+UNIT_RETRIES = int(os.environ.get('QPG_UNIT_RETRIES', 1))
+REPAIR_RETRIES = int(os.environ.get('QPG_REPAIR_RETRIES', 2))
+
+REPAIR_PROMPT_TEMPLATE = (
+    "As an AI assistant, your task is to write additional exam questions from the provided text. "
+    "For each unit listed in the 'Units' section below, write exactly the number of questions requested for each mark value, and no others. "
+    "Do not repeat any of the existing questions listed for a unit. "
+    "Use the following strict format:\n\n"
+    "Unit X:\n"
+    "{format_lines}\n\n"
+    "The [CO:X] must be the same as the unit number, and [BT:Y] must be a Bloom's Taxonomy level between 1 and 6. "
+    "Do not include any additional text, introductions or explanations."
+)
+
+# Marks values are spelled out in prompts ('four-mark'), as the model was originally instructed
+MARKS_WORDS = ('zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten')
+
+SSE_KEEPALIVE_SECONDS = 15
+MAX_PAPERS = int(os.environ.get('QPG_MAX_PAPERS', 100))
+
 UPLOAD_FOLDER = 'uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-
-DATABASE = 'data/questions.db'
-
-# Database Initialization
-def init_db():
-    os.makedirs('data', exist_ok=True)
-    logging.debug("Ensured that the data directory exists.")
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-
-    # Create the 'questions' table with 'unit', 'question', and 'marks' columns
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS questions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            unit TEXT NOT NULL,
-            question TEXT NOT NULL,
-            marks INTEGER NOT NULL
-        )
-    ''')
-    conn.commit()
-    conn.close()
-    logging.info("Database initialized successfully.")
-
-# Clear Existing Questions
-def clear_questions():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM questions')
-    conn.commit()
-    conn.close()
-    logging.info("Cleared all existing questions from the database.")
-
-# Store Questions in Database
-def store_questions(unit_questions):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-
-    for unit, marks_dict in unit_questions.items():
-        for mark, questions in marks_dict.items():
-            for question_data in questions:
-                question_text = question_data['text']
-                # Store 'unit', 'question', and 'marks'
-                cursor.execute(
-                    'INSERT INTO questions (unit, question, marks) VALUES (?, ?, ?)',
-                    (unit, question_text, int(mark))
-                )
-                logging.debug(f"Stored question for {unit}: {question_text} ({mark} marks)")
-
-    conn.commit()
-    conn.close()
-    logging.info("All questions have been stored in the database.")
-
-# Retrieve All Questions Grouped by Unit and Marks
-def get_all_questions_by_unit():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT unit, question, marks FROM questions')
-    questions = cursor.fetchall()
-    conn.close()
-
-    # Organize questions by unit and marks
-    unit_questions = {}
-    for unit, question, marks in questions:
-        if unit not in unit_questions:
-            unit_questions[unit] = {'4': [], '6': []}
-        question_data = {'text': question, 'marks': marks}
-        if marks == 4:
-            unit_questions[unit]['4'].append(question_data)
-        elif marks == 6:
-            unit_questions[unit]['6'].append(question_data)
-
-    logging.debug(f"Retrieved questions grouped by unit: {unit_questions}")
-    return unit_questions
+# Bank compaction and upload garbage collection at startup run in one worker process per interval
+MAINTENANCE_INTERVAL = int(os.environ.get('QPG_MAINTENANCE_INTERVAL', 3600))
+
+# Request and Generation Metrics (exposed at /metrics)
+HTTP_REQUESTS = metrics.counter('qpg_http_requests_total', 'HTTP requests by route, method and status.', ('method', 'route', 'status'))
+HTTP_REQUEST_SECONDS = metrics.histogram('qpg_http_request_seconds', 'HTTP request handling time (streamed bodies excluded).', ('method', 'route'))
+OLLAMA_GENERATIONS = metrics.histogram('qpg_ollama_generation_seconds', 'Ollama generation time, from request to end of stream.', ('outcome',))
+OLLAMA_FIRST_TOKEN_SECONDS = metrics.histogram('qpg_ollama_time_to_first_token_seconds', 'Time from sending a prompt to the first streamed token.')
+OLLAMA_TOKENS = metrics.counter('qpg_ollama_tokens_total', 'Tokens processed by Ollama (prompt tokens when reported).', ('kind',))
+OLLAMA_TOKENS_PER_SECOND = metrics.histogram('qpg_ollama_tokens_per_second', 'Generation speed after the first token.', buckets=THROUGHPUT_BUCKETS)
+
+# Raw stream lines arrive once per token; at DEBUG only a sample of them is logged
+log_stream_line = LogSampler('app')
+
+@routes.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@routes.after_app_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+    if 'request_started' in g:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.request_started, method=request.method, route=route)
+    return response
+
+# Opt-in profiling (QPG_PROFILING=1): the admin token as an X-Profile header or ?profile=, or QPG_PROFILE_SAMPLE_RATE (profiling.py)
+@routes.before_app_request
+def start_request_profile():
+    trigger = profile_trigger(request.headers, request.args, request.path)
+    if trigger:
+        profile = Profile(trigger, target=f"{request.method} {request.path}")
+        try:
+            profile.start()
+        except ValueError as e:
+            # Another request is already being profiled; this one is served without a profile
+            logging.warning(f"Skipped profiling {request.method} {request.path}: {e}")
+            return
+        g.profile = profile
+
+@routes.after_app_request
+def save_request_profile(response):
+    profile = g.pop('profile', None)
+    if profile is not None and profile.running:
+        # Streamed bodies (job events, bundles) are produced after this point and are not included
+        try:
+            profile.stop(status=response.status_code, route=request.url_rule.rule if request.url_rule else None)
+            response.headers['X-Profile-Id'] = profile.id
+        except Exception:
+            logging.exception(f"Could not save profile {profile.id}.")
+    return response
+
+@routes.teardown_app_request
+def stop_request_profile(error=None):
+    profile = g.pop('profile', None)
+    if profile is not None and profile.running:
+        try:
+            profile.stop(status=500, error=repr(error))
+        except Exception:
+            logging.exception(f"Could not save profile {profile.id}.")
 
 # Route: Homepage
-@app.route('/')
+@routes.route('/')
 def index():
     return render_template('index.html')
 
+# Pipeline Error: carries the user-facing message and HTTP status for a failed job
+class GenerationError(Exception):
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
 # Route: Generate Questions
-@app.route('/generate-questions', methods=['POST'])
+@routes.route('/generate-questions', methods=['POST'])
 def generate_questions():
     try:
         logging.info("Received request to generate questions.")
@@ -151,407 +177,800 @@ def generate_questions():
             logging.error("No syllabus file uploaded.")
             return jsonify({'error': 'No syllabus file uploaded.'}), 400
 
-        # Secure and save the uploaded file
-        filename = secure_filename(syllabus_file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        syllabus_file.save(filepath)
-        logging.info(f"Syllabus file saved to: {filepath}")
-
-        # Extract text from PDF
-        syllabus_text = extract_text_from_pdf(filepath)
-        logging.debug(f"Extracted syllabus text (first 500 characters): {syllabus_text[:500]}")
-
-        # Extract units from the syllabus text
-        units = extract_units_from_text(syllabus_text)
-        logging.info(f"Extracted units: {units}")
-
-        if not units:
-            logging.error("No units found in the syllabus text.")
-            return jsonify({'error': 'No units found in the syllabus text.'}), 400
-
-        # Prepare the units list for the prompt
-        units_text = '\n'.join(units.keys())  # Only unit numbers (e.g., 'Unit 1', 'Unit 2', etc.)
-
-        # Construct prompt for AI
-        prompt = f"{SYSTEM_PROMPT}\n\nUnits:\n{units_text}\n\nText:\n{syllabus_text}"
-        logging.debug("Constructed prompt for AI model.")
-
-        # Send prompt to AI API
-        response = requests.post(
-            'http://localhost:11434/api/generate',
-            json={"model": "llama3.2-vision", "prompt": prompt},
-            stream=True
-        )
-
-        logging.info(f"AI API response status: {response.status_code}")
-
-        if response.status_code != 200:
-            logging.error(f"AI API returned non-200 status code: {response.status_code}")
-            return jsonify({'error': 'Failed to generate questions from AI API.'}), 500
-
-        # Collect AI response
-        generated_text = ''
-        for line in response.iter_lines():
-            if line:
-                try:
-                    json_line = json.loads(line)
-                    logging.debug(f"Received line from AI API: {json_line}")
-                    if json_line.get('done'):
-                        break
-                    if 'response' not in json_line:
-                        logging.error(f"Invalid response format: {json_line}")
-                        raise ValueError(f"Invalid response format: {json_line}")
-                    generated_text += json_line['response']
-                except json.JSONDecodeError:
-                    logging.error(f"Error decoding JSON from line: {line}")
-                    return jsonify({'error': 'Invalid response from AI API.'}), 500
-
-        if not generated_text.strip():
-            logging.error("No questions received from AI API.")
-            return jsonify({'error': 'No questions received from AI API.'}), 500
-
-        # Remove any additional text after the last expected question
-        end_pattern = re.compile(r'(Unit\s+\d+:.*?6\.\s*.*?\(6\s*marks\)\.)', re.DOTALL | re.IGNORECASE)
-        match = end_pattern.findall(generated_text)
-        if match:
-            generated_text = '\n'.join(match)
-        else:
-            logging.warning("Could not find the end of the expected questions. The AI output may contain extra text.")
-
-        logging.debug(f"Full generated text after trimming: {generated_text}")
-
-        # Parse generated questions
-        unit_questions = parse_generated_questions(generated_text, units)
-
-        # Validate the number of questions per unit
-        insufficient_units = []
-        for unit, questions in unit_questions.items():
-            num_four_mark = len(questions['4'])
-            num_six_mark = len(questions['6'])
-            total_questions = num_four_mark + num_six_mark
-            if total_questions != 6 or num_four_mark != 3 or num_six_mark != 3:
-                insufficient_units.append(unit)
-                logging.error(f"Unit '{unit}' has {num_four_mark} four-mark questions and {num_six_mark} six-mark questions.")
-
-        if insufficient_units:
-            logging.error(f"Units {insufficient_units} do not have the required number of questions.")
-            return jsonify({
-                'error': f"Units {insufficient_units} do not have the required number of questions."
-            }), 500
-
-        logging.info("All questions have been successfully generated and assigned to units.")
-
-        # Clear existing questions and store new ones
-        clear_questions()
-        store_questions(unit_questions)
-
-        return jsonify({"message": "Questions generated and stored successfully.", "units": list(unit_questions.keys())}), 200
+        # Stream the upload into content-addressed storage; identical files share one blob
+        filename = secure_filename(syllabus_file.filename) or 'syllabus.pdf'
+        try:
+            upload = store_upload(syllabus_file.stream, filename)
+        except UploadError as e:
+            return jsonify({'error': str(e)}), 400
+        logging.info(f"Syllabus file saved to: {upload.path}")
+
+        # Hand the rest of the pipeline to the background job queue
+        # 'fresh' skips the generation cache when new questions are wanted for the same syllabus
+        bypass_cache = request.values.get('fresh', '').lower() in ('1', 'true', 'yes', 'on')
+        mode = request.values.get('mode', GENERATION_MODE)
+        if mode not in GENERATION_MODES:
+            return jsonify({'error': f"Unknown generation mode '{mode}'."}), 400
+        course = request.values.get('course', '').strip() or DEFAULT_COURSE
+        try:
+            blueprint = load_blueprint(request.values.get('blueprint', '').strip() or None)
+        except BlueprintError as e:
+            return jsonify({'error': str(e)}), 400
+        pipeline = run_question_generation
+        job_profile = None
+        if 'profile' in g:
+            # The pipeline runs on a job worker, so a profiled upload profiles its job as well
+            job_profile = Profile(g.profile.trigger, target='generate-questions job', request_profile=g.profile.id,
+                                  filename=upload.filename, mode=mode)
+            pipeline = job_profile.follow(run_question_generation)
+        job = job_queue.submit('generate-questions', pipeline, upload.path, bypass_cache, mode, course, blueprint,
+                               filename=upload.filename, content_hash=upload.content_hash)
+
+        response = {
+            "message": "Question generation started.",
+            "job_id": job.id,
+            "status_url": url_for('.job_status', job_id=job.id),
+            "result_url": url_for('.job_result', job_id=job.id),
+            "events_url": url_for('.job_events', job_id=job.id),
+            "upload": upload.to_dict()
+        }
+        if job_profile is not None:
+            # Available once the job has finished
+            response['profile_url'] = url_for('.profile_detail', profile_id=job_profile.id)
+        return jsonify(response), 202
+    except JobQueueFull as e:
+        logging.warning(f"Rejected generation request: {e}")
+        return jsonify({'error': 'Too many generation jobs are in progress. Please try again shortly.'}), 503
     except Exception as e:
         logging.exception("An error occurred while generating questions.")
         return jsonify({'error': 'An error occurred while processing the request.'}), 500
 
-# Function: Parse Generated Questions
-def parse_generated_questions(generated_text, units):
-    unit_questions = {unit_num: {'4': [], '6': []} for unit_num in units.keys()}
-    current_unit_number = None
-    co_number_expected = None
+# Function: Question Generation Pipeline (runs on a job worker)
+def run_question_generation(job, filepath, bypass_cache=False, mode=None, course=DEFAULT_COURSE, blueprint=None,
+                            filename=None, content_hash=None):
+    mode = mode or GENERATION_MODE
+    blueprint = blueprint or load_blueprint()
 
-    lines = generated_text.strip().splitlines()
-    question_pattern = re.compile(
-        r'^(\d+)\.\s*(.+?)\s*\[CO:(\d+)\]\s*\[BT:(\d+)\]\s*\((\d+)\s*marks\)\.?$',
-        re.IGNORECASE
+    # Every job is recorded as a generation run against its course, syllabus version and blueprint
+    # Uploads arrive already hashed; the file is only read again for paths given directly
+    content_hash = content_hash or hash_file(filepath)
+    start_run(job.id, course, filename or os.path.basename(filepath), content_hash, OLLAMA_MODEL, mode, blueprint.name)
+    try:
+        result = generate_and_store_questions(job, filepath, bypass_cache, mode, blueprint, content_hash)
+    except Exception as e:
+        fail_run(job.id, e)
+        raise
+    result['course'] = course
+    result['blueprint'] = blueprint.name
+    return result
+
+# Function: Generate, Validate and Append One Syllabus's Questions to the Bank
+def generate_and_store_questions(job, filepath, bypass_cache, mode, blueprint, content_hash=None):
+    # Extract text from PDF; pages and the unit index of a file seen before come from the page cache
+    job.set_stage('extracting_text', 0.05)
+    syllabus = extract_syllabus_from_pdf(filepath, content_hash)
+    logging.debug("Extracted syllabus text (first 500 characters): %s", syllabus.text[:500])
+
+    # Units, in syllabus order, from the syllabus index
+    job.set_stage('extracting_units', 0.1)
+    units = syllabus.unit_titles()
+    logging.info(f"Extracted units: {units}")
+
+    if not units:
+        logging.error("No units found in the syllabus text.")
+        raise GenerationError('No units found in the syllabus text.', 400)
+
+    # Unit texts without reference lists, page numbers and running headers, packed into each prompt's token budget
+    source = prepare_syllabus(syllabus)
+    if mode == 'per-unit':
+        unit_questions, cache_targets = generate_questions_per_unit(job, source, units, bypass_cache, blueprint)
+    else:
+        unit_questions, cache_targets = generate_questions_single(job, source, units, bypass_cache, blueprint)
+
+    # Keep every valid unit and re-prompt only for the missing (unit, marks) slots
+    repair_attempts = repair_unit_questions(job, source, units, unit_questions, blueprint)
+
+    # Validate the number of questions per unit
+    job.set_stage('validating', 0.85)
+    insufficient_units = find_insufficient_units(unit_questions, blueprint)
+
+    if insufficient_units:
+        logging.error(f"Units {insufficient_units} do not have the required number of questions.")
+        raise GenerationError(f"Units {insufficient_units} do not have the required number of questions.")
+
+    logging.info("All questions have been successfully generated and assigned to units.")
+
+    # Append to the bank; questions already stored for this syllabus version are skipped
+    job.set_stage('storing', 0.9)
+    new_questions = store_questions(unit_questions, run_id=job.id)
+
+    # Cache the validated (and possibly repaired) questions in the canonical output format
+    for cache_key, unit_numbers in cache_targets:
+        cached_units = {unit_number: units[unit_number] for unit_number in unit_numbers}
+        generation_cache.put(cache_key, OLLAMA_MODEL, format_generated_questions(unit_questions, cached_units, blueprint))
+
+    return {
+        "message": "Questions generated and stored successfully.",
+        "units": list(unit_questions.keys()),
+        "run_id": job.id,
+        "new_questions": new_questions,
+        "mode": mode,
+        "cached": not cache_targets,
+        "repair_attempts": repair_attempts
+    }
+
+# Function: Generate All Units with a Single Prompt
+def generate_questions_single(job, source, units, bypass_cache, blueprint):
+    # Prepare the units list for the prompt
+    units_text = '\n'.join(units.keys())  # Only unit numbers (e.g., 'Unit 1', 'Unit 2', etc.)
+
+    # Construct prompt for AI
+    system_prompt = build_system_prompt(blueprint)
+    plan = build_prompt(system_prompt, units_text, source.unit_texts, len(units) * sum(blueprint.generate.values()), source.preamble)
+    logging.debug("Constructed prompt for AI model: %s", plan.to_dict())
+
+    # Reuse a previous generation for identical inputs unless fresh questions were requested
+    cache_key = make_cache_key(OLLAMA_MODEL, system_prompt, units_text, plan.text, plan.options)
+    generated_text = lookup_cached_generation(cache_key, bypass_cache)
+    cache_targets = []
+
+    if generated_text is not None:
+        job.set_stage('parsing', 0.8)
+        return parse_cached_generation(job, generated_text, units, blueprint), cache_targets
+
+    # Questions are parsed as tokens stream in; the stream stops once every quota is filled
+    job.set_stage('generating', 0.15)
+    parser = job_stream_parser(job, units, unit_quotas(units, blueprint), blueprint)
+    request_generation(plan.prompt, parser=parser, on_records=lambda records: report_questions(job, parser, records),
+                       options=plan.options)
+    cache_targets.append((cache_key, list(units.keys())))
+    return parser.result(), cache_targets
+
+# Function: Generate Each Unit Concurrently with Its Own Smaller Prompt
+def generate_questions_per_unit(job, source, units, bypass_cache, blueprint):
+    job.set_stage('generating', 0.15)
+    unit_texts = source.unit_texts
+    results = {}
+    completed = 0
+
+    with ThreadPoolExecutor(max_workers=UNIT_CONCURRENCY, thread_name_prefix='qpg-unit') as executor:
+        futures = {
+            executor.submit(generate_unit_questions, job, unit_number, units[unit_number], unit_texts[unit_number], bypass_cache, blueprint): unit_number
+            for unit_number in units
+        }
+        for future in as_completed(futures):
+            unit_number = futures[future]
+            results[unit_number] = future.result()
+            completed += 1
+            job.set_progress(0.15 + 0.65 * completed / len(units))
+            logging.info(f"Finished generation for {unit_number} ({completed}/{len(units)}).")
+
+    # Merge per-unit results back into the usual structure, in syllabus order
+    job.set_stage('parsing', 0.8)
+    unit_questions = {}
+    cache_targets = []
+    for unit_number in units:
+        questions, cache_key = results[unit_number]
+        unit_questions[units[unit_number]] = questions
+        if cache_key:
+            cache_targets.append((cache_key, [unit_number]))
+    return unit_questions, cache_targets
+
+# Function: Generate Questions for One Unit, Retrying Only This Unit if the Request Fails
+def generate_unit_questions(job, unit_number, unit_title, unit_text, bypass_cache, blueprint):
+    unit = {unit_number: unit_title}
+    system_prompt = build_system_prompt(blueprint)
+    plan = build_prompt(system_prompt, unit_number, {unit_number: unit_text}, sum(blueprint.generate.values()))
+    cache_key = make_cache_key(OLLAMA_MODEL, system_prompt, unit_number, plan.text, plan.options)
+
+    generated_text = lookup_cached_generation(cache_key, bypass_cache)
+    if generated_text is not None:
+        return parse_cached_generation(job, generated_text, unit, blueprint)[unit_title], None
+
+    for attempt in range(1, UNIT_RETRIES + 2):
+        parser = job_stream_parser(job, unit, unit_quotas(unit, blueprint), blueprint)
+        try:
+            request_generation(plan.prompt, timeout=UNIT_TIMEOUT, parser=parser,
+                               on_records=lambda records: report_questions(job, parser, records), options=plan.options)
+        except GenerationError as e:
+            logging.warning(f"Generation for {unit_number} failed on attempt {attempt}: {e.message}")
+            # The failed attempt's questions were already streamed; clients drop them before the retry's arrive
+            job.emit('unit_reset', {'unit': unit_number, 'title': unit_title, 'attempt': attempt})
+            continue
+        # A short unit is returned as-is; the repair loop fills only its missing slots
+        return parser.result()[unit_title], cache_key
+
+    raise GenerationError(f"Failed to generate questions for {unit_number} from AI API.")
+
+# Function: Re-Prompt Only for Missing (Unit, Marks) Slots Until Valid or Out of Budget
+def repair_unit_questions(job, source, units, unit_questions, blueprint):
+    trim_excess_questions(unit_questions, blueprint)
+    attempts = 0
+
+    while attempts < REPAIR_RETRIES:
+        missing_slots = find_missing_slots(unit_questions, units, blueprint)
+        if not missing_slots:
+            break
+        attempts += 1
+        job.set_stage('repairing', 0.8)
+        logging.info(f"Repair attempt {attempts}/{REPAIR_RETRIES} for missing slots: {missing_slots}")
+        job.emit('warning', {'message': f"Requesting missing questions (attempt {attempts}/{REPAIR_RETRIES}).", 'missing': missing_slots})
+
+        plan = build_repair_prompt(missing_slots, unit_questions, units, source, blueprint)
+        repair_units = {unit_number: units[unit_number] for unit_number in missing_slots}
+        parser = job_stream_parser(job, repair_units, missing_slots, blueprint)
+        try:
+            request_generation(plan.prompt, timeout=UNIT_TIMEOUT, parser=parser,
+                               on_records=lambda records: report_questions(job, parser, records), options=plan.options)
+        except GenerationError as e:
+            logging.warning(f"Repair attempt {attempts} failed: {e.message}")
+            continue
+
+        repaired = parser.result()
+        for unit_number, slots in missing_slots.items():
+            unit_title = units[unit_number]
+            for marks, needed in slots.items():
+                unit_questions[unit_title][marks].extend(repaired[unit_title][marks][:needed])
+
+    return attempts
+
+# Function: Drop Questions Beyond the Required Count (the first valid ones are kept)
+def trim_excess_questions(unit_questions, blueprint):
+    for unit, questions in unit_questions.items():
+        for marks, required in blueprint.generate.items():
+            if len(questions[marks]) > required:
+                logging.warning(f"Unit '{unit}' has {len(questions[marks])} {marks}-mark questions; keeping the first {required}.")
+                del questions[marks][required:]
+
+# Function: Count the Questions Still Needed per Unit and Marks (the shortfall against the blueprint)
+def find_missing_slots(unit_questions, units, blueprint):
+    missing_slots = {}
+    for unit_number, unit_title in units.items():
+        questions = unit_questions[unit_title]
+        slots = {
+            marks: required - len(questions[marks])
+            for marks, required in blueprint.generate.items()
+            if len(questions[marks]) < required
+        }
+        if slots:
+            missing_slots[unit_number] = slots
+    return missing_slots
+
+# Function: Build the Follow-Up Prompt for Missing Slots
+def build_repair_prompt(missing_slots, unit_questions, units, source, blueprint):
+    requests_text = []
+    context_texts = {}
+    for unit_number, slots in missing_slots.items():
+        wanted = ' and '.join(f"{count} {marks}-mark question(s)" for marks, count in slots.items())
+        requests_text.append(f"{unit_number}: {wanted}")
+        existing = [
+            question['text']
+            for questions in unit_questions[units[unit_number]].values()
+            for question in questions
+        ]
+        context_text = []
+        if existing:
+            context_text.append(f"Existing questions for {unit_number} (do not repeat):\n" + '\n'.join(f"- {text}" for text in existing))
+        context_text.append(source.unit_texts[unit_number])
+        context_texts[unit_number] = '\n\n'.join(context_text)
+
+    repair_prompt = REPAIR_PROMPT_TEMPLATE.format(format_lines='\n'.join(
+        f"{number}. Question text [CO:X] [BT:Y] ({marks} marks)." for number, marks in enumerate(blueprint.marks, start=1)
+    ))
+    questions = sum(count for slots in missing_slots.values() for count in slots.values())
+    # If the budget is tight, unit text is cut from the end; the existing questions come first and are kept
+    return build_prompt(repair_prompt, '\n'.join(requests_text), context_texts, questions, separator='\n\n')
+
+# Function: Format Parsed Questions Back into the Model's Output Format
+def format_generated_questions(unit_questions, units, blueprint):
+    lines = []
+    for unit_number, unit_title in units.items():
+        lines.append(f"{unit_number}:")
+        question_number = 1
+        for marks in blueprint.marks:
+            for question in unit_questions[unit_title][marks]:
+                lines.append(f"{question_number}. {question['text']} ({marks} marks).")
+                question_number += 1
+    return '\n'.join(lines)
+
+# Function: Look Up a Cached Generation Unless the Cache Is Bypassed
+def lookup_cached_generation(cache_key, bypass_cache):
+    if bypass_cache:
+        generation_cache.record_bypass()
+        return None
+    return generation_cache.get(cache_key)
+
+# Function: Find Units Without Exactly the Blueprint's Question Count for Each Marks Value
+def find_insufficient_units(unit_questions, blueprint):
+    insufficient_units = []
+    for unit, questions in unit_questions.items():
+        counts = {marks: len(questions[marks]) for marks in blueprint.marks}
+        if counts != blueprint.generate:
+            insufficient_units.append(unit)
+            logging.error(f"Unit '{unit}' has {counts} questions per marks value; the blueprint requires {blueprint.generate}.")
+    return insufficient_units
+
+# Function: Send a Prompt to the AI API and Stream the Response into a Parser
+def request_generation(prompt, timeout=None, parser=None, on_records=None, options=None):
+    # Collect AI response; chunks are joined once at the end instead of growing a string
+    chunks = []
+    deadline = time.monotonic() + timeout if timeout else None
+    started = time.perf_counter()
+    first_token_at = None
+    prompt_tokens = None
+    outcome = 'failed'
+    try:
+        with ollama_client.stream_generate(prompt, options=options) as response:
+            logging.info(f"AI API response status: {response.status_code}")
+
+            if response.status_code != 200:
+                logging.error(f"AI API returned non-200 status code: {response.status_code}")
+                raise GenerationError('Failed to generate questions from AI API.')
+
+            for line in response.iter_lines():
+                if deadline and time.monotonic() > deadline:
+                    logging.error(f"AI API generation exceeded {timeout} seconds; aborting.")
+                    raise GenerationError('Timed out waiting for the AI API.')
+                if line:
+                    try:
+                        json_line = json.loads(line)
+                        if log_stream_line():
+                            logging.debug("Received line from AI API (1 in %d): %s", log_stream_line.every, json_line)
+                        if json_line.get('done'):
+                            prompt_tokens = json_line.get('prompt_eval_count')
+                            break
+                        if 'response' not in json_line:
+                            logging.error(f"Invalid response format: {json_line}")
+                            raise ValueError(f"Invalid response format: {json_line}")
+                        chunks.append(json_line['response'])
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                            OLLAMA_FIRST_TOKEN_SECONDS.observe(first_token_at - started)
+                    except json.JSONDecodeError:
+                        logging.error(f"Error decoding JSON from line: {line}")
+                        raise GenerationError('Invalid response from AI API.')
+
+                    if parser is not None:
+                        records = parser.feed(json_line['response'])
+                        if records and on_records:
+                            on_records(records)
+                        # Closing the response cancels the generation upstream
+                        if parser.is_complete():
+                            logging.info("All question quotas are filled; closing the AI API stream early.")
+                            outcome = 'stopped_early'
+                            break
+                        if parser.is_off_format():
+                            logging.warning("AI output is off-format; closing the AI API stream early.")
+                            outcome = 'off_format'
+                            break
+        if outcome == 'failed':
+            outcome = 'done'
+    except OllamaUnavailable as e:
+        logging.error(str(e))
+        raise GenerationError('The AI API is unavailable. Please try again later.', 503)
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        # requests surfaces streaming read timeouts as connection errors
+        logging.error("AI API stream stalled or was interrupted.")
+        raise GenerationError('The AI API stream was interrupted or timed out.')
+    finally:
+        record_generation_metrics(started, first_token_at, len(chunks), prompt_tokens, outcome)
+
+    if parser is not None:
+        records = parser.close()
+        if records and on_records:
+            on_records(records)
+
+    generated_text = ''.join(chunks)
+    if not generated_text.strip():
+        logging.error("No questions received from AI API.")
+        raise GenerationError('No questions received from AI API.')
+
+    return generated_text
+
+# Function: Record Latency and Token Throughput of One Ollama Generation
+# Each streamed chunk carries one token; prompt tokens are only known when Ollama sends its final line
+def record_generation_metrics(started, first_token_at, tokens, prompt_tokens, outcome):
+    finished = time.perf_counter()
+    OLLAMA_GENERATIONS.observe(finished - started, outcome=outcome)
+    OLLAMA_TOKENS.inc(tokens, kind='generated')
+    if prompt_tokens:
+        OLLAMA_TOKENS.inc(prompt_tokens, kind='prompt')
+    if first_token_at is not None and tokens > 1 and finished > first_token_at:
+        OLLAMA_TOKENS_PER_SECOND.observe((tokens - 1) / (finished - first_token_at))
+
+# Function: Build a Stream Parser That Reports Validation Warnings to the Job
+def job_stream_parser(job, units, quotas, blueprint):
+    return QuestionStreamParser(units, quotas, on_warning=lambda message: job.emit('warning', {'message': message}), marks=blueprint.marks)
+
+# Function: Report Parsed Questions and Completed Units to the Job's Event Stream
+def report_questions(job, parser, records):
+    for record in records:
+        job.emit('question', record)
+        if parser.is_unit_complete(record['unit']):
+            job.emit('unit_complete', {'unit': record['unit'], 'title': record['title']})
+
+# Function: Parse a Cached Generation, Reporting Its Questions Like a Live Stream
+def parse_cached_generation(job, generated_text, units, blueprint):
+    parser = job_stream_parser(job, units, unit_quotas(units, blueprint), blueprint)
+    report_questions(job, parser, parser.feed(generated_text.strip()) + parser.close())
+    return parser.result()
+
+# Function: Per-Unit Question Quotas for the Stream Parser
+def unit_quotas(units, blueprint):
+    return {unit_number: dict(blueprint.generate) for unit_number in units}
+
+# Function: System Prompt Asking for the Blueprint's Questions per Unit
+def build_system_prompt(blueprint):
+    quotas = []
+    format_lines = []
+    for marks, count in blueprint.generate.items():
+        marks_word = MARKS_WORDS[int(marks)] if int(marks) < len(MARKS_WORDS) else marks
+        quotas.append(f"{count} {marks_word}-mark question{'s' if count != 1 else ''}")
+        for _ in range(count):
+            format_lines.append(f"{len(format_lines) + 1}. Question text [CO:X] [BT:Y] ({marks} marks).")
+    quota_text = quotas[0] if len(quotas) == 1 else f"{', '.join(quotas[:-1])} and {quotas[-1]}"
+    return SYSTEM_PROMPT_TEMPLATE.format(
+        question_total=len(format_lines),
+        quota_text=quota_text,
+        format_lines='\n'.join(format_lines)
     )
 
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue  # Skip empty lines
-
-        # Detect unit titles in the AI-generated text (e.g., 'Unit 1:')
-        if re.match(r'^Unit\s+\d+:$', line, re.IGNORECASE):
-            unit_number = line.split(':')[0].strip()
-            if unit_number in units:
-                current_unit_number = unit_number
-                co_number_expected = int(re.search(r'\d+', unit_number).group())
-                logging.debug(f"Detected current unit: {current_unit_number}, expected CO number: {co_number_expected}")
-            else:
-                logging.warning(f"Unknown unit detected: {unit_number}")
-            continue  # Skip unit titles
-
-        if not current_unit_number:
-            logging.warning(f"Question found before any unit title: {line}")
-            continue  # Skip questions before any unit is detected
-
-        # Extract question and marks using regex
-        match = question_pattern.match(line)
-        if match:
-            question_number = int(match.group(1).strip())
-            question_text = match.group(2).strip()
-            co_number = int(match.group(3).strip())
-            bt_number = int(match.group(4).strip())
-            marks = match.group(5).strip()
-            if marks in ['4', '6']:
-                if co_number != co_number_expected:
-                    logging.warning(f"CO number {co_number} does not match expected CO number {co_number_expected} for unit {current_unit_number}")
-                    continue  # Skip questions with incorrect CO numbers
-                if not (1 <= bt_number <= 6):
-                    logging.warning(f"BT number {bt_number} is out of expected range (1-6)")
-                    continue  # Skip questions with invalid BT numbers
-                # Include CO and BT in the question text
-                question_text_with_co_bt = f"{question_text} [CO:{co_number}] [BT:{bt_number}]"
-                question_data = {'text': question_text_with_co_bt, 'marks': marks}
-                unit_questions[current_unit_number][marks].append(question_data)
-                logging.debug(f"Parsed question {question_number} for {current_unit_number}: {question_text_with_co_bt} ({marks} marks)")
-            else:
-                logging.warning(f"Unexpected marks value: {marks} in line: {line}")
-        else:
-            logging.warning(f"Line does not match expected question format: {line}")
-
-    # Map unit numbers back to full unit titles
-    mapped_unit_questions = {}
-    for unit_number, questions in unit_questions.items():
-        full_title = units[unit_number]
-        mapped_unit_questions[full_title] = questions
-
-    return mapped_unit_questions
-
-# Function: Extract Units from Syllabus Text
-def extract_units_from_text(syllabus_text):
-    units = {}
-    lines = syllabus_text.splitlines()
-    for line in lines:
-        line = line.strip()
-        # Detect unit lines, assuming they start with 'Unit' followed by a number
-        if re.match(r'^Unit\s+\d+.*', line, re.IGNORECASE):
-            unit_line = line.split(':')[0]  # Get 'Unit X' part
-            unit_number = unit_line.strip()
-            units[unit_number] = line.strip()  # Store the full line as the unit title
-    logging.debug(f"Units extracted from text: {units}")
-    return units
-
-# Function: Extract Text from PDF
-def extract_text_from_pdf(filepath):
+# Route: Generation Cache Statistics
+@routes.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    stats = generation_cache.stats()
+    stats['page_cache'] = page_cache.stats()
+    return jsonify(stats), 200
+
+# Route: Prometheus Metrics (text exposition format)
+@routes.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Route: Question Bank Contents (courses, syllabus versions, recent runs)
+@routes.route('/bank', methods=['GET'])
+def bank_summary():
+    return jsonify(get_bank_summary(run_limit=min(request.args.get('runs', 20, type=int), 200))), 200
+
+# Route: Apply Bank Retention Policies
+@routes.route('/bank/compact', methods=['POST'])
+def bank_compact():
     try:
-        text = ''
-        with open(filepath, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            for page_num, page in enumerate(reader.pages, start=1):
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + '\n'
-                    logging.debug(f"Extracted text from page {page_num}.")
-                else:
-                    logging.warning(f"No text found on page {page_num}.")
-        return text
+        vacuum = request.values.get('vacuum', '').lower() in ('1', 'true', 'yes', 'on')
+        return jsonify(compact_bank(vacuum=vacuum)), 200
     except Exception as e:
-        logging.exception(f"Failed to extract text from PDF: {filepath}")
-        raise
+        logging.exception("An error occurred while compacting the question bank.")
+        return jsonify({'error': 'An error occurred while compacting the question bank.'}), 500
+
+# Route: Recent Uploads and the Blob Each One Is Stored As
+@routes.route('/uploads', methods=['GET'])
+def uploads_list():
+    return jsonify({'uploads': list_uploads(limit=min(max(request.args.get('limit', 50, type=int), 1), 500))}), 200
 
-# Function: Generate PDF from Questions in Table Format
-def generate_pdf(unit_questions, filepath):
+# Route: Remove Unreferenced Upload Blobs and Stale Generated Papers
+@routes.route('/uploads/gc', methods=['POST'])
+def uploads_gc():
     try:
-        doc = SimpleDocTemplate(filepath, pagesize=letter)
-        styles = getSampleStyleSheet()
-        elements = []
-
-        # Define a custom style for main titles
-        main_title_style = ParagraphStyle(
-            name='MainTitle',
-            parent=styles['Heading1'],
-            alignment=1,  # Center alignment
-            spaceAfter=12
-        )
+        return jsonify(collect_garbage(UPLOAD_FOLDER)), 200
+    except Exception as e:
+        logging.exception("An error occurred while collecting upload garbage.")
+        return jsonify({'error': 'An error occurred while collecting upload garbage.'}), 500
+
+# Route: Near-Duplicate Question Clusters (same scope parameters as /generate-papers)
+@routes.route('/bank/duplicates', methods=['GET'])
+def bank_duplicates():
+    clusters = get_duplicate_clusters(
+        course=request.args.get('course'),
+        syllabus=request.args.get('syllabus'),
+        run_id=request.args.get('run')
+    )
+    return jsonify({'clusters': clusters, 'count': len(clusters)}), 200
 
-        # Define a custom style for table headers
-        header_style = ParagraphStyle(
-            name='TableHeader',
-            parent=styles['Normal'],
-            fontName='Helvetica-Bold',
-            fontSize=10,
-            alignment=1,  # Center alignment
-            textColor=colors.whitesmoke
-        )
+# Route: Rebuild the Near-Duplicate Index
+@routes.route('/bank/reindex', methods=['POST'])
+def bank_reindex():
+    try:
+        return jsonify(reindex_near_duplicates()), 200
+    except Exception as e:
+        logging.exception("An error occurred while rebuilding the near-duplicate index.")
+        return jsonify({'error': 'An error occurred while rebuilding the near-duplicate index.'}), 500
 
-        # Add Main Titles at the Top
-        exam_title = Paragraph("Exam Question Paper", main_title_style)
-        course_title = Paragraph("Course: Data Communications", styles['Heading2'])
-        instructor = Paragraph("Instructor: Dr. Jane Doe", styles['Normal'])
-        date = Paragraph("Date: 23-Nov-2024", styles['Normal'])
-
-        elements.extend([exam_title, course_title, instructor, date, Spacer(1, 24)])
-
-        # Define table data with headers
-        table_data = [
-            [
-                Paragraph('Question No', header_style),
-                Paragraph('Subquestion', header_style),
-                Paragraph('Question Text', header_style),
-                Paragraph('CO', header_style),
-                Paragraph('BT', header_style),
-                Paragraph('Marks', header_style)
-            ]
-        ]
+# Route: Available Paper Blueprints
+@routes.route('/blueprints', methods=['GET'])
+def blueprints_list():
+    return jsonify({'blueprints': list_blueprints(), 'default': load_blueprint().name}), 200
 
-        # Initialize question number
-        question_num = 1
-
-        for unit, questions in unit_questions.items():
-            # For each unit, select 2 questions (1 four-mark and 1 six-mark)
-            selected_questions_4 = questions['4'][:1]  # 1 four-mark question
-            selected_questions_6 = questions['6'][:1]  # 1 six-mark question
-
-            # Combine selected questions
-            selected_questions = selected_questions_4 + selected_questions_6
-
-            for idx, question in enumerate(selected_questions):
-                sub_label = chr(97 + idx)  # 'a', 'b'
-                formatted_question_num = f"{question_num}{sub_label}"
-                # Extract CO and BT from the question text
-                co_match = re.search(r'\[CO:(\d+)\]', question['text'])
-                bt_match = re.search(r'\[BT:(\d+)\]', question['text'])
-                co = co_match.group(1) if co_match else 'N/A'
-                bt = bt_match.group(1) if bt_match else 'N/A'
-
-                # Remove [CO:X] and [BT:Y] from the question text for clarity in the table
-                question_text_clean = re.sub(r'\[CO:\d+\]\s*\[BT:\d+\]', '', question['text']).strip()
-
-                # Append the row to table data
-                table_data.append([
-                    Paragraph(formatted_question_num, styles['Normal']),  # Question No (e.g., '1a')
-                    sub_label,                                          # Subquestion ('a', 'b')
-                    Paragraph(question_text_clean, styles['Normal']),
-                    str(co),
-                    str(bt),
-                    str(question['marks'])
-                ])
-
-            # Add a blank row after each unit for differentiation
-            table_data.append(['', '', '', '', '', ''])
-
-            question_num += 1  # Increment main question number for next unit
-
-        # Define column widths
-        col_widths = [80, 60, 300, 40, 40, 40]
-
-        # Create the table
-        table = Table(table_data, colWidths=col_widths, repeatRows=1)
-
-        # Add table style
-        table_style = TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-
-            ('GRID', (0,0), (-1,-1), 1, colors.black),
-        ])
-        table.setStyle(table_style)
-
-        # Alternate row colors (starting from the first data row)
-        for i in range(1, len(table_data)):
-            # Skip blank rows
-            if all(cell == '' for cell in table_data[i]):
-                continue
-            elif i % 7 == 0:
-                # Every 7th row is a blank row; skip coloring
-                continue
-            elif i % 2 == 0:
-                bg_color = colors.lightgrey
-            else:
-                bg_color = colors.whitesmoke
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, i), (-1, i), bg_color)
-            ]))
-
-        elements.append(table)
-        elements.append(Spacer(1, 24))  # Space after the table
-
-        # Build the PDF
-        doc.build(elements)
-        logging.debug(f"PDF generated at: {filepath}")
+# Route: One Blueprint's Definition
+@routes.route('/blueprints/<name>', methods=['GET'])
+def blueprint_detail(name):
+    try:
+        return jsonify(load_blueprint(name).to_dict()), 200
+    except BlueprintError as e:
+        return jsonify({'error': str(e)}), 404
+
+# Route: Create or Replace a Blueprint (stored in the question bank)
+@routes.route('/blueprints/<name>', methods=['PUT'])
+def blueprint_save(name):
+    definition = request.get_json(silent=True)
+    if definition is None:
+        return jsonify({'error': 'Send the blueprint as a JSON object.'}), 400
+    try:
+        return jsonify(save_blueprint(name, definition).to_dict()), 200
+    except BlueprintError as e:
+        return jsonify({'error': str(e)}), 400
+
+# Route: Ollama Backend Health
+@routes.route('/ollama/status', methods=['GET'])
+def ollama_status():
+    backends = ollama_client.check_health()
+    status_code = 200 if any(backend['healthy'] for backend in backends) else 503
+    return jsonify({'model': ollama_client.model, 'options': ollama_client.options, 'backends': backends}), status_code
+
+# The /profiles endpoints need the admin token; without a configured token they do not exist
+def _profiles_access_denied():
+    if not PROFILE_TOKEN:
+        return jsonify({'error': 'Not found.'}), 404
+    if not profile_access_allowed(request.headers, request.args):
+        return jsonify({'error': 'A valid profiling token is required.'}), 403
+    return None
+
+# Route: Captured Profiles, Newest First
+@routes.route('/profiles', methods=['GET'])
+def profiles_list():
+    denied = _profiles_access_denied()
+    if denied:
+        return denied
+    return jsonify({'profiles': list_profiles(limit=min(max(request.args.get('limit', 50, type=int), 1), 500))}), 200
+
+# Route: Compare Two Profiles (?base=<id>&other=<id>)
+@routes.route('/profiles/compare', methods=['GET'])
+def profiles_compare():
+    denied = _profiles_access_denied()
+    if denied:
+        return denied
+    try:
+        return jsonify(compare_profiles(request.args.get('base'), request.args.get('other'))), 200
+    except ProfileNotFound as e:
+        return jsonify({'error': str(e)}), 404
+
+# Route: Profile Summary (top functions, allocation sites, job stage timings)
+@routes.route('/profiles/<profile_id>', methods=['GET'])
+def profile_detail(profile_id):
+    denied = _profiles_access_denied()
+    if denied:
+        return denied
+    try:
+        return jsonify(load_profile(profile_id)), 200
+    except ProfileNotFound as e:
+        return jsonify({'error': str(e)}), 404
+
+# Route: Download a Profile: ?kind=cpu (pstats file, the default) or ?kind=memory (tracemalloc snapshot)
+@routes.route('/profiles/<profile_id>/download', methods=['GET'])
+def profile_download(profile_id):
+    denied = _profiles_access_denied()
+    if denied:
+        return denied
+    kind = request.args.get('kind', 'cpu')
+    if kind not in ('cpu', 'memory'):
+        return jsonify({'error': f"Unknown profile kind '{kind}'."}), 400
+    try:
+        path = os.path.abspath(profile_path(profile_id, kind))
+    except ProfileNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    if not os.path.exists(path):
+        return jsonify({'error': f"No profile '{profile_id}'."}), 404
+    return send_from_directory(os.path.dirname(path), os.path.basename(path), as_attachment=True)
+
+# Route: Job Status
+@routes.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    return jsonify(job.to_dict()), 200
+
+# Route: Job Event Stream (Server-Sent Events)
+@routes.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+
+    # Reconnecting EventSource clients resume after the last event they saw
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        last_event_id = 0
+
+    def stream():
+        sent = last_event_id
+        while True:
+            events, finished = job.wait_for_events(sent, timeout=SSE_KEEPALIVE_SECONDS)
+            for event_id, event, data in events:
+                yield f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+                sent = event_id
+            if finished and not events:
+                break
+            if not events:
+                yield ": keep-alive\n\n"
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Stop reverse proxies from buffering the stream
+    })
+
+# Route: Job Result
+@routes.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    if job.status == 'failed':
+        return jsonify({'error': job.error, 'job_id': job.id}), job.error_status or 500
+    if job.status != 'succeeded':
+        # Not finished yet: point the client back at the status endpoint
+        return jsonify(job.to_dict()), 202
+    return jsonify(job.result), 200
+
+# Function: SHA-256 of a File, Read in Blocks
+def hash_file(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(64 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Function: Extract and Index a Syllabus PDF (pages are streamed, cached by content hash and split across processes when large)
+def extract_syllabus_from_pdf(filepath, content_hash=None):
+    try:
+        return load_syllabus(filepath, content_hash)
     except Exception as e:
-        logging.exception(f"Failed to generate PDF: {filepath}")
+        logging.exception(f"Failed to extract text from PDF: {filepath}")
         raise
 
 # Route: Generate Question Papers
-@app.route('/generate-papers', methods=['GET'])
+@routes.route('/generate-papers', methods=['GET'])
 def generate_papers():
     try:
         logging.info("Received request to generate question papers.")
-        unit_questions = get_all_questions_by_unit()
-
-        # Verify that each unit has at least 6 questions
-        insufficient_units = []
-        for unit, questions in unit_questions.items():
-            total_questions = len(questions['4']) + len(questions['6'])
-            if total_questions < 6:
-                insufficient_units.append(unit)
-
-        if insufficient_units:
-            logging.error(f"Units {insufficient_units} do not have enough questions to generate papers.")
-            return jsonify({'error': f"Units {insufficient_units} do not have enough questions to generate papers."}), 500
-
+        # Scope: ?run= for one generation run, else ?course= (and ?syllabus= version); defaults to the latest run's syllabus
+        scope = {
+            'course': request.args.get('course'),
+            'syllabus': request.args.get('syllabus'),
+            'run_id': request.args.get('run')
+        }
+        scope_info = describe_scope(**scope)
+        if scope_info is None:
+            return jsonify({'error': 'No questions are stored for this course. Generate questions first.'}), 404
+
+        # The paper follows ?blueprint=, else the blueprint the scope's questions were generated for
+        try:
+            blueprint = load_blueprint(request.args.get('blueprint') or scope_info['blueprint'])
+            if request.args.get('per_unit'):
+                blueprint = blueprint.with_per_unit(PaperConstraints.from_args(request.args).per_unit)
+            constraints = PaperConstraints.from_args(request.args, per_unit=blueprint.paper_per_unit)
+        except (BlueprintError, AssemblyError) as e:
+            return jsonify({'error': str(e)}), 400
+
+        unit_questions = get_questions_by_unit(**scope, marks=constraints.marks)
+        if not unit_questions:
+            return jsonify({'error': 'No questions are stored for this course. Generate questions first.'}), 404
+        blueprint_problems = blueprint.check_units(len(unit_questions))
+        if blueprint_problems:
+            return jsonify({'error': '; '.join(blueprint_problems)}), 422
+
+        num_papers = min(max(request.args.get('count', 3, type=int), 1), MAX_PAPERS)  # Number of question papers to generate
+        try:
+            variants, stats = assemble_papers(unit_questions, num_papers, constraints, seed=request.args.get('seed'))
+        except AssemblyError as e:
+            logging.error(f"Could not assemble {num_papers} question papers: {e}")
+            return jsonify({'error': f"Could not assemble {num_papers} question papers: {e}"}), 422
+        logging.info(f"Assembled {num_papers} question papers: {stats}")
+
+        # Each request renders into its own paper set, so concurrent requests cannot overwrite each other's papers
+        paper_set, paper_dir = create_paper_set()
         papers = []
-        num_papers = 3  # Number of question papers to generate
-
-        # For each unit and marks, shuffle the questions
-        shuffled_unit_questions = {}
-        for unit, marks in unit_questions.items():
-            shuffled_unit_questions[unit] = {
-                '4': random.sample(marks['4'], len(marks['4'])),
-                '6': random.sample(marks['6'], len(marks['6']))
-            }
-            logging.debug(f"Shuffled questions for {unit}: {shuffled_unit_questions[unit]}")
-
-        # Assign questions to papers
-        for paper_num in range(1, num_papers + 1):
-            paper_questions = {}
-            logging.info(f"Generating paper {paper_num}.")
-
-            for unit, marks in shuffled_unit_questions.items():
-                # Select 1 four-mark and 1 six-mark question per unit
-                q4 = marks['4'][0]  # Select the first four-mark question
-                q6 = marks['6'][0]  # Select the first six-mark question
-
-                # Initialize unit in paper_questions if not already
-                if unit not in paper_questions:
-                    paper_questions[unit] = {'4': [], '6': []}
-
-                # Append questions
-                paper_questions[unit]['4'].append(q4)
-                paper_questions[unit]['6'].append(q6)
-
-                logging.debug(f"Selected questions for {unit} in paper {paper_num}: {q4['text']} (4 marks), {q6['text']} (6 marks)")
-
-            # Generate PDF with table format
+        render_jobs = []
+        for paper_num, paper_questions in enumerate(variants, start=1):
             pdf_filename = f'question_paper_{paper_num}.pdf'
-            pdf_filepath = os.path.join(UPLOAD_FOLDER, pdf_filename)
-            generate_pdf(paper_questions, pdf_filepath)
-            logging.info(f"Generated PDF for paper {paper_num}: {pdf_filepath}")
+            pdf_filepath = os.path.join(paper_dir, pdf_filename)
+            render_jobs.append((paper_questions, pdf_filepath))
             papers.append(pdf_filename)
 
+        # Generate PDFs with table format, in parallel across worker processes
+        try:
+            render_papers(render_jobs, layout=blueprint.layout(course=scope_info['course']))
+        except Exception:
+            shutil.rmtree(paper_dir, ignore_errors=True)
+            raise
+        logging.info(f"Rendered {len(render_jobs)} question papers into paper set {paper_set}.")
+
         logging.info("All question papers have been generated successfully.")
-        return jsonify({"message": "Question papers generated successfully.", "papers": papers}), 200
+        return jsonify({
+            "message": "Question papers generated successfully.",
+            "paper_set": paper_set,
+            "papers": papers,
+            "download_urls": [url_for('.download_file', paper_set=paper_set, filename=name) for name in papers],
+            "assembly": stats,
+            "blueprint": blueprint.name,
+            "bundle_url": url_for('.download_bundle', paper_set=paper_set)
+        }), 200
     except Exception as e:
         logging.exception("An error occurred while generating question papers.")
         return jsonify({'error': 'An error occurred while generating question papers.'}), 500
 
 # Route: Download Generated PDFs
-@app.route('/download/<filename>', methods=['GET'])
-def download_file(filename):
+@routes.route('/download/<paper_set>/<filename>', methods=['GET'])
+def download_file(paper_set, filename):
     try:
-        logging.info(f"Download request received for file: {filename}")
-        return send_from_directory(UPLOAD_FOLDER, filename, as_attachment=True)
+        logging.info(f"Download request received for file: {paper_set}/{filename}")
+        directory = paper_set_dir(paper_set)
+        if directory is None or not PAPER_FILENAME_PATTERN.match(filename):
+            return jsonify({'error': 'File not found or an error occurred while downloading.'}), 404
+        # Clients revalidate (ETag/Last-Modified) and may resume with Range
+        return send_from_directory(os.path.abspath(directory), filename, as_attachment=True, conditional=True, etag=True, max_age=0)
+    except RequestedRangeNotSatisfiable:
+        raise
     except Exception as e:
         logging.exception(f"An error occurred while trying to download the file: {filename}")
         return jsonify({'error': 'File not found or an error occurred while downloading.'}), 404
 
-# Initialize Database Before Running the App
+# Route: Download a Whole Paper Set as One Streamed ZIP
+@routes.route('/download-bundle/<paper_set>', methods=['GET'])
+def download_bundle(paper_set):
+    directory = paper_set_dir(paper_set)
+    if directory is None:
+        return jsonify({'error': f"No paper set '{paper_set}'."}), 404
+    requested = request.args.get('papers')
+    if requested:
+        filenames = [secure_filename(name) for name in requested.split(',') if name.strip()]
+        if not all(PAPER_FILENAME_PATTERN.match(name) for name in filenames):
+            return jsonify({'error': 'Only generated question papers can be bundled.'}), 400
+    else:
+        # Default to the whole set, in paper order
+        filenames = sorted(
+            (name for name in os.listdir(directory) if PAPER_FILENAME_PATTERN.match(name)),
+            key=lambda name: int(PAPER_FILENAME_PATTERN.match(name).group(1))
+        )
+
+    paths = [os.path.join(directory, name) for name in dict.fromkeys(filenames)]
+    missing = [os.path.basename(path) for path in paths if not os.path.isfile(path)]
+    if not paths or missing:
+        return jsonify({'error': f"Question papers not found: {missing}" if missing else 'No question papers have been generated.'}), 404
+
+    logging.info(f"Streaming bundle of {len(paths)} question papers.")
+    response = Response(stream_zip(paths), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename=question_papers.zip'
+    response.cache_control.no_cache = True
+    response.set_etag(bundle_etag(paths), weak=True)
+    response.last_modified = bundle_last_modified(paths)
+    # The archive is built on the fly, so its length is unknown and ranges are not offered
+    return response.make_conditional(request, accept_ranges=False)
+
+# Function: Startup Work, Safe to Run in Every Worker Process
+# Schema migrations take the database write lock (init_db); maintenance is claimed by one process per interval
+def startup():
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    init_db()
+    job_queue.recover()
+    if claim_periodic_task(JOBS_DATABASE, 'startup_maintenance', MAINTENANCE_INTERVAL):
+        compact_bank()
+        collect_garbage(UPLOAD_FOLDER)
+
+# Function: Application Factory
+# 'config' overrides Flask settings; run_startup=False skips startup() when the runner has already done it
+def create_app(config=None, run_startup=True):
+    # Levels come from QPG_LOG_LEVEL / QPG_LOG_LEVELS (log_config)
+    configure_logging()
+    app = Flask(__name__)
+    CORS(app)
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    app.config.update(config or {})
+    app.register_blueprint(routes)
+    if run_startup:
+        startup()
+    return app
+
+# Development Server: one process, with the debugger when QPG_DEBUG=1. Production runs serve.py or wsgi:app
 if __name__ == '__main__':
-    init_db()  # Initialize the database when the app starts
-    app.run(debug=True)
+    create_app().run(debug=os.environ.get('QPG_DEBUG', '0') == '1')
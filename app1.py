@@ -1,5 +1,5 @@
 from flask import Flask, request, jsonify, render_template, send_from_directory
-import requests
+from ollama_client import ollama_client
 from werkzeug.utils import secure_filename
 import os
 import PyPDF2
@@ -32,7 +32,8 @@ UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-DATABASE = 'data/questions.db'
+# Prototype schema; kept apart from the normalized question bank in data/questions.db
+DATABASE = 'data/prototype_questions.db'
 
 def init_db():
     os.makedirs('data', exist_ok=True)
@@ -40,10 +41,8 @@ def init_db():
     conn = sqlite3.connect(DATABASE)
     cursor = conn.cursor()
 
-    cursor.execute('DROP TABLE IF EXISTS questions')
-    
     cursor.execute('''
-        CREATE TABLE questions (
+        CREATE TABLE IF NOT EXISTS questions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             unit TEXT NOT NULL,
             question TEXT NOT NULL,
@@ -117,30 +116,25 @@ def generate_questions():
         prompt = f"{SYSTEM_PROMPT}\n\nBase prompt: {base_prompt}\n\nText: {syllabus_text}"
         logging.debug(f"Sending prompt to API: {prompt}")
 
-        response = requests.post(
-            'http://localhost:11434/api/generate',
-            json={"model": "llama3.1", "prompt": prompt},
-            stream=True
-        )
-
-        logging.debug(f"API response status: {response.status_code}")
-
-        generated_questions = []
-        current_question = []
-
-        for line in response.iter_lines():
-            if line:
-                try:
-                    json_line = json.loads(line)
-                    logging.debug(f"Received line: {json_line}")
-                    if json_line.get('done'):
-                        break
-                    if 'response' not in json_line:
-                        raise ValueError(f"Invalid response format: {json_line}")
-                    current_question.append(json_line['response'])
-                except json.JSONDecodeError:
-                    logging.error(f"Error decoding JSON from line: {line}")
-                    return jsonify({'error': 'Invalid response from API.'}), 500
+        with ollama_client.stream_generate(prompt, model="llama3.1") as response:
+            logging.debug(f"API response status: {response.status_code}")
+
+            generated_questions = []
+            current_question = []
+
+            for line in response.iter_lines():
+                if line:
+                    try:
+                        json_line = json.loads(line)
+                        logging.debug(f"Received line: {json_line}")
+                        if json_line.get('done'):
+                            break
+                        if 'response' not in json_line:
+                            raise ValueError(f"Invalid response format: {json_line}")
+                        current_question.append(json_line['response'])
+                    except json.JSONDecodeError:
+                        logging.error(f"Error decoding JSON from line: {line}")
+                        return jsonify({'error': 'Invalid response from API.'}), 500
 
         if current_question:
             full_questions = ''.join(current_question).strip()
@@ -1,5 +1,5 @@
 from flask import Flask, request, jsonify, render_template, send_from_directory
-import requests
+from ollama_client import ollama_client
 from werkzeug.utils import secure_filename
 import os
 import PyPDF2
@@ -55,7 +55,8 @@ UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-DATABASE = 'data/questions.db'
+# Prototype schema; kept apart from the normalized question bank in data/questions.db
+DATABASE = 'data/prototype_questions.db'
 
 # Database Initialization
 def init_db():
@@ -168,34 +169,29 @@ def generate_questions():
         logging.debug("Constructed prompt for AI model.")
 
         # Send prompt to AI API
-        response = requests.post(
-            'http://localhost:11434/api/generate',
-            json={"model": "llama3.2", "prompt": prompt},
-            stream=True
-        )
-
-        logging.info(f"AI API response status: {response.status_code}")
-
-        if response.status_code != 200:
-            logging.error(f"AI API returned non-200 status code: {response.status_code}")
-            return jsonify({'error': 'Failed to generate questions from AI API.'}), 500
-
-        # Collect AI response
-        generated_text = ''
-        for line in response.iter_lines():
-            if line:
-                try:
-                    json_line = json.loads(line)
-                    logging.debug(f"Received line from AI API: {json_line}")
-                    if json_line.get('done'):
-                        break
-                    if 'response' not in json_line:
-                        logging.error(f"Invalid response format: {json_line}")
-                        raise ValueError(f"Invalid response format: {json_line}")
-                    generated_text += json_line['response']
-                except json.JSONDecodeError:
-                    logging.error(f"Error decoding JSON from line: {line}")
-                    return jsonify({'error': 'Invalid response from AI API.'}), 500
+        with ollama_client.stream_generate(prompt, model="llama3.2") as response:
+            logging.info(f"AI API response status: {response.status_code}")
+
+            if response.status_code != 200:
+                logging.error(f"AI API returned non-200 status code: {response.status_code}")
+                return jsonify({'error': 'Failed to generate questions from AI API.'}), 500
+
+            # Collect AI response
+            generated_text = ''
+            for line in response.iter_lines():
+                if line:
+                    try:
+                        json_line = json.loads(line)
+                        logging.debug(f"Received line from AI API: {json_line}")
+                        if json_line.get('done'):
+                            break
+                        if 'response' not in json_line:
+                            logging.error(f"Invalid response format: {json_line}")
+                            raise ValueError(f"Invalid response format: {json_line}")
+                        generated_text += json_line['response']
+                    except json.JSONDecodeError:
+                        logging.error(f"Error decoding JSON from line: {line}")
+                        return jsonify({'error': 'Invalid response from AI API.'}), 500
 
         if not generated_text.strip():
             logging.error("No questions received from AI API.")
@@ -0,0 +1,69 @@
+"""Benchmark paper assembly: time and overlap for many variants over pools of different sizes.
+
+Usage: python benchmarks/bench_assembly.py [--papers N] [--units N] [--pool N,N,...] [--max-overlap X] [--json PATH]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from paper_assembler import PaperConstraints, AssemblyError, assemble_papers  # noqa: E402
+
+
+def make_pool(units, per_slot, rng):
+    question_id = 0
+    unit_questions = {}
+    for unit in range(1, units + 1):
+        pools = {}
+        for marks in ('4', '6'):
+            pools[marks] = []
+            for _ in range(per_slot):
+                question_id += 1
+                pools[marks].append({
+                    'id': question_id,
+                    'text': f"Question {question_id} on topic {unit}",
+                    'co': unit,
+                    'bt': rng.randint(1, 6),
+                    'marks': int(marks)
+                })
+        unit_questions[f"Unit {unit}: Topic {unit}"] = pools
+    return unit_questions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--papers', type=int, default=50)
+    parser.add_argument('--units', type=int, default=6)
+    parser.add_argument('--pool', default='3,10,100,1000', help='Questions per unit and marks value')
+    parser.add_argument('--max-overlap', default='', help='Overlap limit passed to the assembler')
+    parser.add_argument('--json', help='Write results to this JSON file')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    constraints = PaperConstraints(max_overlap=args.max_overlap)
+    results = []
+    print(f"{'pool':>6}{'papers':>8}{'ms':>10}{'max overlap':>13}{'mean overlap':>14}{'distinct':>10}")
+    for per_slot in (int(size) for size in args.pool.split(',')):
+        unit_questions = make_pool(args.units, per_slot, rng)
+        start = time.perf_counter()
+        try:
+            _, stats = assemble_papers(unit_questions, args.papers, constraints, seed=0)
+        except AssemblyError as e:
+            print(f"{per_slot:>6}{args.papers:>8}  infeasible: {e}")
+            results.append({'pool': per_slot, 'papers': args.papers, 'error': str(e)})
+            continue
+        elapsed = round((time.perf_counter() - start) * 1000, 3)
+        results.append({'pool': per_slot, 'ms': elapsed, **stats})
+        print(f"{per_slot:>6}{args.papers:>8}{elapsed:>10}{stats['max_pairwise_overlap']:>13}"
+              f"{stats['mean_pairwise_overlap']:>14}{stats['distinct_questions']:>10}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'units': args.units, 'max_overlap': args.max_overlap, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark syllabus PDF text extraction: one pass vs. parallel page ranges vs. the page cache.
+
+Usage: python benchmarks/bench_extract.py [--pages N] [--workers N] [--pdf PATH] [--json PATH]
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, PageBreak
+from reportlab.lib.styles import getSampleStyleSheet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pdf_text  # noqa: E402
+
+
+# A scheme-book-like document: a unit heading every few pages and dense paragraphs on every page
+def make_pdf(path, pages):
+    styles = getSampleStyleSheet()
+    elements = []
+    for page in range(1, pages + 1):
+        if page % 10 == 1:
+            elements.append(Paragraph(f"Unit {page // 10 + 1}: Topic {page // 10 + 1}", styles['Heading2']))
+        for paragraph in range(6):
+            elements.append(Paragraph(
+                ' '.join(f"Concept {page}.{paragraph}.{word} covers signals, protocols and error control."
+                         for word in range(8)),
+                styles['Normal']
+            ))
+        elements.append(PageBreak())
+    SimpleDocTemplate(path, pagesize=letter).build(elements)
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return round((time.perf_counter() - start) * 1000, 1), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=120)
+    parser.add_argument('--workers', type=int, default=pdf_text.PDF_WORKERS)
+    parser.add_argument('--pdf', help='Benchmark this PDF instead of a generated one')
+    parser.add_argument('--json', help='Write results to this JSON file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.pdf or os.path.join(directory, 'syllabus.pdf')
+        if not args.pdf:
+            make_pdf(path, args.pages)
+        with open(path, 'rb') as file:
+            content_hash = hashlib.sha256(file.read()).hexdigest()
+        pdf_text.page_cache = pdf_text.PageCache(os.path.join(directory, 'page_cache.db'))
+
+        def extract(workers, use_cache):
+            return ''.join(text for _, text in pdf_text.iter_pdf_pages(path, content_hash if use_cache else None, workers))
+
+        # Start the worker pool outside the timings, as a running server would have it
+        extract(args.workers, False)
+        results = {}
+        results['serial_ms'], serial_text = timed(lambda: extract(1, False))
+        results['parallel_ms'], parallel_text = timed(lambda: extract(args.workers, False))
+        results['cold_cache_ms'], _ = timed(lambda: extract(args.workers, True))
+        results['warm_cache_ms'], cached_text = timed(lambda: extract(args.workers, True))
+        assert serial_text == parallel_text == cached_text
+        results['pages'] = pdf_text.page_cache.stats()['pages']
+        results['workers'] = args.workers
+
+    for name in ('serial_ms', 'parallel_ms', 'cold_cache_ms', 'warm_cache_ms'):
+        print(f"{name:16}{results[name]:>10}")
+    print(f"{results['pages']} pages, {results['workers']} workers")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
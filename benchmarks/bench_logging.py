@@ -0,0 +1,129 @@
+"""Benchmark the per-token streaming path under different logging setups.
+
+Replays a generation as Ollama NDJSON lines through the loop request_generation runs for each
+line (decode, log, feed the question parser) and reports lines per second for:
+  sync_debug      every line formatted and written by synchronous handlers (the old setup)
+  queue_debug     every line logged through the queue handler
+  queue_sampled   DEBUG through the queue handler, 1 in QPG_LOG_SAMPLE_EVERY lines logged
+  queue_info      the default INFO level: stream lines are not logged
+  no_logging      logging disabled, the floor
+
+Usage: python benchmarks/bench_logging.py [--units N] [--questions N] [--runs N] [--json PATH]
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import log_config  # noqa: E402
+import question_parser  # noqa: E402
+from question_parser import QuestionStreamParser  # noqa: E402
+
+MODES = ('sync_debug', 'queue_debug', 'queue_sampled', 'queue_info', 'no_logging')
+
+
+# NDJSON lines of a generation in the blueprint format, one line per token as Ollama streams it
+def make_stream(units, questions):
+    lines = []
+    for unit in range(1, units + 1):
+        lines.append(f"Unit {unit}:\n")
+        for number in range(1, questions + 1):
+            marks = 4 if number <= questions // 2 else 6
+            lines.append(
+                f"{number}. Explain how the protocols of topic {unit}.{number} handle framing, error control and "
+                f"retransmission on noisy links. [CO:{unit}] [BT:{number % 6 + 1}] ({marks} marks)\n"
+            )
+    tokens = [token for line in lines for token in line.replace(' ', ' \0').split('\0')]
+    stream = [
+        json.dumps({'model': 'llama3.2', 'created_at': '2024-01-01T00:00:00Z', 'response': token, 'done': False}).encode()
+        for token in tokens
+    ]
+    stream.append(json.dumps({'model': 'llama3.2', 'done': True, 'prompt_eval_count': 2048}).encode())
+    return stream
+
+
+# The body of request_generation's loop over response.iter_lines()
+def replay(stream, units, mode, sampler):
+    parser = QuestionStreamParser({f"Unit {unit}": f"Unit {unit}:" for unit in range(1, units + 1)})
+    chunks = []
+    for line in stream:
+        json_line = json.loads(line)
+        if mode == 'sync_debug':
+            logging.debug(f"Received line from AI API: {json_line}")
+        elif sampler():
+            logging.debug("Received line from AI API (1 in %d): %s", sampler.every, json_line)
+        if json_line.get('done'):
+            break
+        chunks.append(json_line['response'])
+        parser.feed(json_line['response'])
+    parser.close()
+    return parser.accepted
+
+
+def configure(mode, directory):
+    log_config.stop_logging()
+    log_file = os.path.join(directory, f"{mode}.log")
+    if mode == 'sync_debug':
+        logging.basicConfig(
+            level=logging.DEBUG, format=log_config.LOG_FORMAT, force=True,
+            handlers=[logging.FileHandler(log_file, encoding='utf-8'), logging.StreamHandler(sys.stdout)]
+        )
+        log_config._default_level = logging.DEBUG
+    else:
+        log_config.configure_logging(level='INFO' if mode in ('queue_info', 'no_logging') else 'DEBUG', levels='', log_file=log_file)
+    logging.disable(logging.CRITICAL if mode == 'no_logging' else logging.NOTSET)
+    every = 1 if mode in ('sync_debug', 'queue_debug') else log_config.LOG_SAMPLE_EVERY
+    question_parser.log_question = log_config.LogSampler('question_parser', every=every)
+    return log_config.LogSampler('app', every=every)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--units', type=int, default=5)
+    parser.add_argument('--questions', type=int, default=20, help='Questions per unit')
+    parser.add_argument('--runs', type=int, default=20, help='Generations replayed per mode')
+    parser.add_argument('--json', help='Write results to this JSON file')
+    args = parser.parse_args()
+
+    stream = make_stream(args.units, args.questions)
+    results = {'lines_per_generation': len(stream), 'runs': args.runs, 'sample_every': log_config.LOG_SAMPLE_EVERY}
+    console = sys.stdout
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, 'w') as devnull:
+        for mode in MODES:
+            # Console output goes nowhere but is still written, as a server's stdout would be
+            sys.stdout = devnull
+            try:
+                sampler = configure(mode, directory)
+                dropped = log_config.LOG_RECORDS_DROPPED.value()
+                start = time.perf_counter()
+                for _ in range(args.runs):
+                    accepted = replay(stream, args.units, mode, sampler)
+                elapsed = time.perf_counter() - start
+                # Records still queued are written before the listener stops; that is not on the request path
+                log_config.stop_logging()
+            finally:
+                sys.stdout = console
+            assert accepted == args.units * args.questions
+            results[mode] = {
+                'ms_per_generation': round(elapsed * 1000 / args.runs, 2),
+                'lines_per_second': round(len(stream) * args.runs / elapsed),
+                'records_dropped': log_config.LOG_RECORDS_DROPPED.value() - dropped,
+            }
+    logging.disable(logging.NOTSET)
+
+    for mode in MODES:
+        result = results[mode]
+        print(f"{mode:16}{result['ms_per_generation']:>10} ms{result['lines_per_second']:>12} lines/s{result['records_dropped']:>10} dropped")
+    print(f"{results['lines_per_generation']} lines per generation, {results['runs']} runs")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+"""End-to-end benchmark of /generate-questions and /generate-papers against a fake Ollama server.
+
+Each scenario runs in a fresh app process with its own data directory: syllabus PDFs of the
+given size are uploaded from `concurrency` clients at once and every job is polled to the end,
+then papers are requested the same way. Ollama is replaced by benchmarks/fake_ollama.py, so
+no GPU or model is needed. Latency percentiles, throughput and peak RSS are written as JSON,
+and --compare checks a run against a saved baseline (exit status 1 on a regression).
+
+Usage: python benchmarks/bench_pipeline.py [--scenario NAME ...] [--rounds N] [--tokens-per-second N]
+                                           [--json PATH] [--compare BASELINE] [--tolerance X]
+"""
+import os
+import sys
+import json
+import math
+import time
+import socket
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_OLLAMA = os.path.join(REPO, 'benchmarks', 'fake_ollama.py')
+
+# units: units in the syllabus; pages: PDF pages; concurrency: simultaneous clients;
+# paper_count: papers per /generate-papers request (0 skips it); format: fake model output
+SCENARIOS = {
+    'small': {'units': 3, 'pages': 3, 'concurrency': 1, 'paper_count': 3, 'format': 'good', 'mode': 'single'},
+    'medium': {'units': 6, 'pages': 24, 'concurrency': 4, 'paper_count': 10, 'format': 'good', 'mode': 'single'},
+    'large': {'units': 10, 'pages': 80, 'concurrency': 8, 'paper_count': 50, 'format': 'good', 'mode': 'single'},
+    'per_unit': {'units': 6, 'pages': 24, 'concurrency': 4, 'paper_count': 10, 'format': 'good', 'mode': 'per-unit'},
+    'repair': {'units': 6, 'pages': 12, 'concurrency': 4, 'paper_count': 10, 'format': 'short', 'mode': 'single'},
+    'malformed': {'units': 4, 'pages': 6, 'concurrency': 2, 'paper_count': 0, 'format': 'malformed', 'mode': 'single'},
+    'off_format': {'units': 4, 'pages': 6, 'concurrency': 2, 'paper_count': 0, 'format': 'off_format', 'mode': 'single'},
+}
+DEFAULT_SCENARIOS = ('small', 'medium', 'per_unit', 'repair', 'malformed')
+
+# Compared against the baseline: (path, a larger value is worse)
+COMPARED = (
+    ('questions.p50_s', True), ('questions.p95_s', True), ('questions.jobs_per_second', False),
+    ('papers.p50_s', True), ('papers.p95_s', True), ('papers.papers_per_second', False),
+    ('peak_rss_mb', True), ('peak_worker_rss_mb', True),
+)
+# Latency changes smaller than this are noise, whatever the ratio
+LATENCY_FLOOR_SECONDS = 0.05
+POLL_INTERVAL = 0.02
+
+TOPIC_WORDS = (
+    'Transmission media', 'Analog and digital signals', 'Line coding', 'Multiplexing', 'Error detection',
+    'Flow control', 'Sliding window protocols', 'Medium access control', 'Ethernet', 'Wireless LANs',
+    'Circuit switching', 'Packet switching', 'Routing algorithms', 'Congestion control', 'Transport protocols',
+)
+
+
+# A syllabus of `units` units over `pages` pages; the seed makes every upload a distinct document
+def make_syllabus(path, units, pages, seed):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, PageBreak
+    from reportlab.lib.styles import getSampleStyleSheet
+
+    rng = random.Random(seed)
+    styles = getSampleStyleSheet()
+    elements = [Paragraph(f"Course Code: DC{seed:04d} Data Communications", styles['Title'])]
+    for page in range(pages):
+        for unit in range(1, units + 1):
+            if (unit - 1) * pages // units == page:
+                topics = rng.sample(TOPIC_WORDS, 3)
+                elements.append(Paragraph(f"Unit {unit}: {topics[0]}", styles['Heading2']))
+                elements.append(Paragraph(', '.join(topics), styles['Normal']))
+        for _ in range(4):
+            elements.append(Paragraph(' '.join(
+                f"{rng.choice(TOPIC_WORDS)} covers signals, protocols and error control ({seed}.{page})." for _ in range(6)
+            ), styles['Normal']))
+        elements.append(PageBreak())
+    SimpleDocTemplate(path, pagesize=letter).build(elements)
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)], 3)
+
+
+def summarize(latencies, failures, wall_seconds, rate_name, rate_count):
+    return {
+        'requests': len(latencies) + failures,
+        'succeeded': len(latencies),
+        'failed': failures,
+        'p50_s': percentile(latencies, 0.5),
+        'p95_s': percentile(latencies, 0.95),
+        'max_s': round(max(latencies), 3) if latencies else None,
+        'wall_s': round(wall_seconds, 3),
+        rate_name: round(rate_count / wall_seconds, 3) if wall_seconds else None,
+    }
+
+
+# Runs inside the app process: drives the Flask app through its WSGI interface
+def run_worker(config, result_path):
+    sys.path.insert(0, REPO)
+    import app as server
+    import pdf_text
+    import paper_renderer
+
+    flask_app = server.create_app()
+    requests_total = config['concurrency'] * config['rounds']
+    os.makedirs('syllabi', exist_ok=True)
+    syllabi = []
+    for index in range(requests_total):
+        path = os.path.join('syllabi', f"syllabus_{index}.pdf")
+        make_syllabus(path, config['units'], config['pages'], seed=index + 1)
+        syllabi.append(path)
+
+    def generate(path):
+        client = flask_app.test_client()
+        start = time.perf_counter()
+        with open(path, 'rb') as f:
+            response = client.post('/generate-questions', data={
+                'syllabus': (f, os.path.basename(path)), 'mode': config['mode'], 'fresh': '1'
+            }, content_type='multipart/form-data')
+        if response.status_code != 202:
+            return None, f"HTTP {response.status_code}"
+        status_url = response.get_json()['status_url']
+        while True:
+            status = client.get(status_url).get_json()
+            if status['status'] in ('succeeded', 'failed'):
+                break
+            time.sleep(POLL_INTERVAL)
+        elapsed = time.perf_counter() - start
+        return (elapsed, None) if status['status'] == 'succeeded' else (None, status.get('error'))
+
+    def generate_papers(_):
+        client = flask_app.test_client()
+        start = time.perf_counter()
+        response = client.get(f"/generate-papers?count={config['paper_count']}")
+        elapsed = time.perf_counter() - start
+        return (elapsed, None) if response.status_code == 200 else (None, f"HTTP {response.status_code}")
+
+    def run(function, items):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=config['concurrency']) as executor:
+            outcomes = list(executor.map(function, items))
+        wall = time.perf_counter() - start
+        latencies = [elapsed for elapsed, _ in outcomes if elapsed is not None]
+        errors = sorted({error for elapsed, error in outcomes if elapsed is None})
+        return latencies, len(outcomes) - len(latencies), wall, errors
+
+    latencies, failures, wall, errors = run(generate, syllabi)
+    result = {'questions': summarize(latencies, failures, wall, 'jobs_per_second', len(latencies))}
+    result['questions']['errors'] = errors[:5]
+
+    if config['paper_count'] and latencies:
+        latencies, failures, wall, errors = run(generate_papers, range(requests_total))
+        result['papers'] = summarize(latencies, failures, wall, 'papers_per_second', len(latencies) * config['paper_count'])
+        result['papers']['errors'] = errors[:5]
+
+    # Pool processes count towards RUSAGE_CHILDREN once they have exited
+    for pool in (pdf_text._extract_pool, paper_renderer._render_pool):
+        if pool is not None:
+            pool.shutdown(wait=True)
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    result['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+    result['peak_worker_rss_mb'] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1)
+    with open(result_path, 'w') as f:
+        json.dump(result, f)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def run_scenario(name, config, args):
+    config = {**config, 'rounds': args.rounds}
+    port = free_port()
+    fake = subprocess.Popen(
+        [sys.executable, FAKE_OLLAMA, '--port', str(port), '--format', config['format'],
+         '--tokens-per-second', str(args.tokens_per_second), '--first-token-delay', str(args.first_token_delay)],
+        stdout=subprocess.DEVNULL
+    )
+    try:
+        wait_for(f"http://127.0.0.1:{port}/api/tags")
+        with tempfile.TemporaryDirectory() as directory:
+            env = {
+                **os.environ,
+                'OLLAMA_HOSTS': f"http://127.0.0.1:{port}",
+                'QPG_BLUEPRINT_DIR': os.path.join(REPO, 'blueprints'),
+                'QPG_LOG_LEVEL': args.log_level,
+                'QPG_LOG_FILE': '',
+                'QPG_JOB_MAX_PENDING': str(max(32, config['concurrency'] * 2)),
+            }
+            result_path = os.path.join(directory, 'result.json')
+            worker = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker', json.dumps(config), result_path],
+                cwd=directory, env=env, capture_output=True, text=True, timeout=args.timeout
+            )
+            if worker.returncode != 0 or not os.path.exists(result_path):
+                raise RuntimeError(f"Scenario '{name}' failed:\n{worker.stderr[-2000:]}")
+            with open(result_path) as f:
+                result = json.load(f)
+    finally:
+        fake.terminate()
+        fake.wait()
+    return {'name': name, **config, 'tokens_per_second': args.tokens_per_second, **result}
+
+
+def lookup(result, path):
+    for key in path.split('.'):
+        result = result.get(key) if isinstance(result, dict) else None
+    return result
+
+
+# Function: Compare Scenario Results with a Baseline; returns the regressions found
+def compare(results, baseline, tolerance):
+    previous = {scenario['name']: scenario for scenario in baseline['scenarios']}
+    regressions = []
+    for scenario in results:
+        before = previous.get(scenario['name'])
+        if before is None:
+            continue
+        changed = [key for key in (*SCENARIOS[scenario['name']], 'rounds', 'tokens_per_second') if before.get(key) != scenario.get(key)]
+        if changed:
+            print(f"{scenario['name']:12}settings differ from the baseline ({', '.join(changed)}); comparing anyway")
+        for path, larger_is_worse in COMPARED:
+            old, new = lookup(before, path), lookup(scenario, path)
+            if old is None or new is None or old == 0:
+                continue
+            change = (new - old) / old
+            worse = change > tolerance if larger_is_worse else change < -tolerance
+            if worse and path.endswith('_s') and abs(new - old) < LATENCY_FLOOR_SECONDS:
+                worse = False
+            print(f"{scenario['name']:12}{path:28}{old:>10}{new:>10}{change:>+9.1%}{'  REGRESSION' if worse else ''}")
+            if worse:
+                regressions.append({'scenario': scenario['name'], 'metric': path, 'baseline': old, 'current': new})
+        for part in ('questions', 'papers'):
+            old, new = lookup(before, f"{part}.failed"), lookup(scenario, f"{part}.failed")
+            if old is not None and new is not None and new > old:
+                print(f"{scenario['name']:12}{part + '.failed':28}{old:>10}{new:>10}  REGRESSION")
+                regressions.append({'scenario': scenario['name'], 'metric': f"{part}.failed", 'baseline': old, 'current': new})
+    return regressions
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--worker':
+        run_worker(json.loads(sys.argv[2]), sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help=f"Repeatable; default: {', '.join(DEFAULT_SCENARIOS)}")
+    parser.add_argument('--rounds', type=int, default=2, help='Requests per client')
+    parser.add_argument('--tokens-per-second', type=float, default=1000, help='Fake model streaming speed per request')
+    parser.add_argument('--first-token-delay', type=float, default=0.05, help='Fake prompt evaluation time in seconds')
+    parser.add_argument('--log-level', default='ERROR', help='QPG_LOG_LEVEL for the app process')
+    parser.add_argument('--timeout', type=float, default=900, help='Seconds allowed per scenario')
+    parser.add_argument('--json', help='Write results to this JSON file (a baseline for --compare)')
+    parser.add_argument('--compare', help='Baseline JSON written by an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Relative change that counts as a regression')
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'scenario':12}{'requests':>9}{'failed':>8}{'p50 s':>8}{'p95 s':>8}{'jobs/s':>8}"
+          f"{'papers p95':>12}{'papers/s':>10}{'rss MB':>8}{'worker MB':>11}")
+    for name in args.scenario or DEFAULT_SCENARIOS:
+        result = run_scenario(name, SCENARIOS[name], args)
+        results.append(result)
+        questions, papers = result['questions'], result.get('papers', {})
+        print(f"{name:12}{questions['requests']:>9}{questions['failed']:>8}{questions['p50_s'] or '-':>8}{questions['p95_s'] or '-':>8}"
+              f"{questions['jobs_per_second']:>8}{papers.get('p95_s') or '-':>12}{papers.get('papers_per_second') or '-':>10}"
+              f"{result['peak_rss_mb']:>8}{result['peak_worker_rss_mb']:>11}")
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'scenarios': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        print(f"{len(regressions)} regression(s) against {args.compare}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""Benchmark question paper rendering: per-call setup vs. the cached PaperTemplate.
+
+Usage: python benchmarks/bench_render.py [--papers N] [--units N] [--json PATH]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+import tempfile
+
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib import colors
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from paper_renderer import PaperTemplate  # noqa: E402
+
+
+# The renderer as it was before PaperTemplate: styles, titles and per-row table styles rebuilt on every call
+def legacy_generate_pdf(unit_questions, filepath):
+    doc = SimpleDocTemplate(filepath, pagesize=letter)
+    styles = getSampleStyleSheet()
+    elements = []
+
+    # Define a custom style for main titles
+    main_title_style = ParagraphStyle(
+        name='MainTitle',
+        parent=styles['Heading1'],
+        alignment=1,  # Center alignment
+        spaceAfter=12
+    )
+
+    # Define a custom style for table headers
+    header_style = ParagraphStyle(
+        name='TableHeader',
+        parent=styles['Normal'],
+        fontName='Helvetica-Bold',
+        fontSize=10,
+        alignment=1,  # Center alignment
+        textColor=colors.whitesmoke
+    )
+
+    # Add Main Titles at the Top
+    exam_title = Paragraph("Exam Question Paper", main_title_style)
+    course_title = Paragraph("Course: Data Communications", styles['Heading2'])
+    instructor = Paragraph("Instructor: Dr. Jane Doe", styles['Normal'])
+    date = Paragraph("Date: 23-Nov-2024", styles['Normal'])
+
+    elements.extend([exam_title, course_title, instructor, date, Spacer(1, 24)])
+
+    # Define table data with headers
+    table_data = [
+        [
+            Paragraph('Question No', header_style),
+            Paragraph('Subquestion', header_style),
+            Paragraph('Question Text', header_style),
+            Paragraph('CO', header_style),
+            Paragraph('BT', header_style),
+            Paragraph('Marks', header_style)
+        ]
+    ]
+
+    # Initialize question number
+    question_num = 1
+
+    for unit, questions in unit_questions.items():
+        # For each unit, select 2 questions (1 four-mark and 1 six-mark)
+        selected_questions_4 = questions['4'][:1]  # 1 four-mark question
+        selected_questions_6 = questions['6'][:1]  # 1 six-mark question
+
+        # Combine selected questions
+        selected_questions = selected_questions_4 + selected_questions_6
+
+        for idx, question in enumerate(selected_questions):
+            sub_label = chr(97 + idx)  # 'a', 'b'
+            formatted_question_num = f"{question_num}{sub_label}"
+            # Extract CO and BT from the question text
+            co_match = re.search(r'\[CO:(\d+)\]', question['text'])
+            bt_match = re.search(r'\[BT:(\d+)\]', question['text'])
+            co = co_match.group(1) if co_match else 'N/A'
+            bt = bt_match.group(1) if bt_match else 'N/A'
+
+            # Remove [CO:X] and [BT:Y] from the question text for clarity in the table
+            question_text_clean = re.sub(r'\[CO:\d+\]\s*\[BT:\d+\]', '', question['text']).strip()
+
+            # Append the row to table data
+            table_data.append([
+                Paragraph(formatted_question_num, styles['Normal']),  # Question No (e.g., '1a')
+                sub_label,                                          # Subquestion ('a', 'b')
+                Paragraph(question_text_clean, styles['Normal']),
+                str(co),
+                str(bt),
+                str(question['marks'])
+            ])
+
+        # Add a blank row after each unit for differentiation
+        table_data.append(['', '', '', '', '', ''])
+
+        question_num += 1  # Increment main question number for next unit
+
+    # Define column widths
+    col_widths = [80, 60, 300, 40, 40, 40]
+
+    # Create the table
+    table = Table(table_data, colWidths=col_widths, repeatRows=1)
+
+    # Add table style
+    table_style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+
+        ('GRID', (0,0), (-1,-1), 1, colors.black),
+    ])
+    table.setStyle(table_style)
+
+    # Alternate row colors (starting from the first data row)
+    for i in range(1, len(table_data)):
+        # Skip blank rows
+        if all(cell == '' for cell in table_data[i]):
+            continue
+        elif i % 7 == 0:
+            # Every 7th row is a blank row; skip coloring
+            continue
+        elif i % 2 == 0:
+            bg_color = colors.lightgrey
+        else:
+            bg_color = colors.whitesmoke
+        table.setStyle(TableStyle([
+            ('BACKGROUND', (0, i), (-1, i), bg_color)
+        ]))
+
+    elements.append(table)
+    elements.append(Spacer(1, 24))  # Space after the table
+
+    # Build the PDF
+    doc.build(elements)
+
+
+# An assembled paper: one four-mark and one six-mark question per unit, as both renderers lay it out
+def make_paper(units):
+    return {
+        f"Unit {u}: Topic {u}": {
+            '4': [{'text': f"Explain the key idea of topic {u} with an example. [CO:{u}] [BT:2]", 'marks': '4'}],
+            '6': [{'text': f"Describe and compare approaches for topic {u} in detail. [CO:{u}] [BT:4]", 'marks': '6'}],
+        }
+        for u in range(1, units + 1)
+    }
+
+
+def time_renders(render, paper, papers, directory):
+    timings = []
+    for i in range(papers):
+        path = os.path.join(directory, f"paper_{i}.pdf")
+        start = time.perf_counter()
+        render(paper, path)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        'papers': papers,
+        'mean_ms': round(statistics.mean(timings), 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'min_ms': round(min(timings), 3),
+        'total_s': round(sum(timings) / 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--papers', type=int, default=200)
+    parser.add_argument('--units', type=int, default=6)
+    parser.add_argument('--json', help='Write results to this JSON file')
+    args = parser.parse_args()
+
+    paper = make_paper(args.units)
+    template = PaperTemplate()
+    with tempfile.TemporaryDirectory() as directory:
+        # Warm up imports and font caches so both variants start equal
+        legacy_generate_pdf(paper, os.path.join(directory, 'warmup.pdf'))
+        template.render(paper, os.path.join(directory, 'warmup.pdf'))
+
+        results = {
+            'units': args.units,
+            'before': time_renders(legacy_generate_pdf, paper, args.papers, directory),
+            'after': time_renders(template.render, paper, args.papers, directory),
+        }
+    results['speedup'] = round(results['before']['mean_ms'] / results['after']['mean_ms'], 2)
+
+    print(f"{'':8}{'mean ms':>10}{'median ms':>12}{'min ms':>10}")
+    for name in ('before', 'after'):
+        r = results[name]
+        print(f"{name:8}{r['mean_ms']:>10}{r['median_ms']:>12}{r['min_ms']:>10}")
+    print(f"speedup: {results['speedup']}x over {args.papers} papers")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""A local stand-in for Ollama's /api/generate that streams canned questions as NDJSON.
+
+Reads the units and per-unit quotas from the prompt (generation, per-unit and repair prompts)
+and answers in the format the parser expects, token by token, at a configurable speed:
+  good        every requested question, followed by a line of chatter
+  short       the last question of every second unit is left out, so the app sends repair prompts
+  malformed   a line that is not JSON a third of the way into the stream
+  off_format  prose instead of numbered questions, so the parser stops the stream early
+
+Usage: python benchmarks/fake_ollama.py [--port N] [--format F] [--tokens-per-second N] [--first-token-delay S]
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FORMATS = ('good', 'short', 'malformed', 'off_format')
+
+UNITS_SECTION_PATTERN = re.compile(r'\nUnits:\n(.*?)\n\nText:\n', re.DOTALL)
+UNIT_NUMBER_PATTERN = re.compile(r'^Unit\s+(\d+)', re.IGNORECASE)
+FORMAT_LINE_PATTERN = re.compile(r'^\d+\. Question text \[CO:X\] \[BT:Y\] \((\d+) marks\)\.$', re.MULTILINE)
+REPAIR_REQUEST_PATTERN = re.compile(r'(\d+) (\d+)-mark question')
+TOKEN_PATTERN = re.compile(r'\S+\s*|\s+')
+
+WORDS = (
+    'signal', 'protocol', 'frame', 'channel', 'error', 'latency', 'routing', 'packet', 'bandwidth', 'modulation',
+    'encoding', 'switching', 'congestion', 'window', 'checksum', 'multiplexing', 'topology', 'collision', 'spectrum',
+    'handshake', 'datagram', 'segment', 'address', 'gateway', 'retransmission', 'flow', 'parity', 'sampling',
+)
+VERBS = ('Explain', 'Describe', 'Compare', 'Analyse', 'Illustrate', 'Discuss', 'Derive', 'Evaluate')
+
+
+# Unit number -> marks of each question asked for, in order; and whether the prompt is a repair prompt
+def requested_questions(prompt):
+    section = UNITS_SECTION_PATTERN.search(prompt)
+    format_marks = [int(marks) for marks in FORMAT_LINE_PATTERN.findall(prompt)] or [4, 4, 4, 6, 6, 6]
+    wanted = {}
+    repair = False
+    for line in (section.group(1) if section else 'Unit 1').splitlines():
+        match = UNIT_NUMBER_PATTERN.match(line.strip())
+        if not match:
+            continue
+        _, _, requests = line.partition(':')
+        # Repair prompts list the missing questions per unit; generation prompts only the unit numbers
+        missing = [int(marks) for count, marks in REPAIR_REQUEST_PATTERN.findall(requests) for _ in range(int(count))]
+        repair = repair or bool(missing)
+        wanted[match.group(1)] = missing or format_marks
+    return wanted or {'1': format_marks}, repair
+
+
+def make_output(prompt, output_format, rng):
+    wanted, repair = requested_questions(prompt)
+    lines = []
+    for unit, marks_list in wanted.items():
+        lines.append(f"Unit {unit}:")
+        for number, marks in enumerate(marks_list, start=1):
+            # Repair prompts are answered in full, so 'short' costs one repair round
+            if output_format == 'short' and not repair and int(unit) % 2 == 0 and number == len(marks_list):
+                continue
+            topic = ' '.join(rng.sample(WORDS, 4))
+            if output_format == 'off_format':
+                lines.append(f"Here is a question about {topic} for unit {unit}, worth {marks} marks.")
+                continue
+            lines.append(
+                f"{number}. {rng.choice(VERBS)} the role of {topic} in unit {unit} with an example. "
+                f"[CO:{unit}] [BT:{rng.randint(1, 6)}] ({marks} marks)."
+            )
+    lines.append("\nI hope these questions help!")
+    return '\n'.join(lines)
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    output_format = 'good'
+    tokens_per_second = 0
+    first_token_delay = 0.0
+    model = 'llama3.2-vision'
+
+    def log_message(self, *args):
+        pass
+
+    def handle(self):
+        # Clients drop idle keep-alive connections; that is not an error here
+        try:
+            super().handle()
+        except ConnectionResetError:
+            pass
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send_json({'models': [{'name': self.model}]})
+        elif self.path == '/api/version':
+            self._send_json({'version': 'fake'})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        if self.path != '/api/generate':
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        prompt = body.get('prompt', '')
+        rng = random.Random(f"{prompt[-200:]}{time.time_ns()}")
+        tokens = TOKEN_PATTERN.findall(make_output(prompt, self.output_format, rng))
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        started = time.perf_counter()
+        try:
+            if self.first_token_delay:
+                time.sleep(self.first_token_delay)
+            for index, token in enumerate(tokens):
+                if self.output_format == 'malformed' and index == len(tokens) // 3:
+                    self._write_chunk(b'{"response": "broken\n')
+                    break
+                self._write_chunk(json.dumps({'model': self.model, 'response': token, 'done': False}).encode() + b'\n')
+                if self.tokens_per_second:
+                    time.sleep(1 / self.tokens_per_second)
+            else:
+                self._write_chunk(json.dumps({
+                    'model': self.model, 'response': '', 'done': True,
+                    'prompt_eval_count': len(prompt) // 4, 'eval_count': len(tokens),
+                    'eval_duration': int((time.perf_counter() - started) * 1e9),
+                }).encode() + b'\n')
+            self._write_chunk(b'')
+        except (BrokenPipeError, ConnectionResetError):
+            # The app closes the stream once every quota is filled
+            self.close_connection = True
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+# Function: Start a Fake Ollama Server on a Background Thread; returns the server
+def start_server(port=0, output_format='good', tokens_per_second=0, first_token_delay=0.0):
+    handler = type('Handler', (FakeOllamaHandler,), {
+        'output_format': output_format, 'tokens_per_second': tokens_per_second, 'first_token_delay': first_token_delay,
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--format', choices=FORMATS, default='good')
+    parser.add_argument('--tokens-per-second', type=float, default=0, help='Streaming speed per request; 0 streams as fast as possible')
+    parser.add_argument('--first-token-delay', type=float, default=0.0, help='Seconds before the first token (prompt evaluation)')
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.format, args.tokens_per_second, args.first_token_delay)
+    print(f"Fake Ollama listening on http://127.0.0.1:{server.server_address[1]} ({args.format})", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
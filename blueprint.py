@@ -0,0 +1,223 @@
+import os
+import re
+import json
+import logging
+from datetime import date as Date
+
+from question_bank import get_stored_blueprint, list_stored_blueprints, store_blueprint
+
+# Blueprint Configuration
+BLUEPRINT_DIR = os.environ.get('QPG_BLUEPRINT_DIR', 'blueprints')
+DEFAULT_BLUEPRINT = os.environ.get('QPG_BLUEPRINT', 'default')
+
+NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# The paper this project has always produced: per unit, a bank of 3 four-mark and 3 six-mark
+# questions, and one of each on every paper
+BUILTIN_BLUEPRINTS = {
+    'default': {
+        'name': 'default',
+        'generate': {'4': 3, '6': 3},
+        'sections': [{'per_unit': {'4': 1, '6': 1}}],
+        'title': 'Exam Question Paper',
+        'instructor': 'Dr. Jane Doe',
+    },
+}
+
+
+class BlueprintError(Exception):
+    pass
+
+
+def _marks_counts(value, field):
+    if not isinstance(value, dict) or not value:
+        raise BlueprintError(f"'{field}' must map marks to question counts, e.g. {{\"4\": 3}}.")
+    counts = {}
+    for marks, count in value.items():
+        try:
+            marks, count = int(marks), int(count)
+        except (TypeError, ValueError):
+            raise BlueprintError(f"'{field}' must map marks to question counts, got {marks!r}: {count!r}.")
+        if marks <= 0 or count < 0:
+            raise BlueprintError(f"'{field}' marks and counts must be positive, got {marks}: {count}.")
+        if count:
+            counts[str(marks)] = count
+    # Marks categories are always kept in ascending order
+    return dict(sorted(counts.items(), key=lambda item: int(item[0])))
+
+
+# Section: One Block of the Paper, Filled with the Same Questions per Unit
+class Section:
+    def __init__(self, per_unit, name='', attempt=None, instructions=''):
+        self.per_unit = _marks_counts(per_unit, 'per_unit')
+        if not self.per_unit:
+            raise BlueprintError('A section needs at least one question per unit.')
+        self.name = name or ''
+        self.instructions = instructions or ''
+        # Optional questions: candidates answer 'attempt' of the section's questions
+        self.attempt = int(attempt) if attempt else None
+        if self.attempt is not None and len(self.per_unit) > 1:
+            raise BlueprintError(f"Section '{self.name}' offers a choice, so all its questions must carry the same marks.")
+
+    def question_count(self, units):
+        return units * sum(self.per_unit.values())
+
+    def marks_total(self, units):
+        if self.attempt is not None:
+            return min(self.attempt, self.question_count(units)) * int(next(iter(self.per_unit)))
+        return units * sum(int(marks) * count for marks, count in self.per_unit.items())
+
+    def to_dict(self):
+        section = {'per_unit': self.per_unit}
+        if self.name:
+            section['name'] = self.name
+        if self.attempt is not None:
+            section['attempt'] = self.attempt
+        if self.instructions:
+            section['instructions'] = self.instructions
+        return section
+
+
+# Blueprint: Marks Categories, Questions per Unit, Sections, Time and Total Marks of a Paper
+class Blueprint:
+    def __init__(self, name, sections, generate=None, title='Exam Question Paper', course=None,
+                 instructor=None, date=None, duration_minutes=None, total_marks=None):
+        if not NAME_PATTERN.match(name or ''):
+            raise BlueprintError('Blueprint names may only use letters, digits, dashes and underscores.')
+        if not sections:
+            raise BlueprintError('A blueprint needs at least one section.')
+        self.name = name
+        self.sections = [section if isinstance(section, Section) else Section(**section) for section in sections]
+        self.title = title
+        self.course = course
+        self.instructor = instructor
+        self.date = date
+        self.duration_minutes = int(duration_minutes) if duration_minutes else None
+        self.total_marks = int(total_marks) if total_marks else None
+
+        self.paper_per_unit = {}
+        for section in self.sections:
+            for marks, count in section.per_unit.items():
+                self.paper_per_unit[marks] = self.paper_per_unit.get(marks, 0) + count
+        self.paper_per_unit = dict(sorted(self.paper_per_unit.items(), key=lambda item: int(item[0])))
+
+        # Questions generated per unit for the bank; defaults to three for every question a paper uses
+        self.generate = _marks_counts(generate, 'generate') if generate else {
+            marks: 3 * count for marks, count in self.paper_per_unit.items()
+        }
+        short = [marks for marks, count in self.paper_per_unit.items() if self.generate.get(marks, 0) < count]
+        if short:
+            raise BlueprintError(f"'generate' must provide at least as many questions per unit as a paper uses (marks {short}).")
+
+    # Marks categories, ascending, as the strings the parser and paper pools are keyed by
+    @property
+    def marks(self):
+        return tuple(self.generate)
+
+    def paper_marks(self, units):
+        return sum(section.marks_total(units) for section in self.sections)
+
+    # Problems that only show up once the number of units is known
+    def check_units(self, units):
+        if self.total_marks and self.paper_marks(units) != self.total_marks:
+            return [f"blueprint '{self.name}' gives {self.paper_marks(units)} marks for {units} units, not {self.total_marks}"]
+        return []
+
+    # Same paper header, one plain section with a different question count per unit
+    def with_per_unit(self, per_unit):
+        definition = self.to_dict()
+        definition['sections'] = [{'per_unit': per_unit}]
+        definition['generate'] = {marks: max(count, self.generate.get(marks, 0)) for marks, count in _marks_counts(per_unit, 'per_unit').items()}
+        definition.pop('total_marks', None)
+        return Blueprint.from_dict(definition)
+
+    # Hashable renderer settings; templates are cached per layout
+    def layout(self, course=None):
+        return {
+            'exam_title': self.title,
+            'course': self.course or course or '',
+            'instructor': self.instructor or '',
+            'date': self.date or Date.today().strftime('%d-%b-%Y'),
+            'duration_minutes': self.duration_minutes,
+            'total_marks': self.total_marks,
+            'sections': tuple(
+                (section.name, section.instructions, tuple(section.per_unit.items()), section.attempt)
+                for section in self.sections
+            ),
+        }
+
+    def to_dict(self):
+        definition = {
+            'name': self.name,
+            'generate': self.generate,
+            'sections': [section.to_dict() for section in self.sections],
+            'title': self.title,
+        }
+        for field in ('course', 'instructor', 'date', 'duration_minutes', 'total_marks'):
+            if getattr(self, field) is not None:
+                definition[field] = getattr(self, field)
+        return definition
+
+    @classmethod
+    def from_dict(cls, definition):
+        if not isinstance(definition, dict):
+            raise BlueprintError('A blueprint must be a JSON object.')
+        fields = ('name', 'sections', 'generate', 'title', 'course', 'instructor', 'date', 'duration_minutes', 'total_marks')
+        unknown = sorted(set(definition) - set(fields))
+        if unknown:
+            raise BlueprintError(f"Unknown blueprint fields: {unknown}")
+        try:
+            return cls(**{field: definition[field] for field in fields if field in definition})
+        except (TypeError, ValueError) as e:
+            raise BlueprintError(f"Invalid blueprint: {e}")
+
+
+# Function: Load a Blueprint by Name (stored in the bank, then the blueprint directory, then built in)
+def load_blueprint(name=None):
+    name = name or DEFAULT_BLUEPRINT
+    if not NAME_PATTERN.match(name):
+        raise BlueprintError(f"Unknown blueprint '{name}'.")
+
+    definition = get_stored_blueprint(name)
+    if definition is None:
+        path = os.path.join(BLUEPRINT_DIR, f"{name}.json")
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as file:
+                try:
+                    definition = json.load(file)
+                except json.JSONDecodeError as e:
+                    raise BlueprintError(f"Blueprint file {path} is not valid JSON: {e}")
+            if not isinstance(definition, dict):
+                raise BlueprintError(f"Blueprint file {path} must contain a JSON object.")
+            definition.setdefault('name', name)
+        else:
+            definition = BUILTIN_BLUEPRINTS.get(name)
+    if definition is None:
+        raise BlueprintError(f"Unknown blueprint '{name}'.")
+
+    blueprint = Blueprint.from_dict(definition)
+    logging.debug("Loaded blueprint '%s': %s", name, blueprint.to_dict())
+    return blueprint
+
+
+# Function: Names of Every Available Blueprint and Where Each One Comes From
+def list_blueprints():
+    sources = {name: 'builtin' for name in BUILTIN_BLUEPRINTS}
+    if os.path.isdir(BLUEPRINT_DIR):
+        for filename in os.listdir(BLUEPRINT_DIR):
+            name, extension = os.path.splitext(filename)
+            if extension == '.json' and NAME_PATTERN.match(name):
+                sources[name] = 'file'
+    for name in list_stored_blueprints():
+        sources[name] = 'database'
+    return [{'name': name, 'source': source} for name, source in sorted(sources.items())]
+
+
+# Function: Validate and Store a Blueprint in the Bank (overrides a file or built-in of the same name)
+def save_blueprint(name, definition):
+    if not isinstance(definition, dict):
+        raise BlueprintError('A blueprint must be a JSON object.')
+    blueprint = Blueprint.from_dict({**definition, 'name': name})
+    store_blueprint(blueprint.name, json.dumps(blueprint.to_dict()))
+    logging.info(f"Stored blueprint '{blueprint.name}'.")
+    return blueprint
@@ -0,0 +1,43 @@
+import os
+import logging
+
+# Config File: KEY=VALUE lines of QPG_* (and OLLAMA_*) settings, read into the environment
+# before the application modules are imported, as they read their settings at import time
+CONFIG_FILE = os.environ.get('QPG_CONFIG', 'qpg.env')
+
+
+def parse_config(text):
+    settings = {}
+    for number, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        key, separator, value = line.partition('=')
+        key = key.strip()
+        if key.startswith('export '):
+            key = key[len('export '):].strip()
+        if not separator or not key:
+            raise ValueError(f"Line {number} is not KEY=VALUE: {line!r}")
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in ('"', "'"):
+            value = value[1:-1]
+        settings[key] = value
+    return settings
+
+
+# Function: Load a Config File into the Environment; variables already set take precedence
+# A missing file is only an error when it was named explicitly (argument or QPG_CONFIG)
+def load_config(path=None):
+    explicit = path is not None or 'QPG_CONFIG' in os.environ
+    path = path or CONFIG_FILE
+    try:
+        with open(path, encoding='utf-8') as f:
+            settings = parse_config(f.read())
+    except FileNotFoundError:
+        if explicit:
+            raise
+        return {}
+    for key, value in settings.items():
+        os.environ.setdefault(key, value)
+    logging.debug("Loaded %d settings from %s.", len(settings), path)
+    return settings
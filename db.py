@@ -0,0 +1,163 @@
+import os
+import queue
+import logging
+import sqlite3
+import time
+import threading
+from contextlib import contextmanager
+
+from metrics import metrics
+
+# SQLite Configuration
+SQLITE_POOL_SIZE = int(os.environ.get('QPG_SQLITE_POOL_SIZE', 8))  # Connections kept open per database file
+SQLITE_BUSY_TIMEOUT = float(os.environ.get('QPG_SQLITE_BUSY_TIMEOUT', 30))  # Seconds to wait for a lock or a free connection
+SQLITE_CACHE_KIB = int(os.environ.get('QPG_SQLITE_CACHE_KIB', 16 * 1024))
+SQLITE_MMAP_BYTES = int(os.environ.get('QPG_SQLITE_MMAP_BYTES', 128 * 1024 * 1024))
+SQLITE_SYNCHRONOUS = os.environ.get('QPG_SQLITE_SYNCHRONOUS', 'NORMAL')
+
+# WAL lets readers run alongside the single writer; NORMAL sync is durable across crashes in WAL mode
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    f'PRAGMA synchronous = {SQLITE_SYNCHRONOUS}',
+    f'PRAGMA busy_timeout = {int(SQLITE_BUSY_TIMEOUT * 1000)}',
+    f'PRAGMA cache_size = -{SQLITE_CACHE_KIB}',
+    f'PRAGMA mmap_size = {SQLITE_MMAP_BYTES}',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA foreign_keys = ON',
+)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# SQLite Metrics
+LOCK_WAIT_SECONDS = metrics.histogram('qpg_sqlite_lock_wait_seconds', 'Time write transactions wait for the database write lock.', ('database',))
+TRANSACTION_SECONDS = metrics.histogram('qpg_sqlite_transaction_seconds', 'Write transaction time, from BEGIN to COMMIT.', ('database', 'outcome'))
+
+
+# PooledConnection: A Connection That Knows Which Database File It Belongs To (for metrics)
+class PooledConnection(sqlite3.Connection):
+    database = 'sqlite'
+
+
+# ConnectionPool: Long-Lived, Pre-Configured Connections to One Database File
+class ConnectionPool:
+    def __init__(self, path, size=SQLITE_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # Autocommit mode: reads never hold a transaction open, writes use transaction()
+        conn = sqlite3.connect(
+            self.path,
+            timeout=SQLITE_BUSY_TIMEOUT,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256,
+            factory=PooledConnection
+        )
+        conn.database = os.path.splitext(os.path.basename(self.path))[0]
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        logging.debug("Opened SQLite connection to %s.", self.path)
+        return conn
+
+    # Borrow a connection for the duration of the block; it goes back to the pool afterwards
+    @contextmanager
+    def connection(self):
+        self._reset_after_fork()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=SQLITE_BUSY_TIMEOUT)
+                except queue.Empty:
+                    raise sqlite3.OperationalError(f"No free connection to {self.path} within {SQLITE_BUSY_TIMEOUT}s.")
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._opened = 0
+
+    # Connections must not cross a fork; a child process starts with an empty pool
+    def _reset_after_fork(self):
+        if self._pid != os.getpid():
+            self._idle = queue.LifoQueue()
+            self._opened = 0
+            self._lock = threading.Lock()
+            self._pid = os.getpid()
+
+
+# Function: Shared Pool for a Database File
+def get_pool(path):
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = ConnectionPool(path)
+            _pools[path] = pool
+        return pool
+
+
+# Function: Run a Block in One Write Transaction
+# BEGIN IMMEDIATE takes the write lock up front, so concurrent writers wait on busy_timeout
+# instead of failing with 'database is locked' when a read transaction tries to upgrade.
+@contextmanager
+def transaction(conn, immediate=True):
+    database = getattr(conn, 'database', 'sqlite')
+    start = time.perf_counter()
+    conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+    LOCK_WAIT_SECONDS.observe(time.perf_counter() - start, database=database)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        TRANSACTION_SECONDS.observe(time.perf_counter() - start, database=database, outcome='rolled_back')
+        raise
+    else:
+        conn.commit()
+        TRANSACTION_SECONDS.observe(time.perf_counter() - start, database=database, outcome='committed')
+
+
+# Function: Claim a Periodic Task for This Process; returns whether the caller should run it
+# The first caller once 'interval' seconds have passed records the time and wins, the others skip
+# the task. Worker processes sharing a data directory use this to run startup maintenance once
+def claim_periodic_task(path, name, interval):
+    now = time.time()
+    with get_pool(path).connection() as conn:
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS periodic_tasks (name TEXT PRIMARY KEY, claimed_at REAL NOT NULL, claimed_by INTEGER NOT NULL)'
+        )
+        with transaction(conn):
+            row = conn.execute('SELECT claimed_at FROM periodic_tasks WHERE name = ?', (name,)).fetchone()
+            if row is not None and now - row[0] < interval:
+                return False
+            conn.execute(
+                'INSERT OR REPLACE INTO periodic_tasks (name, claimed_at, claimed_by) VALUES (?, ?, ?)', (name, now, os.getpid())
+            )
+    return True
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+from db import get_pool, transaction
+from metrics import metrics
+
+# Generation Cache Configuration
+CACHE_DATABASE = os.environ.get('QPG_CACHE_DATABASE', 'data/generation_cache.db')
+CACHE_MAX_ENTRIES = int(os.environ.get('QPG_CACHE_MAX_ENTRIES', 500))
+CACHE_MAX_BYTES = int(os.environ.get('QPG_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+CACHE_MAX_AGE_SECONDS = int(os.environ.get('QPG_CACHE_MAX_AGE_SECONDS', 30 * 24 * 3600))
+
+
+# Function: Build a Content-Addressed Cache Key for a Generation Request
+def make_cache_key(model, system_prompt, units_text, syllabus_text, options=None):
+    payload = json.dumps(
+        {
+            'model': model,
+            'system_prompt': system_prompt,
+            'units': units_text,
+            'syllabus': syllabus_text,
+            'options': options or {},
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# GenerationCache: Persistent Store of Raw LLM Output Keyed by Request Hash
+class GenerationCache:
+    def __init__(self, path=CACHE_DATABASE, max_entries=CACHE_MAX_ENTRIES,
+                 max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    # Borrow a pooled connection, creating the table on first use
+    @contextmanager
+    def _connection(self):
+        with get_pool(self.path).connection() as conn:
+            if not self._initialized:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS generations (
+                        cache_key TEXT PRIMARY KEY,
+                        model TEXT NOT NULL,
+                        generated_text TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        created_at REAL NOT NULL,
+                        last_used_at REAL NOT NULL
+                    )
+                ''')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_generations_last_used ON generations (last_used_at)')
+                self._initialized = True
+            yield conn
+
+    def get(self, key):
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute(
+                'SELECT generated_text, created_at FROM generations WHERE cache_key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+            generated_text, created_at = row
+            if now - created_at > self.max_age:
+                conn.execute('DELETE FROM generations WHERE cache_key = ?', (key,))
+                with self._lock:
+                    self.misses += 1
+                    self.evictions += 1
+                return None
+            conn.execute('UPDATE generations SET last_used_at = ? WHERE cache_key = ?', (now, key))
+        with self._lock:
+            self.hits += 1
+        logging.info(f"Generation cache hit for key {key[:12]}.")
+        return generated_text
+
+    def put(self, key, model, generated_text):
+        now = time.time()
+        size = len(generated_text.encode('utf-8'))
+        with self._connection() as conn, transaction(conn):
+            conn.execute(
+                'INSERT OR REPLACE INTO generations '
+                '(cache_key, model, generated_text, size, created_at, last_used_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, model, generated_text, size, now, now)
+            )
+            self._evict(conn, now)
+        logging.info(f"Stored generation in cache under key {key[:12]} ({size} bytes).")
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypasses += 1
+
+    # Evict expired entries, then least recently used ones until both limits hold
+    def _evict(self, conn, now):
+        cursor = conn.execute('DELETE FROM generations WHERE created_at < ?', (now - self.max_age,))
+        evicted = cursor.rowcount
+        count, total_bytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generations').fetchone()
+        if count > self.max_entries or total_bytes > self.max_bytes:
+            for key, size in conn.execute(
+                'SELECT cache_key, size FROM generations ORDER BY last_used_at ASC'
+            ).fetchall():
+                if count <= self.max_entries and total_bytes <= self.max_bytes:
+                    break
+                conn.execute('DELETE FROM generations WHERE cache_key = ?', (key,))
+                count -= 1
+                total_bytes -= size
+                evicted += 1
+        if evicted:
+            with self._lock:
+                self.evictions += evicted
+            logging.info(f"Evicted {evicted} entries from the generation cache.")
+
+    def stats(self):
+        with self._connection() as conn:
+            count, total_bytes = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generations'
+            ).fetchone()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': count,
+                'bytes': total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypasses': self.bypasses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'max_age_seconds': self.max_age,
+            }
+
+
+generation_cache = GenerationCache()
+metrics.callback(
+    'qpg_generation_cache_lookups_total', 'Generation cache lookups by result.',
+    lambda: [(('hit',), generation_cache.hits), (('miss',), generation_cache.misses), (('bypass',), generation_cache.bypasses)],
+    labels=('result',), kind='counter'
+)
+metrics.callback('qpg_generation_cache_evictions_total', 'Generation cache entries evicted.',
+                 lambda: generation_cache.evictions, kind='counter')
@@ -0,0 +1,388 @@
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from db import get_pool, transaction
+from metrics import metrics
+
+# Job Queue Configuration
+JOB_WORKERS = int(os.environ.get('QPG_JOB_WORKERS', 4))  # Per worker process
+JOB_MAX_PENDING = int(os.environ.get('QPG_JOB_MAX_PENDING', 32))  # Across all worker processes
+JOB_RETENTION_SECONDS = int(os.environ.get('QPG_JOB_RETENTION_SECONDS', 3600))
+JOBS_DATABASE = os.environ.get('QPG_JOBS_DATABASE', 'data/jobs.db')
+JOB_POLL_SECONDS = float(os.environ.get('QPG_JOB_POLL_SECONDS', 0.5))  # How often another process's job is checked for events
+
+ACTIVE_STATUSES = ('queued', 'running')
+ORPHANED_JOB_ERROR = 'The server process running this job stopped before it finished. Please try again.'
+
+
+# Job Metrics
+STAGE_SECONDS = metrics.histogram('qpg_job_stage_seconds', 'Time jobs spend in each pipeline stage.', ('kind', 'stage'))
+JOB_SECONDS = metrics.histogram('qpg_job_seconds', 'Job run time from start to finish.', ('kind', 'status'))
+QUEUE_WAIT_SECONDS = metrics.histogram('qpg_job_queue_wait_seconds', 'Time jobs wait in the queue before a worker picks them up.', ('kind',))
+JOBS_REJECTED = metrics.counter('qpg_jobs_rejected_total', 'Jobs refused because the queue was full.', ('kind',))
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+# Job: State of a Single Background Pipeline Run
+# The process running the job keeps it in memory and writes every change through to the job
+# store, so the other worker processes can report on it
+class Job:
+    def __init__(self, kind, job_id=None, store=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.status = 'queued'
+        self.stage = None
+        self.progress = 0.0
+        self.timings = {}
+        self.result = None
+        self.error = None
+        self.error_status = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.events = []
+        self._store = store
+        self._lock = threading.Lock()
+        self._events_changed = threading.Condition(self._lock)
+
+    # Record the start of a pipeline stage; the previous stage's timing is closed off
+    def set_stage(self, stage, progress=None):
+        now = time.time()
+        with self._lock:
+            self._close_stage(now)
+            self.stage = stage
+            self._stage_started = now
+            if progress is not None:
+                self.progress = round(min(max(progress, 0.0), 1.0), 3)
+        self.save()
+        logging.info(f"Job {self.id} entered stage '{stage}'.")
+        self.emit('stage', {'stage': stage, 'progress': self.progress})
+
+    # Append an event for streaming clients; events are numbered from 1
+    def emit(self, event, data):
+        with self._lock:
+            event_id = len(self.events) + 1
+            self.events.append((event_id, event, data))
+            self._events_changed.notify_all()
+        if self._store is not None:
+            self._store.add_event(self.id, event_id, event, data)
+
+    # Write the job's state to the job store
+    def save(self):
+        if self._store is not None:
+            self._store.save(self)
+
+    # Block until there are events after 'after' or the job finishes; returns (events, finished)
+    def wait_for_events(self, after, timeout=None):
+        with self._lock:
+            if len(self.events) <= after and self.finished_at is None:
+                self._events_changed.wait(timeout)
+            return self.events[after:], self.finished_at is not None
+
+    def set_progress(self, progress):
+        with self._lock:
+            self.progress = round(min(max(progress, 0.0), 1.0), 3)
+        self.save()
+
+    def _close_stage(self, now):
+        if self.stage is not None and getattr(self, '_stage_started', None) is not None:
+            self.timings[self.stage] = round(self.timings.get(self.stage, 0.0) + now - self._stage_started, 3)
+            STAGE_SECONDS.observe(now - self._stage_started, kind=self.kind, stage=self.stage)
+            self._stage_started = None
+
+    def to_dict(self):
+        with self._lock:
+            data = {
+                'job_id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'stage': self.stage,
+                'progress': self.progress,
+                'timings': dict(self.timings),
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+            }
+            if self.error:
+                data['error'] = self.error
+            return data
+
+
+# StoredJob: A Job Run by Another Worker Process, Read Back from the Job Store
+class StoredJob(Job):
+    def __init__(self, store, row):
+        super().__init__(row['kind'], job_id=row['id'])
+        self._reader = store
+        self.status = row['status']
+        self.stage = row['stage']
+        self.progress = row['progress']
+        self.timings = json.loads(row['timings'])
+        self.result = json.loads(row['result']) if row['result'] is not None else None
+        self.error = row['error']
+        self.error_status = row['error_status']
+        self.created_at = row['created_at']
+        self.started_at = row['started_at']
+        self.finished_at = row['finished_at']
+
+    # Polls the store, as the job's own process cannot signal this one
+    def wait_for_events(self, after, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            events, finished = self._reader.events_since(self.id, after)
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if events or finished or (remaining is not None and remaining <= 0):
+                return events, finished
+            time.sleep(JOB_POLL_SECONDS if remaining is None else min(JOB_POLL_SECONDS, remaining))
+
+
+def _process_alive(pid):
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        # os.kill() would terminate the process; such jobs are only recovered once they are stale
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# JobStore: Job State and Events in SQLite, Shared by All Worker Processes
+class JobStore:
+    def __init__(self, path=JOBS_DATABASE):
+        self.path = path
+        self.host = socket.gethostname()
+        self._initialized = False
+
+    # Borrow a pooled connection, creating the tables on first use
+    @contextmanager
+    def _connection(self):
+        with get_pool(self.path).connection() as conn:
+            if not self._initialized:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id TEXT PRIMARY KEY,
+                        kind TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        stage TEXT,
+                        progress REAL NOT NULL DEFAULT 0,
+                        timings TEXT NOT NULL DEFAULT '{}',
+                        result TEXT,
+                        error TEXT,
+                        error_status INTEGER,
+                        created_at REAL NOT NULL,
+                        started_at REAL,
+                        finished_at REAL,
+                        owner_host TEXT NOT NULL,
+                        owner_pid INTEGER NOT NULL
+                    )
+                ''')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at)')
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS job_events (
+                        job_id TEXT NOT NULL,
+                        event_id INTEGER NOT NULL,
+                        event TEXT NOT NULL,
+                        data TEXT NOT NULL,
+                        PRIMARY KEY (job_id, event_id)
+                    ) WITHOUT ROWID
+                ''')
+                self._initialized = True
+            yield conn
+
+    # Register a new job unless max_pending jobs are already queued or running in any process
+    def insert(self, job, max_pending):
+        with self._connection() as conn, transaction(conn):
+            self._expire_finished(conn)
+            active = conn.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE status IN ({', '.join('?' for _ in ACTIVE_STATUSES)})", ACTIVE_STATUSES
+            ).fetchone()[0]
+            if active >= max_pending:
+                raise JobQueueFull(f"{active} jobs are already queued or running.")
+            conn.execute(
+                'INSERT INTO jobs (id, kind, status, created_at, owner_host, owner_pid) VALUES (?, ?, ?, ?, ?, ?)',
+                (job.id, job.kind, job.status, job.created_at, self.host, os.getpid())
+            )
+
+    def save(self, job):
+        with job._lock:
+            row = (
+                job.status, job.stage, job.progress, json.dumps(job.timings),
+                json.dumps(job.result) if job.result is not None else None,
+                job.error, job.error_status, job.started_at, job.finished_at, job.id,
+            )
+        with self._connection() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, stage = ?, progress = ?, timings = ?, result = ?, error = ?, '
+                'error_status = ?, started_at = ?, finished_at = ? WHERE id = ?', row
+            )
+
+    def add_event(self, job_id, event_id, event, data):
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO job_events (job_id, event_id, event, data) VALUES (?, ?, ?, ?)',
+                (job_id, event_id, event, json.dumps(data))
+            )
+
+    def load(self, job_id):
+        with self._connection() as conn:
+            cursor = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return StoredJob(self, dict(zip((column[0] for column in cursor.description), row)))
+
+    # Events after 'after', and whether the job had finished before they were read
+    def events_since(self, job_id, after):
+        with self._connection() as conn:
+            # Read in this order: a finished job has written all of its events
+            finished = conn.execute('SELECT finished_at IS NOT NULL FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            rows = conn.execute(
+                'SELECT event_id, event, data FROM job_events WHERE job_id = ? AND event_id > ? ORDER BY event_id',
+                (job_id, after)
+            ).fetchall()
+        return [(event_id, event, json.loads(data)) for event_id, event, data in rows], finished is None or bool(finished[0])
+
+    # Fail unfinished jobs whose process is gone: those of owner_pids on this host, or when owner_pids is
+    # None, those whose process no longer runs here. Jobs owned by other hosts are left to those hosts
+    def fail_orphaned(self, owner_pids=None):
+        now = time.time()
+        with self._connection() as conn, transaction(conn):
+            rows = conn.execute(
+                f"SELECT id, owner_pid FROM jobs WHERE owner_host = ? AND status IN ({', '.join('?' for _ in ACTIVE_STATUSES)})",
+                (self.host, *ACTIVE_STATUSES)
+            ).fetchall()
+            orphaned = [
+                job_id for job_id, pid in rows
+                if (pid in owner_pids if owner_pids is not None else not _process_alive(pid))
+            ]
+            for job_id in orphaned:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, error_status = 503, finished_at = ? WHERE id = ?",
+                    (ORPHANED_JOB_ERROR, now, job_id)
+                )
+                # A last event, so clients streaming the job stop waiting
+                conn.execute(
+                    'INSERT INTO job_events (job_id, event_id, event, data) '
+                    "SELECT ?, COALESCE(MAX(event_id), 0) + 1, 'failed', ? FROM job_events WHERE job_id = ?",
+                    (job_id, json.dumps({'error': ORPHANED_JOB_ERROR}), job_id)
+                )
+        if orphaned:
+            logging.warning(f"Marked {len(orphaned)} jobs of stopped worker processes as failed.")
+        return len(orphaned)
+
+    # Drop finished jobs older than the retention window so the store stays bounded
+    def _expire_finished(self, conn):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        conn.execute('DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE finished_at < ?)', (cutoff,))
+        conn.execute('DELETE FROM jobs WHERE finished_at < ?', (cutoff,))
+
+
+# JobQueue: Bounded Worker Pool; Jobs Run in the Process That Accepted Them and Are Shared Through the Job Store
+class JobQueue:
+    def __init__(self, max_workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING, store=None):
+        self.max_pending = max_pending
+        self.store = store or JobStore()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='qpg-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, func, *args, **kwargs):
+        job = Job(kind, store=self.store)
+        try:
+            self.store.insert(job, self.max_pending)
+        except JobQueueFull:
+            JOBS_REJECTED.inc(kind=kind)
+            raise
+        with self._lock:
+            self._expire_finished()
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, func, args, kwargs)
+        logging.info(f"Queued {kind} job {job.id}.")
+        return job
+
+    # This process's jobs are served from memory, other processes' from the job store
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None else self.store.load(job_id)
+
+    # Fail jobs left unfinished by stopped worker processes (JobStore.fail_orphaned)
+    def recover(self, owner_pids=None):
+        return self.store.fail_orphaned(owner_pids)
+
+    # Metrics are per process: depth and counts cover this process's jobs
+    def depth(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == 'queued')
+
+    # Jobs in the registry per (kind, status), finished ones included until they expire
+    def counts(self):
+        counts = {}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[(job.kind, job.status)] = counts.get((job.kind, job.status), 0) + 1
+        return sorted(counts.items())
+
+    def _run(self, job, func, args, kwargs):
+        job.status = 'running'
+        job.started_at = time.time()
+        QUEUE_WAIT_SECONDS.observe(job.started_at - job.created_at, kind=job.kind)
+        try:
+            job.save()
+            result = func(job, *args, **kwargs)
+            job.result = result
+            job.status = 'succeeded'
+            job.progress = 1.0
+        except Exception as e:
+            # Pipeline errors carry a user-facing message and HTTP status
+            job.error = getattr(e, 'message', None) or 'An error occurred while processing the request.'
+            job.error_status = getattr(e, 'status_code', 500)
+            job.status = 'failed'
+            if not hasattr(e, 'status_code'):
+                logging.exception(f"Job {job.id} failed with an unexpected error.")
+            else:
+                logging.error(f"Job {job.id} failed: {job.error}")
+        finally:
+            try:
+                if job.status == 'succeeded':
+                    job.emit('done', job.result)
+                else:
+                    job.emit('failed', {'error': job.error})
+            finally:
+                with job._lock:
+                    job.finished_at = time.time()
+                    job._close_stage(job.finished_at)
+                    job._events_changed.notify_all()
+                JOB_SECONDS.observe(job.finished_at - job.started_at, kind=job.kind, status=job.status)
+                job.save()
+
+    # Drop finished jobs older than the retention window so the registry stays bounded
+    def _expire_finished(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+job_queue = JobQueue()
+metrics.callback('qpg_job_queue_depth', 'Jobs waiting for a job worker thread.', lambda: job_queue.depth())
+metrics.callback('qpg_jobs', 'Jobs run by the server processes, by kind and status (finished jobs until they expire).',
+                 lambda: job_queue.counts(), labels=('kind', 'status'))
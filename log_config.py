@@ -0,0 +1,148 @@
+import os
+import sys
+import queue
+import atexit
+import logging
+import itertools
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from metrics import metrics
+
+# Logging Configuration
+LOG_LEVEL = os.environ.get('QPG_LOG_LEVEL', 'INFO').upper()
+# Per-module levels, e.g. 'question_parser=DEBUG,werkzeug=WARNING'; a name is a module of this
+# project (file name without .py) or a library logger
+LOG_LEVELS = os.environ.get('QPG_LOG_LEVELS', '')
+LOG_FILE = os.environ.get('QPG_LOG_FILE', 'app.log')  # Empty logs to stdout only
+LOG_QUEUE_SIZE = int(os.environ.get('QPG_LOG_QUEUE_SIZE', 10000))  # Records beyond this are dropped, never waited on
+LOG_SAMPLE_EVERY = int(os.environ.get('QPG_LOG_SAMPLE_EVERY', 100))  # Per-token and per-row debug lines: log 1 in N
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+LOG_RECORDS_DROPPED = metrics.counter('qpg_log_records_dropped_total', 'Log records dropped because the log queue was full.')
+
+# Module name -> level, for records logged through the root logger
+_module_levels = {}
+_default_level = logging.INFO
+_listener = None
+_configure_lock = threading.Lock()
+
+
+def parse_levels(spec):
+    levels = {}
+    for item in spec.split(','):
+        name, _, level = item.partition('=')
+        if not name.strip() or not level.strip():
+            continue
+        levels[name.strip()] = logging.getLevelName(level.strip().upper())
+        if not isinstance(levels[name.strip()], int):
+            raise ValueError(f"Unknown log level '{level.strip()}' for '{name.strip()}'.")
+    return levels
+
+
+# Function: Whether a Module's Records at a Level Reach the Handlers
+# A cheap check for call sites whose log arguments are costly to compute
+def log_enabled(module, level=logging.DEBUG):
+    return level >= _module_levels.get(module, _default_level)
+
+
+# ModuleLevelFilter: Per-Module Levels for the Root Logger
+# The project logs through the root logger, so the level of a record's source module
+# (record.module) decides instead of the logger's
+class ModuleLevelFilter(logging.Filter):
+    def filter(self, record):
+        if record.name != 'root':
+            return True
+        return record.levelno >= _module_levels.get(record.module, _default_level)
+
+
+# AsyncQueueHandler: Hands Records to the Listener Thread Without Blocking the Caller
+class AsyncQueueHandler(QueueHandler):
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+    # Only the message is interpolated here (its arguments may change after the call);
+    # timestamps and the line layout are formatted on the listener thread. The record is
+    # changed in place: this is the root logger's only handler
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# _LogListener: Waits for Room for Its Stop Sentinel, So Records Already Queued Are Still Written
+class _LogListener(QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+# LogSampler: Lets Through the First of Every N Calls, for Per-Token and Per-Row Events
+class LogSampler:
+    def __init__(self, module, level=logging.DEBUG, every=None):
+        self.module = module
+        self.level = level
+        self.every = max(every or LOG_SAMPLE_EVERY, 1)
+        self._calls = itertools.count()
+
+    def __call__(self):
+        if not log_enabled(self.module, self.level):
+            return False
+        return next(self._calls) % self.every == 0
+
+
+# Function: Route All Logging Through a Queue to File and Console Handlers on a Background Thread
+def configure_logging(level=None, levels=None, log_file=None):
+    global _listener, _default_level
+    with _configure_lock:
+        if _listener is not None:
+            return
+        _default_level = logging.getLevelName((level or LOG_LEVEL).upper())
+        if not isinstance(_default_level, int):
+            raise ValueError(f"Unknown log level '{level or LOG_LEVEL}'.")
+        levels = parse_levels(LOG_LEVELS if levels is None else levels)
+        _module_levels.clear()
+        for name, module_level in levels.items():
+            _module_levels[name] = module_level
+            # Library loggers (werkzeug, urllib3, ...) filter by their own level
+            logging.getLogger(name).setLevel(module_level)
+
+        formatter = logging.Formatter(LOG_FORMAT)
+        handlers = [logging.StreamHandler(sys.stdout)]
+        log_file = LOG_FILE if log_file is None else log_file
+        if log_file:
+            handlers.insert(0, logging.FileHandler(log_file, encoding='utf-8'))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        queue_handler = AsyncQueueHandler(log_queue)
+        queue_handler.addFilter(ModuleLevelFilter())
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        # The root level lets through the most verbose level any module asked for
+        root.setLevel(min([_default_level, *_module_levels.values()]))
+
+        _listener = _LogListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+# Function: Flush Queued Records and Stop the Listener Thread
+def stop_logging():
+    global _listener
+    with _configure_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import math
+import atexit
+import bisect
+import logging
+import secrets
+import threading
+from contextlib import contextmanager
+
+# Metrics Configuration
+METRICS_ENABLED = os.environ.get('QPG_METRICS', '1') != '0'
+METRICS_DIR = os.environ.get('QPG_METRICS_DIR', '')  # Shared by worker processes (serve.py sets it); empty keeps metrics in-process
+METRICS_FLUSH_SECONDS = float(os.environ.get('QPG_METRICS_FLUSH_SECONDS', 5))  # How often each process writes its metrics there
+
+# Latency buckets in seconds: sub-millisecond SQLite writes up to multi-minute generations
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+THROUGHPUT_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _process_alive(pid):
+    if pid == os.getpid() or os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Function: Prometheus Text Lines for One Metric Snapshot
+def _render_snapshot(name, snapshot):
+    lines = [f"# HELP {name} {snapshot['help']}", f"# TYPE {name} {snapshot['kind']}"]
+    labels = snapshot['labels']
+    for key, value in sorted(snapshot['values'], key=lambda item: item[0]):
+        if snapshot['kind'] != 'histogram':
+            lines.append(f"{name}{_format_labels(labels, key)} {_format_value(value)}")
+            continue
+        counts, total, count = value
+        cumulative = 0
+        for bound, bucket_count in zip((*snapshot['buckets'], math.inf), counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_format_labels(labels, key, [('le', _format_value(bound))])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels, key)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labels, key)} {count}")
+    return lines
+
+
+# Function: Combine the Metric Snapshots of Several Processes
+# Totals ('total': counters, histograms) include processes that have exited, so they never go backwards;
+# gauges ('sum', 'min' or 'max') only include processes that are still running
+def _merge_snapshots(processes):
+    merged = {}
+    for alive, snapshots in processes:
+        for name, snapshot in snapshots.items():
+            aggregate = snapshot['aggregate']
+            if aggregate != 'total' and not alive:
+                continue
+            values = merged.setdefault(name, {**snapshot, 'values': {}})['values']
+            for key, value in snapshot['values']:
+                key = tuple(key)
+                current = values.get(key)
+                if current is None:
+                    values[key] = value
+                elif snapshot['kind'] == 'histogram':
+                    values[key] = [[a + b for a, b in zip(current[0], value[0])], current[1] + value[1], current[2] + value[2]]
+                elif aggregate == 'min':
+                    values[key] = min(current, value)
+                elif aggregate == 'max':
+                    values[key] = max(current, value)
+                else:
+                    values[key] = current + value
+    for snapshot in merged.values():
+        snapshot['values'] = [[list(key), value] for key, value in snapshot['values'].items()]
+    return merged
+
+
+# _Metric: Shared Name, Help Text, Label Names and Per-Label-Set State
+class _Metric:
+    kind = 'untyped'
+    aggregate = 'sum'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"Metric {self.name} takes labels {self.labels}, got {tuple(labels)}.")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _current_values(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    # The metric's current values as JSON-compatible data (rendered, or merged with other processes')
+    def snapshot(self):
+        return {'kind': self.kind, 'help': self.help_text, 'labels': list(self.labels), 'aggregate': self.aggregate,
+                'values': self._current_values()}
+
+    def render(self):
+        return _render_snapshot(self.name, self.snapshot())
+
+
+class Counter(_Metric):
+    kind = 'counter'
+    aggregate = 'total'
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+    aggregate = 'total'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    # Observe the duration of a block in seconds
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[2] if state else 0
+
+    def _current_values(self):
+        with self._lock:
+            return [[list(key), [[*counts], total, count]] for key, (counts, total, count) in self._values.items()]
+
+    def snapshot(self):
+        return {**super().snapshot(), 'buckets': list(self.buckets)}
+
+
+# CallbackMetric: Values Read from Another Component When Metrics Are Scraped
+# The callback returns a number, or a list of (label values, number) when the metric has labels.
+# Across processes counters are totalled; gauges are summed unless aggregate is 'min' or 'max'
+class CallbackMetric(_Metric):
+    def __init__(self, name, help_text, callback, labels=(), kind='gauge', aggregate=None):
+        super().__init__(name, help_text, labels)
+        self.kind = kind
+        self.aggregate = aggregate or ('total' if kind == 'counter' else 'sum')
+        self.callback = callback
+
+    def _current_values(self):
+        values = self.callback()
+        if not self.labels:
+            values = [((), values)]
+        return [[list(key), value] for key, value in values]
+
+
+# MetricsRegistry: Every Metric of the Process, Rendered in the Prometheus Text Format
+# With METRICS_DIR set, each process writes its snapshot there and a scrape renders all of them combined,
+# so any worker behind a shared socket answers for the whole server
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._file = None
+        self._file_pid = None
+        self._flush_lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # Modules re-imported (e.g. by the reloader) get the metric that already exists
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def callback(self, name, help_text, callback, labels=(), kind='gauge', aggregate=None):
+        with self._lock:
+            # Callbacks are replaced, so they always read the current component
+            self._metrics[name] = CallbackMetric(name, help_text, callback, labels, kind, aggregate)
+            return self._metrics[name]
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    # This process's file under METRICS_DIR; a new name per process, so a reused pid never overwrites a dead worker's totals
+    def _path(self):
+        if self._file_pid != os.getpid():
+            self._file_pid = os.getpid()
+            self._file = os.path.join(METRICS_DIR, f"{self._file_pid}-{secrets.token_hex(4)}.json")
+        return self._file
+
+    # Write this process's snapshot to METRICS_DIR and return it; snapshots are taken and written in turn,
+    # so the file never goes back to older totals, and replaced atomically, so readers never see a partial file
+    def flush(self):
+        with self._flush_lock:
+            snapshots = self.snapshot()
+            if METRICS_DIR:
+                path = self._path()
+                os.makedirs(METRICS_DIR, exist_ok=True)
+                with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump(snapshots, f)
+                os.replace(path + '.tmp', path)
+            return snapshots
+
+    def _other_processes(self):
+        own = os.path.basename(self._path())
+        for filename in os.listdir(METRICS_DIR):
+            if not filename.endswith('.json') or filename == own:
+                continue
+            try:
+                with open(os.path.join(METRICS_DIR, filename), encoding='utf-8') as f:
+                    snapshots = json.load(f)
+                pid = int(filename.split('-', 1)[0])
+            except (OSError, ValueError):
+                continue
+            yield _process_alive(pid), snapshots
+
+    def render(self):
+        if METRICS_DIR:
+            # Saved before it is served: a later scrape answered by another worker sees at least these totals
+            snapshots = _merge_snapshots([(True, self.flush()), *self._other_processes()])
+        else:
+            snapshots = self.snapshot()
+        lines = []
+        for name in sorted(snapshots):
+            lines.extend(_render_snapshot(name, snapshots[name]))
+        return '\n'.join(lines) + '\n'
+
+    # Remove the files of earlier processes, so a restarted server starts its totals from zero
+    def clear_shared(self):
+        if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+            return
+        own = os.path.basename(self._path())
+        for filename in os.listdir(METRICS_DIR):
+            if not filename.startswith(own):
+                try:
+                    os.unlink(os.path.join(METRICS_DIR, filename))
+                except FileNotFoundError:
+                    pass
+
+    # Write the snapshot every METRICS_FLUSH_SECONDS, and once more when the process exits
+    def start_sharing(self):
+        def flush_periodically():
+            while True:
+                time.sleep(METRICS_FLUSH_SECONDS)
+                try:
+                    self.flush()
+                except Exception:
+                    logging.exception("Could not write shared metrics.")
+
+        threading.Thread(target=flush_periodically, name='qpg-metrics-flush', daemon=True).start()
+        atexit.register(self.flush)
+
+
+metrics = MetricsRegistry()
+if METRICS_DIR:
+    metrics.start_sharing()
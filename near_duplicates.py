@@ -0,0 +1,144 @@
+import os
+import re
+import array
+import hashlib
+import logging
+
+# Near-Duplicate Detection Configuration
+DEDUP_MODES = ('cluster', 'reject', 'off')
+DEDUP_MODE = os.environ.get('QPG_DEDUP_MODE', 'cluster')
+DEDUP_THRESHOLD = float(os.environ.get('QPG_DEDUP_THRESHOLD', 0.75))  # Estimated Jaccard similarity of shingle sets
+if DEDUP_MODE not in DEDUP_MODES:
+    raise ValueError(f"Unknown QPG_DEDUP_MODE '{DEDUP_MODE}'; expected one of: {', '.join(DEDUP_MODES)}.")
+
+# 64 MinHash values split into 16 bands of 4 rows: pairs at similarity 0.75 share a band with
+# probability ~0.998, pairs at 0.3 only ~12% of the time, so thresholds of 0.5 and up are reliable
+NUM_PERM = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+WORD_PATTERN = re.compile(r'[a-z0-9]+')
+# Question verbs and function words carry no topic; 'Explain X' and 'Describe X' are the same question
+STOP_WORDS = frozenset(
+    'a an the of in on for to and or with without is are be been what how why which when where who '
+    'explain describe discuss define compare contrast write short note notes brief briefly detail detailed '
+    'its their this that these those by as from at into using example examples give list state'.split()
+)
+
+
+def _permutations():
+    # Fixed seeds so signatures stored in the database stay comparable across processes and restarts
+    seed = hashlib.blake2b(b'qpg-minhash', digest_size=64).digest()
+    params = []
+    for i in range(NUM_PERM):
+        block = hashlib.blake2b(seed + i.to_bytes(2, 'big'), digest_size=16).digest()
+        a = int.from_bytes(block[:8], 'big') % (_MERSENNE_PRIME - 1) + 1
+        b = int.from_bytes(block[8:], 'big') % _MERSENNE_PRIME
+        params.append((a, b))
+    return params
+
+
+PERMUTATIONS = _permutations()
+
+
+# Function: Character Shingles over a Question's Content Words
+def shingles(text):
+    words = [word for word in WORD_PATTERN.findall(text.lower()) if word not in STOP_WORDS]
+    normalized = ' '.join(words)
+    if len(normalized) <= SHINGLE_SIZE:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+
+# Function: MinHash Signature of a Question
+def minhash(text):
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for shingle in shingles(text)
+    ]
+    if not hashes:
+        return (_MERSENNE_PRIME,) * NUM_PERM
+    return tuple(
+        min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+        for a, b in PERMUTATIONS
+    )
+
+
+# Function: Estimated Jaccard Similarity of Two Signatures
+def similarity(signature, other):
+    return sum(1 for x, y in zip(signature, other) if x == y) / NUM_PERM
+
+
+# Function: LSH Bucket Keys, One per Band (signed 64-bit so SQLite stores them as INTEGER)
+def band_keys(signature):
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(
+            array.array('Q', (band, *rows)).tobytes(), digest_size=8
+        ).digest()
+        keys.append(int.from_bytes(digest, 'big', signed=True))
+    return keys
+
+
+def pack_signature(signature):
+    return array.array('Q', signature).tobytes()
+
+
+def unpack_signature(blob):
+    return tuple(array.array('Q', blob))
+
+
+# NearDuplicateIndex: LSH Lookups Against a (Unit, Marks) Slot's Stored Questions Plus a Pending Batch
+class NearDuplicateIndex:
+    def __init__(self, conn, threshold=DEDUP_THRESHOLD):
+        self.conn = conn
+        self.threshold = threshold
+        self._pending = {}  # (unit_id, marks, bucket) -> [(question_id, cluster_id, signature)]
+        self._bucket_rows = []
+        self._signature_rows = []
+
+    # Returns (signature, (question_id, cluster_id, similarity) of the closest match or None)
+    def find(self, unit_id, marks, text):
+        signature = minhash(text)
+        keys = band_keys(signature)
+        candidates = {}
+        placeholders = ', '.join('?' for _ in keys)
+        # Only questions sharing at least one band bucket are compared, so a lookup touches a handful of rows
+        for question_id, cluster_id, blob in self.conn.execute(
+            'SELECT DISTINCT l.question_id, q.cluster_id, s.signature '
+            'FROM question_lsh l JOIN questions q ON q.id = l.question_id '
+            'JOIN question_signatures s ON s.question_id = l.question_id '
+            f'WHERE l.unit_id = ? AND l.bucket IN ({placeholders}) AND q.marks = ?',
+            (unit_id, *keys, marks)
+        ):
+            candidates[question_id] = (cluster_id, unpack_signature(blob))
+        for key in keys:
+            for question_id, cluster_id, other in self._pending.get((unit_id, marks, key), ()):
+                candidates[question_id] = (cluster_id, other)
+
+        best = None
+        for question_id, (cluster_id, other) in candidates.items():
+            score = similarity(signature, other)
+            if score >= self.threshold and (best is None or score > best[2]):
+                best = (question_id, cluster_id or question_id, score)
+        return signature, best
+
+    # Queue a stored question for indexing; written in bulk by flush()
+    def add(self, unit_id, marks, question_id, cluster_id, signature):
+        for key in band_keys(signature):
+            self._pending.setdefault((unit_id, marks, key), []).append((question_id, cluster_id, signature))
+            self._bucket_rows.append((unit_id, key, question_id))
+        self._signature_rows.append((question_id, pack_signature(signature)))
+
+    def flush(self):
+        if self._signature_rows:
+            self.conn.executemany('INSERT INTO question_signatures (question_id, signature) VALUES (?, ?)', self._signature_rows)
+            self.conn.executemany('INSERT INTO question_lsh (unit_id, bucket, question_id) VALUES (?, ?, ?)', self._bucket_rows)
+            logging.debug("Indexed %d questions for near-duplicate detection.", len(self._signature_rows))
+        self._pending = {}
+        self._bucket_rows = []
+        self._signature_rows = []
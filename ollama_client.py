@@ -0,0 +1,184 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+
+# Ollama Backend Configuration
+OLLAMA_HOSTS = [
+    host.strip().rstrip('/')
+    for host in os.environ.get('OLLAMA_HOSTS', 'http://localhost:11434').split(',')
+    if host.strip()
+]
+OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'llama3.2-vision')
+OLLAMA_KEEP_ALIVE = os.environ.get('OLLAMA_KEEP_ALIVE', '10m')
+OLLAMA_NUM_CTX = os.environ.get('OLLAMA_NUM_CTX')
+OLLAMA_NUM_PREDICT = os.environ.get('OLLAMA_NUM_PREDICT')
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get('OLLAMA_CONNECT_TIMEOUT', 5))
+OLLAMA_READ_TIMEOUT = float(os.environ.get('OLLAMA_READ_TIMEOUT', 120))  # Longest allowed gap between streamed chunks
+OLLAMA_POOL_SIZE = int(os.environ.get('OLLAMA_POOL_SIZE', 16))
+OLLAMA_HEALTH_INTERVAL = float(os.environ.get('OLLAMA_HEALTH_INTERVAL', 30))
+
+
+class OllamaUnavailable(Exception):
+    pass
+
+
+# Function: Sampling Options Sent with Every Generation
+def default_options():
+    options = {}
+    if OLLAMA_NUM_CTX:
+        options['num_ctx'] = int(OLLAMA_NUM_CTX)
+    if OLLAMA_NUM_PREDICT:
+        options['num_predict'] = int(OLLAMA_NUM_PREDICT)
+    return options
+
+
+# OllamaBackend: One Ollama Host and Its Load/Health State
+class OllamaBackend:
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.healthy = True
+        self.checked_at = 0.0
+        self.failures = 0
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'outstanding': self.outstanding,
+            'failures': self.failures,
+            'checked_at': self.checked_at,
+        }
+
+
+# OllamaClient: Pooled Keep-Alive Session Balanced Across Ollama Hosts
+class OllamaClient:
+    def __init__(self, hosts=None, model=OLLAMA_MODEL, options=None, keep_alive=OLLAMA_KEEP_ALIVE,
+                 connect_timeout=OLLAMA_CONNECT_TIMEOUT, read_timeout=OLLAMA_READ_TIMEOUT,
+                 pool_size=OLLAMA_POOL_SIZE, health_interval=OLLAMA_HEALTH_INTERVAL):
+        self.backends = [OllamaBackend(url) for url in (hosts or OLLAMA_HOSTS)]
+        self.model = model
+        self.options = default_options() if options is None else options
+        self.keep_alive = keep_alive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.backends), pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    # Open a streaming /api/generate request on the least busy healthy backend
+    @contextmanager
+    def stream_generate(self, prompt, model=None, options=None):
+        payload = {
+            'model': model or self.model,
+            'prompt': prompt,
+            'options': self.options if options is None else options,
+            'keep_alive': self.keep_alive,
+        }
+        tried = set()
+        while True:
+            backend = self._acquire(exclude=tried)
+            tried.add(backend.url)
+            try:
+                response = self.session.post(
+                    f"{backend.url}/api/generate",
+                    json=payload,
+                    stream=True,
+                    timeout=(self.connect_timeout, self.read_timeout)
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                # Nothing was generated yet, so fail over to the next backend
+                self._release(backend, failed=True)
+                logging.warning(f"Ollama backend {backend.url} is unreachable: {e}")
+                if len(tried) >= len(self.backends):
+                    raise OllamaUnavailable('No Ollama backend could be reached.')
+                continue
+            break
+
+        failed = False
+        try:
+            yield response
+        except requests.exceptions.RequestException:
+            failed = True
+            raise
+        finally:
+            response.close()
+            self._release(backend, failed=failed)
+
+    # Probe every backend; returns their status for monitoring
+    def check_health(self):
+        for backend in self.backends:
+            self._probe(backend)
+        with self._lock:
+            return [backend.to_dict() for backend in self.backends]
+
+    def _acquire(self, exclude=()):
+        now = time.time()
+        # Re-probe unhealthy backends once their health interval has passed
+        for backend in self.backends:
+            if not backend.healthy and backend.url not in exclude and now - backend.checked_at >= self.health_interval:
+                self._probe(backend)
+        with self._lock:
+            candidates = [b for b in self.backends if b.healthy and b.url not in exclude]
+            if not candidates:
+                # Every backend looks down; try the least recently failed one anyway
+                candidates = sorted(
+                    (b for b in self.backends if b.url not in exclude), key=lambda b: b.checked_at
+                )[:1]
+            if not candidates:
+                raise OllamaUnavailable('No Ollama backend could be reached.')
+            backend = min(candidates, key=lambda b: b.outstanding)
+            backend.outstanding += 1
+            return backend
+
+    def _release(self, backend, failed=False):
+        with self._lock:
+            backend.outstanding -= 1
+            if failed:
+                backend.healthy = False
+                backend.failures += 1
+                backend.checked_at = time.time()
+            elif not backend.healthy:
+                backend.healthy = True
+
+    def _probe(self, backend):
+        try:
+            response = self.session.get(f"{backend.url}/api/tags", timeout=(self.connect_timeout, self.connect_timeout))
+            healthy = response.status_code == 200
+            response.close()
+        except requests.exceptions.RequestException:
+            healthy = False
+        with self._lock:
+            if healthy != backend.healthy:
+                logging.info(f"Ollama backend {backend.url} is now {'healthy' if healthy else 'unhealthy'}.")
+            backend.healthy = healthy
+            backend.checked_at = time.time()
+            if not healthy:
+                backend.failures += 1
+
+
+ollama_client = OllamaClient()
+
+
+def _backend_values(field):
+    with ollama_client._lock:
+        return [((backend.url,), int(getattr(backend, field))) for backend in ollama_client.backends]
+
+
+metrics.callback('qpg_ollama_backend_outstanding', 'Generation requests in flight per Ollama backend.',
+                 lambda: _backend_values('outstanding'), labels=('backend',))
+metrics.callback('qpg_ollama_backend_healthy', '1 if every worker process considers the Ollama backend healthy.',
+                 lambda: _backend_values('healthy'), labels=('backend',), aggregate='min')
+metrics.callback('qpg_ollama_backend_failures_total', 'Failed requests and health probes per Ollama backend.',
+                 lambda: _backend_values('failures'), labels=('backend',), kind='counter')
@@ -0,0 +1,310 @@
+import os
+import math
+import time
+import random
+import logging
+import itertools
+
+from metrics import metrics
+
+# Paper Assembly Configuration
+MAX_OVERLAP = os.environ.get('QPG_MAX_OVERLAP', '')  # Shared questions allowed between two variants (parse_overlap); empty for no limit
+ASSEMBLY_RESTARTS = int(os.environ.get('QPG_ASSEMBLY_RESTARTS', 3))
+CANDIDATE_SAMPLE = int(os.environ.get('QPG_ASSEMBLY_CANDIDATES', 48))  # Candidates scored per slot from the least-used tier
+
+# Questions per unit, keyed by marks
+DEFAULT_PER_UNIT = {'4': 1, '6': 1}
+
+ASSEMBLY_SECONDS = metrics.histogram('qpg_paper_assembly_seconds', 'Time to assemble a set of paper variants.', ('outcome',))
+
+
+class AssemblyError(Exception):
+    pass
+
+
+# PaperConstraints: What Every Variant Must Satisfy
+class PaperConstraints:
+    def __init__(self, per_unit=None, total_marks=None, bt_distribution=None, co_coverage=None, max_overlap=MAX_OVERLAP):
+        self.per_unit = {str(marks): int(count) for marks, count in (per_unit or DEFAULT_PER_UNIT).items() if int(count) > 0}
+        if not self.per_unit:
+            raise AssemblyError('At least one question per unit is required.')
+        self.total_marks = int(total_marks) if total_marks else None
+        # Exact number of questions per BT level in each paper; missing levels are not restricted
+        self.bt_distribution = {int(level): int(count) for level, count in (bt_distribution or {}).items()}
+        self.co_coverage = {int(co) for co in (co_coverage or ())}
+        self.max_overlap = max_overlap
+        self.overlap_count, self.overlap_fraction = parse_overlap(max_overlap)
+
+    @property
+    def marks(self):
+        return tuple(int(marks) for marks in self.per_unit)
+
+    def paper_marks(self, units):
+        return units * sum(int(marks) * count for marks, count in self.per_unit.items())
+
+    def paper_size(self, units):
+        return units * sum(self.per_unit.values())
+
+    # Resolve the overlap limit to a question count for papers of this size (None = unlimited)
+    def overlap_limit(self, units):
+        if self.overlap_fraction is not None:
+            return int(self.overlap_fraction * self.paper_size(units))
+        return self.overlap_count
+
+    # Parse constraints from query parameters, e.g. ?per_unit=4:1,6:1&bt=2:4,3:4&co=1,2&max_overlap=0.5
+    @classmethod
+    def from_args(cls, args, per_unit=None):
+        try:
+            return cls(
+                per_unit=_parse_pairs(args.get('per_unit')) or per_unit,
+                total_marks=args.get('total_marks'),
+                bt_distribution=_parse_pairs(args.get('bt')),
+                co_coverage=[co for co in (args.get('co') or '').split(',') if co.strip()],
+                max_overlap=args.get('max_overlap', MAX_OVERLAP)
+            )
+        except ValueError as e:
+            raise AssemblyError(f"Invalid paper constraints: {e}")
+
+
+# Function: Parse an Overlap Limit; returns (count, fraction), at most one of them set
+# A whole number is a count of questions ('1' is one question), a percentage ('50%') or a number
+# below 1 ('0.5') is a share of the paper; empty means no limit
+def parse_overlap(value):
+    text = str(value).strip() if value is not None else ''
+    if not text:
+        return None, None
+    try:
+        number = float(text[:-1]) / 100 if text.endswith('%') else float(text)
+    except ValueError:
+        number = math.nan
+    if not math.isfinite(number) or number < 0:
+        raise AssemblyError(f"max_overlap must be a question count, a fraction below 1 or a percentage, not '{value}'.")
+    if text.endswith('%'):
+        if number > 1:
+            raise AssemblyError(f"max_overlap cannot be more than 100%, got '{value}'.")
+        return None, number
+    if number < 1:
+        return None, number
+    if not number.is_integer():
+        raise AssemblyError(f"max_overlap of 1 or more is a question count and must be a whole number, got '{value}'.")
+    return int(number), None
+
+
+def _parse_pairs(value):
+    pairs = {}
+    for item in (value or '').split(','):
+        if item.strip():
+            key, separator, count = item.partition(':')
+            if not separator:
+                raise ValueError(f"expected 'key:count' pairs, got '{item}'")
+            pairs[key.strip()] = int(count)
+    return pairs
+
+
+# _SlotPool: One Unit's Questions of One Marks Value, Tiered by How Many Variants Already Use Them
+class _SlotPool:
+    def __init__(self, questions, rng):
+        questions = list(questions)
+        rng.shuffle(questions)
+        self.questions = {question['id']: question for question in questions}
+        self.tiers = [list(self.questions)]
+        self.position = {question_id: (0, index) for index, question_id in enumerate(self.tiers[0])}
+
+    def promote(self, question_id):
+        tier, index = self.position[question_id]
+        # Swap-remove from the current tier, append to the next one
+        members = self.tiers[tier]
+        last = members.pop()
+        if last != question_id:
+            members[index] = last
+            self.position[last] = (tier, index)
+        if tier + 1 == len(self.tiers):
+            self.tiers.append([])
+        self.tiers[tier + 1].append(question_id)
+        self.position[question_id] = (tier + 1, len(self.tiers[tier + 1]) - 1)
+
+
+# Function: Check a Bank Pool Can Fill the Constraints; Returns a List of Problems
+def check_pool(unit_questions, constraints):
+    problems = []
+    units = len(unit_questions)
+    for unit, pools in unit_questions.items():
+        for marks, count in constraints.per_unit.items():
+            available = len(pools.get(marks, ()))
+            if available < count:
+                problems.append(f"{unit} has {available} {marks}-mark questions, {count} needed per paper")
+    if constraints.total_marks and constraints.total_marks != constraints.paper_marks(units):
+        problems.append(
+            f"{units} units with {constraints.per_unit} questions per unit give {constraints.paper_marks(units)} marks, "
+            f"not {constraints.total_marks}"
+        )
+    if constraints.bt_distribution:
+        wanted, size = sum(constraints.bt_distribution.values()), constraints.paper_size(units)
+        if wanted > size:
+            problems.append(f"The BT distribution asks for {wanted} questions, but a paper has {size}")
+        available_bt = {}
+        for pools in unit_questions.values():
+            for marks in constraints.per_unit:
+                for q in pools.get(marks, ()):
+                    available_bt[q['bt']] = available_bt.get(q['bt'], 0) + 1
+        for level, target in sorted(constraints.bt_distribution.items()):
+            if available_bt.get(level, 0) < target:
+                problems.append(f"{available_bt.get(level, 0)} questions are at BT level {level}, {target} needed per paper")
+    if constraints.co_coverage:
+        available_cos = {q['co'] for pools in unit_questions.values() for qs in pools.values() for q in qs}
+        missing = sorted(constraints.co_coverage - available_cos)
+        if missing:
+            problems.append(f"No questions cover CO {missing}")
+    return problems
+
+
+# Function: Assemble N Paper Variants from a Bank Pool
+# Greedy fill, slot by slot: candidates are drawn from the least-used tiers of each slot's pool,
+# rejected if they would push any earlier variant past the overlap limit, and ranked by BT target
+# excess, CO coverage, BT targets filled, worst overlap with an earlier variant, then usage. CO coverage
+# and the BT distribution are checked on every finished paper. Each pick scores a bounded
+# sample, O(candidates x variants already using the candidate), so cost does not grow with pool size.
+def assemble_papers(unit_questions, num_papers, constraints=None, seed=None):
+    constraints = constraints or PaperConstraints()
+    problems = check_pool(unit_questions, constraints)
+    if problems:
+        raise AssemblyError('; '.join(problems))
+
+    rng = random.Random(seed)
+    last_error = None
+    start = time.perf_counter()
+    for attempt in range(max(ASSEMBLY_RESTARTS, 1)):
+        try:
+            papers = _assemble(unit_questions, num_papers, constraints, rng)
+        except AssemblyError as e:
+            last_error = e
+            logging.info(f"Paper assembly attempt {attempt + 1} failed: {e}")
+            continue
+        ASSEMBLY_SECONDS.observe(time.perf_counter() - start, outcome='assembled')
+        return papers, assembly_stats(papers)
+    ASSEMBLY_SECONDS.observe(time.perf_counter() - start, outcome='failed')
+    raise last_error
+
+
+def _assemble(unit_questions, num_papers, constraints, rng):
+    units = list(unit_questions)
+    limit = constraints.overlap_limit(len(units))
+    slots = [
+        ((unit, marks), _SlotPool(unit_questions[unit][marks], rng), count)
+        for unit in units
+        for marks, count in constraints.per_unit.items()
+    ]
+    used_by = {}  # question id -> indexes of earlier variants containing it
+    papers = []
+    paper_size = sum(count for _, _, count in slots)
+
+    for paper_index in range(num_papers):
+        overlap = [0] * paper_index  # Questions this variant shares with each earlier variant so far
+        bt_counts = {}
+        missing_cos = set(constraints.co_coverage)
+        chosen = set()
+        paper = {unit: {marks: [] for marks in constraints.per_unit} for unit in units}
+        remaining = paper_size
+
+        # Varying the fill order keeps the last slots from always getting the leftovers
+        rng.shuffle(slots)
+        for (unit, marks), pool, count in slots:
+            for _ in range(count):
+                question_id = _pick(pool, chosen, used_by, overlap, limit, bt_counts, remaining, missing_cos, constraints, rng)
+                if question_id is None:
+                    raise AssemblyError(
+                        f"Could not fill {unit} ({marks} marks) for paper {paper_index + 1} "
+                        f"without exceeding {limit} shared questions with an earlier paper"
+                    )
+                question = pool.questions[question_id]
+                for other in used_by.get(question_id, ()):
+                    overlap[other] += 1
+                chosen.add(question_id)
+                bt_counts[question['bt']] = bt_counts.get(question['bt'], 0) + 1
+                missing_cos.discard(question['co'])
+                paper[unit][marks].append(question)
+                remaining -= 1
+
+        if missing_cos:
+            raise AssemblyError(f"Paper {paper_index + 1} does not cover CO {sorted(missing_cos)}")
+        bt_misses = _bt_misses(bt_counts, constraints)
+        if bt_misses:
+            raise AssemblyError(f"Paper {paper_index + 1} does not meet the BT distribution: {bt_misses}")
+        for (unit, marks), pool, count in slots:
+            for question in paper[unit][marks]:
+                pool.promote(question['id'])
+                used_by.setdefault(question['id'], []).append(paper_index)
+        papers.append(paper)
+    return papers
+
+
+# BT level -> (questions at that level, target) for each level whose target a paper misses
+def _bt_misses(bt_counts, constraints):
+    return {
+        level: (bt_counts.get(level, 0), target)
+        for level, target in sorted(constraints.bt_distribution.items())
+        if bt_counts.get(level, 0) != target
+    }
+
+
+# 'remaining' counts the paper's unfilled slots, this one included
+def _pick(pool, chosen, used_by, overlap, limit, bt_counts, remaining, missing_cos, constraints, rng):
+    best, best_score = None, None
+    # Questions still needed to reach the BT targets; once they take every remaining slot, only they fit
+    bt_needed = sum(max(target - bt_counts.get(level, 0), 0) for level, target in constraints.bt_distribution.items())
+    scored = 0
+    # Least-used tiers first; stop once a tier's worth of candidates has been scored
+    for usage, tier in enumerate(pool.tiers):
+        if scored >= CANDIDATE_SAMPLE and best is not None:
+            break
+        candidates = tier if len(tier) <= CANDIDATE_SAMPLE else rng.sample(tier, CANDIDATE_SAMPLE)
+        for question_id in candidates:
+            if question_id in chosen:
+                continue
+            scored += 1
+            worst = max((overlap[other] for other in used_by.get(question_id, ())), default=-1) + 1
+            if limit is not None and worst > limit:
+                continue
+            question = pool.questions[question_id]
+            target = constraints.bt_distribution.get(question['bt'])
+            bt_fill = 1 if target is not None and bt_counts.get(question['bt'], 0) < target else 0
+            bt_excess = max(bt_counts.get(question['bt'], 0) + 1 - target, 0) if target is not None else 0
+            if not bt_fill and bt_needed >= remaining:
+                bt_excess += 1
+            co_gain = 1 if question['co'] in missing_cos else 0
+            score = (bt_excess, -co_gain, -bt_fill, worst, usage)
+            if best_score is None or score < best_score:
+                best, best_score = question_id, score
+                # Nothing can do better than an unused question that fits every target
+                if bt_excess == 0 and worst == 0 and (co_gain or not missing_cos) and (bt_fill or not bt_needed):
+                    return best
+    return best
+
+
+# Function: Overlap and Coverage Summary of an Assembled Paper Set
+def assembly_stats(papers):
+    question_sets = [
+        {question['id'] for pools in paper.values() for questions in pools.values() for question in questions}
+        for paper in papers
+    ]
+    overlaps = [len(a & b) for a, b in itertools.combinations(question_sets, 2)]
+    bt_levels = []
+    for paper in papers:
+        counts = {}
+        for pools in paper.values():
+            for questions in pools.values():
+                for question in questions:
+                    counts[question['bt']] = counts.get(question['bt'], 0) + 1
+        bt_levels.append({str(level): counts[level] for level in sorted(counts)})
+    return {
+        'papers': len(papers),
+        'questions_per_paper': len(question_sets[0]) if question_sets else 0,
+        'distinct_questions': len(set().union(*question_sets)) if question_sets else 0,
+        'max_pairwise_overlap': max(overlaps, default=0),
+        'mean_pairwise_overlap': round(sum(overlaps) / len(overlaps), 3) if overlaps else 0,
+        'bt_levels': bt_levels,  # Questions per BT level, per paper
+    }
+
+
+# The default limit is checked at import, like the other settings
+parse_overlap(MAX_OVERLAP)
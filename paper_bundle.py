@@ -0,0 +1,71 @@
+import os
+import hashlib
+import zipfile
+from datetime import datetime, timezone
+
+# Paper Bundle Configuration
+BUNDLE_READ_SIZE = 64 * 1024
+
+
+# _ZipSink: Write-Only File Object That Hands ZIP Bytes Back to the Response Generator
+class _ZipSink:
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    # tell() without seek() makes zipfile stream entries with data descriptors
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+# Function: Weak Validator for a Set of Files (changes whenever any member is re-rendered)
+def bundle_etag(paths):
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_mtime_ns}:{stat.st_size}\n".encode())
+    return digest.hexdigest()
+
+
+# Function: Latest Modification Time Across a Set of Files
+def bundle_last_modified(paths):
+    return datetime.fromtimestamp(max(os.stat(path).st_mtime for path in paths), tz=timezone.utc)
+
+
+# Function: Stream a ZIP of the Given Files Without Holding Them in Memory
+def stream_zip(paths):
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w') as bundle:
+        for path in paths:
+            # Rendered PDFs are already compressed, so entries are stored as-is
+            info = zipfile.ZipInfo.from_file(path, arcname=os.path.basename(path))
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, 'rb') as source, bundle.open(info, 'w') as entry:
+                while True:
+                    block = source.read(BUNDLE_READ_SIZE)
+                    if not block:
+                        break
+                    entry.write(block)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # Central directory is written when the archive closes
+    data = sink.drain()
+    if data:
+        yield data
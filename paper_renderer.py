@@ -0,0 +1,302 @@
+import os
+import re
+import time
+import logging
+import tempfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib import colors
+
+from metrics import metrics
+
+# Paper Rendering Configuration
+RENDER_WORKERS = int(os.environ.get('QPG_RENDER_WORKERS', os.cpu_count() or 1))
+
+PAPER_TEMPLATE_CACHE_SIZE = 16  # Layouts kept per process; course and date are part of the layout
+
+CO_PATTERN = re.compile(r'\[CO:(\d+)\]')
+BT_PATTERN = re.compile(r'\[BT:(\d+)\]')
+CO_BT_TAGS_PATTERN = re.compile(r'\[CO:\d+\]\s*\[BT:\d+\]')
+
+_render_pool = None
+_render_pool_lock = threading.RLock()
+
+# Rendering Metrics
+RENDER_SECONDS = metrics.histogram('qpg_render_seconds', 'Time to render one set of question paper PDFs.')
+PAPERS_RENDERED = metrics.counter('qpg_papers_rendered_total', 'Question paper PDFs rendered.')
+
+
+# PaperTemplate: Styles, Title Block and Table Styling Built Once per Paper Layout
+class PaperTemplate:
+    col_widths = [80, 60, 300, 40, 40, 40]
+
+    def __init__(self, exam_title="Exam Question Paper", course="Data Communications",
+                 instructor="Dr. Jane Doe", date="23-Nov-2024", duration_minutes=None, total_marks=None,
+                 sections=None):
+        self.styles = getSampleStyleSheet()
+        self.normal_style = self.styles['Normal']
+
+        # Define a custom style for main titles
+        self.main_title_style = ParagraphStyle(
+            name='MainTitle',
+            parent=self.styles['Heading1'],
+            alignment=1,  # Center alignment
+            spaceAfter=12
+        )
+
+        # Define a custom style for table headers
+        self.header_style = ParagraphStyle(
+            name='TableHeader',
+            parent=self.styles['Normal'],
+            fontName='Helvetica-Bold',
+            fontSize=10,
+            alignment=1,  # Center alignment
+            textColor=colors.whitesmoke
+        )
+
+        self.exam_title = exam_title
+        self.course = course
+        self.instructor = instructor
+        self.date = date
+        self.duration_minutes = duration_minutes
+        self.total_marks = total_marks
+        # The title block and header row are reused across papers; ReportLab sets drawing state on
+        # flowables while a document is built, so each thread rendering with this template has its own
+        self._local = threading.local()
+
+        # (name, instructions, ((marks, count per unit), ...), attempt) per section; None puts every question in one table
+        self.sections = sections or (('', '', None, None),)
+        self.section_style = self.styles['Heading3']
+
+        self.base_style_commands = [
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
+
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+
+            ('GRID', (0, 0), (-1, -1), 1, colors.black),
+        ]
+        self._row_background_cache = {}
+
+    # Alternate row colors (starting from the first data row), computed once per row layout
+    def row_background_commands(self, blank_rows, row_count):
+        key = (row_count, blank_rows)
+        commands = self._row_background_cache.get(key)
+        if commands is None:
+            commands = []
+            for i in range(1, row_count):
+                # Skip blank rows
+                if i in blank_rows:
+                    continue
+                elif i % 7 == 0:
+                    # Every 7th row is a blank row; skip coloring
+                    continue
+                elif i % 2 == 0:
+                    bg_color = colors.lightgrey
+                else:
+                    bg_color = colors.whitesmoke
+                commands.append(('BACKGROUND', (0, i), (-1, i), bg_color))
+            self._row_background_cache[key] = commands
+        return commands
+
+    # This thread's title block and table header row; they are only wrapped, never split, so they are reused
+    def shared_flowables(self):
+        local = self._local
+        if not hasattr(local, 'title_block'):
+            # Main titles at the top
+            title_block = [Paragraph(self.exam_title, self.main_title_style)]
+            if self.course:
+                title_block.append(Paragraph(f"Course: {self.course}", self.styles['Heading2']))
+            if self.instructor:
+                title_block.append(Paragraph(f"Instructor: {self.instructor}", self.normal_style))
+            title_block.append(Paragraph(f"Date: {self.date}", self.normal_style))
+            paper_terms = []
+            if self.duration_minutes:
+                paper_terms.append(f"Time: {format_duration(self.duration_minutes)}")
+            if self.total_marks:
+                paper_terms.append(f"Maximum Marks: {self.total_marks}")
+            if paper_terms:
+                title_block.append(Paragraph(' &nbsp;&nbsp;|&nbsp;&nbsp; '.join(paper_terms), self.normal_style))
+            title_block.append(Spacer(1, 24))
+            local.title_block = title_block
+            local.header_row = [
+                Paragraph(label, self.header_style)
+                for label in ('Question No', 'Subquestion', 'Question Text', 'CO', 'BT', 'Marks')
+            ]
+        return local.title_block, local.header_row
+
+    def build_elements(self, unit_questions):
+        title_block, header_row = self.shared_flowables()
+        elements = list(title_block)
+        # Questions already placed per unit and marks; each section takes the next ones from the paper's lists
+        taken = {unit: {} for unit in unit_questions}
+
+        # Initialize question number
+        question_num = 1
+
+        for name, instructions, per_unit, attempt in self.sections:
+            # Define table data with headers
+            table_data = [header_row]
+            blank_rows = []
+            section_questions = 0
+
+            for unit, questions in unit_questions.items():
+                selected_questions = []
+                for marks, count in (per_unit or [(marks, len(marks_questions)) for marks, marks_questions in questions.items()]):
+                    start = taken[unit].get(marks, 0)
+                    selected_questions.extend(questions.get(marks, [])[start:start + count])
+                    taken[unit][marks] = start + count
+                if not selected_questions:
+                    continue
+
+                for idx, question in enumerate(selected_questions):
+                    table_data.append(self.question_row(question_num, chr(97 + idx), question))  # 'a', 'b', ...
+                section_questions += len(selected_questions)
+
+                # Add a blank row after each unit for differentiation
+                blank_rows.append(len(table_data))
+                table_data.append(['', '', '', '', '', ''])
+
+                question_num += 1  # Increment main question number for next unit
+
+            if name:
+                elements.append(Paragraph(name, self.section_style))
+            if attempt and not instructions:
+                instructions = f"Answer any {attempt} of the {section_questions} questions."
+            if instructions:
+                elements.extend([Paragraph(instructions, self.normal_style), Spacer(1, 6)])
+
+            # One TableStyle carrying the shared commands plus this table's row backgrounds
+            style_commands = self.base_style_commands + self.row_background_commands(tuple(blank_rows), len(table_data))
+            table = Table(table_data, colWidths=self.col_widths, repeatRows=1, style=TableStyle(style_commands))
+            elements.extend([table, Spacer(1, 24)])  # Space after the table
+
+        return elements
+
+    def question_row(self, question_num, sub_label, question):
+        if 'co' in question:
+            # Questions from the bank carry typed CO/BT columns and untagged text
+            co = question['co'] if question['co'] is not None else 'N/A'
+            bt = question['bt'] if question['bt'] is not None else 'N/A'
+            question_text_clean = question['text']
+        else:
+            # Extract CO and BT from the question text
+            co_match = CO_PATTERN.search(question['text'])
+            bt_match = BT_PATTERN.search(question['text'])
+            co = co_match.group(1) if co_match else 'N/A'
+            bt = bt_match.group(1) if bt_match else 'N/A'
+
+            # Remove [CO:X] and [BT:Y] from the question text for clarity in the table
+            question_text_clean = CO_BT_TAGS_PATTERN.sub('', question['text']).strip()
+
+        return [
+            Paragraph(f"{question_num}{sub_label}", self.normal_style),  # Question No (e.g., '1a')
+            sub_label,                                                 # Subquestion ('a', 'b')
+            Paragraph(question_text_clean, self.normal_style),
+            str(co),
+            str(bt),
+            str(question['marks'])
+        ]
+
+    def render(self, unit_questions, filepath):
+        doc = SimpleDocTemplate(filepath, pagesize=letter)
+        doc.build(self.build_elements(unit_questions))
+
+
+_paper_templates = OrderedDict()
+_paper_templates_lock = threading.Lock()
+
+
+# Function: '3 hours', '90 minutes' or '2 hours 30 minutes'
+def format_duration(minutes):
+    hours, minutes = divmod(int(minutes), 60)
+    if not hours or (hours == 1 and minutes == 30):
+        return f"{hours * 60 + minutes} minutes"
+    parts = [f"{hours} hour{'s' if hours != 1 else ''}"]
+    if minutes:
+        parts.append(f"{minutes} minutes")
+    return ' '.join(parts)
+
+
+# Function: Get the Cached Template for a Paper Layout (the most recently used layouts are kept)
+def get_paper_template(**layout):
+    key = tuple(sorted(layout.items()))
+    with _paper_templates_lock:
+        template = _paper_templates.get(key)
+        if template is not None:
+            _paper_templates.move_to_end(key)
+            return template
+    template = PaperTemplate(**layout)
+    with _paper_templates_lock:
+        _paper_templates[key] = template
+        while len(_paper_templates) > PAPER_TEMPLATE_CACHE_SIZE:
+            _paper_templates.popitem(last=False)
+    return template
+
+
+# Function: Generate PDF from Questions in Table Format
+def generate_pdf(unit_questions, filepath, template=None):
+    try:
+        (template or get_paper_template()).render(unit_questions, filepath)
+        logging.debug("PDF generated at: %s", filepath)
+    except Exception as e:
+        logging.exception(f"Failed to generate PDF: {filepath}")
+        raise
+
+
+# Function: Render One Paper to a Temporary File, Then Move It into Place
+def render_paper(unit_questions, filepath, layout=None):
+    directory = os.path.dirname(filepath) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.rendering-', suffix='.pdf')
+    os.close(fd)
+    try:
+        generate_pdf(unit_questions, temp_path, get_paper_template(**(layout or {})))
+        # os.replace is atomic, so readers never see a half-written paper
+        os.replace(temp_path, filepath)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return filepath
+
+
+# Function: Render Many Papers in Parallel on a Process Pool
+# layout holds PaperTemplate settings (plain, picklable values); each worker caches one template per layout
+def render_papers(papers, workers=None, layout=None):
+    workers = RENDER_WORKERS if workers is None else workers
+    start = time.perf_counter()
+    if workers <= 1 or len(papers) <= 1:
+        results = [render_paper(unit_questions, filepath, layout) for unit_questions, filepath in papers]
+    else:
+        # Submitted under the pool lock, so another request cannot replace (and shut down) the pool mid-submit
+        with _render_pool_lock:
+            pool = _get_render_pool(workers)
+            futures = [pool.submit(render_paper, unit_questions, filepath, layout) for unit_questions, filepath in papers]
+        results = [future.result() for future in futures]
+    RENDER_SECONDS.observe(time.perf_counter() - start)
+    PAPERS_RENDERED.inc(len(papers))
+    return results
+
+
+# ReportLab rendering is CPU-bound, so papers are built in separate processes.
+# The pool is created once and reused; 'spawn' keeps workers independent of the
+# web server's threads.
+def _get_render_pool(workers):
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None or _render_pool._max_workers != workers:
+            if _render_pool is not None:
+                _render_pool.shutdown(wait=False)
+            _render_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            logging.info(f"Started paper rendering pool with {workers} worker processes.")
+        return _render_pool
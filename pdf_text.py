@@ -0,0 +1,325 @@
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+import PyPDF2
+
+from db import get_pool, transaction
+from metrics import metrics
+
+# PDF Text Extraction Configuration
+PAGE_CACHE_DATABASE = os.environ.get('QPG_PAGE_CACHE_DATABASE', 'data/page_cache.db')
+PAGE_CACHE_MAX_DOCUMENTS = int(os.environ.get('QPG_PAGE_CACHE_MAX_DOCUMENTS', 200))
+PAGE_CACHE_MAX_AGE_SECONDS = int(os.environ.get('QPG_PAGE_CACHE_MAX_AGE_SECONDS', 90 * 24 * 3600))
+PAGE_CACHE_CLAIM_SECONDS = 3600  # A document still being stored after this long without a new batch was abandoned
+PDF_WORKERS = int(os.environ.get('QPG_PDF_WORKERS', os.cpu_count() or 1))
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get('QPG_PDF_PARALLEL_MIN_PAGES', 24))  # Smaller documents are extracted in-process
+PDF_PAGES_PER_TASK = 8
+
+# Pages read back from the cache or written to it per statement batch
+PAGE_BATCH_SIZE = 64
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+# PDF Metrics
+PAGES_READ = metrics.counter('qpg_pdf_pages_total', 'Syllabus pages read, from the page cache or parsed from the PDF.', ('source',))
+
+
+# PageCache: Extracted Page Text Keyed by the PDF's Content Hash
+class PageCache:
+    def __init__(self, path=PAGE_CACHE_DATABASE, max_documents=PAGE_CACHE_MAX_DOCUMENTS, max_age=PAGE_CACHE_MAX_AGE_SECONDS):
+        self.path = path
+        self.max_documents = max_documents
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    # Borrow a pooled connection, creating the tables on first use
+    @contextmanager
+    def _connection(self):
+        with get_pool(self.path).connection() as conn:
+            if not self._initialized:
+                # page_count stays NULL until every page of the document has been stored
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS pdf_documents (
+                        content_hash TEXT PRIMARY KEY,
+                        page_count INTEGER,
+                        size INTEGER NOT NULL DEFAULT 0,
+                        created_at REAL NOT NULL,
+                        last_used_at REAL NOT NULL
+                    )
+                ''')
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS pdf_pages (
+                        content_hash TEXT NOT NULL,
+                        page_number INTEGER NOT NULL,
+                        text TEXT NOT NULL,
+                        PRIMARY KEY (content_hash, page_number)
+                    ) WITHOUT ROWID
+                ''')
+                # Syllabus structure (units, topics, page ranges) computed from the cached pages
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS syllabus_indexes (
+                        content_hash TEXT PRIMARY KEY,
+                        version INTEGER NOT NULL,
+                        structure TEXT NOT NULL
+                    )
+                ''')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_pdf_documents_last_used ON pdf_documents (last_used_at)')
+                self._initialized = True
+            yield conn
+
+    # Page count of a fully cached document, or None (counts as a miss)
+    def lookup(self, content_hash):
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute(
+                'SELECT page_count, created_at FROM pdf_documents WHERE content_hash = ?', (content_hash,)
+            ).fetchone()
+            if row is None or row[0] is None or now - row[1] > self.max_age:
+                with self._lock:
+                    self.misses += 1
+                return None
+            conn.execute('UPDATE pdf_documents SET last_used_at = ? WHERE content_hash = ?', (now, content_hash))
+        with self._lock:
+            self.hits += 1
+        logging.info(f"Page cache hit for document {content_hash[:12]} ({row[0]} pages).")
+        return row[0]
+
+    # Yield (page number, text) in order, reading a batch at a time so a connection is never held across yields
+    def iter_pages(self, content_hash, page_count):
+        for start in range(1, page_count + 1, PAGE_BATCH_SIZE):
+            with self._connection() as conn:
+                batch = conn.execute(
+                    'SELECT page_number, text FROM pdf_pages WHERE content_hash = ? AND page_number BETWEEN ? AND ? '
+                    'ORDER BY page_number',
+                    (content_hash, start, start + PAGE_BATCH_SIZE - 1)
+                ).fetchall()
+            yield from batch
+
+    # Claim a document for storing, discarding the pages of an abandoned attempt; returns False while
+    # another extraction of the same document is still storing pages (it is then not cached twice)
+    def begin(self, content_hash):
+        now = time.time()
+        with self._connection() as conn, transaction(conn):
+            row = conn.execute(
+                'SELECT page_count, last_used_at FROM pdf_documents WHERE content_hash = ?', (content_hash,)
+            ).fetchone()
+            if row is not None and row[0] is None and now - row[1] < PAGE_CACHE_CLAIM_SECONDS:
+                return False
+            conn.execute('DELETE FROM pdf_pages WHERE content_hash = ?', (content_hash,))
+            conn.execute('DELETE FROM syllabus_indexes WHERE content_hash = ?', (content_hash,))
+            conn.execute(
+                'INSERT OR REPLACE INTO pdf_documents (content_hash, page_count, size, created_at, last_used_at) '
+                'VALUES (?, NULL, 0, ?, ?)',
+                (content_hash, now, now)
+            )
+        return True
+
+    # Each batch renews the claim, so a long extraction is not taken for an abandoned one
+    def store_pages(self, content_hash, pages):
+        with self._connection() as conn, transaction(conn):
+            conn.executemany(
+                'INSERT OR REPLACE INTO pdf_pages (content_hash, page_number, text) VALUES (?, ?, ?)',
+                [(content_hash, page_number, text) for page_number, text in pages]
+            )
+            conn.execute(
+                'UPDATE pdf_documents SET size = size + ?, last_used_at = ? WHERE content_hash = ?',
+                (sum(len(text) for _, text in pages), time.time(), content_hash)
+            )
+
+    # Mark a document as cached, but only when every page is stored; a short page set is discarded
+    def complete(self, content_hash, page_count):
+        now = time.time()
+        with self._connection() as conn, transaction(conn):
+            stored = conn.execute('SELECT COUNT(*) FROM pdf_pages WHERE content_hash = ?', (content_hash,)).fetchone()[0]
+            if stored == page_count:
+                conn.execute('UPDATE pdf_documents SET page_count = ? WHERE content_hash = ?', (page_count, content_hash))
+            else:
+                conn.execute('DELETE FROM pdf_pages WHERE content_hash = ?', (content_hash,))
+                conn.execute('DELETE FROM pdf_documents WHERE content_hash = ? AND page_count IS NULL', (content_hash,))
+            self._evict(conn, now)
+        if stored != page_count:
+            logging.warning(f"Did not cache document {content_hash[:12]}: {stored} of {page_count} pages were stored.")
+            return
+        logging.info(f"Cached text of {page_count} pages for document {content_hash[:12]}.")
+
+    # Stored syllabus structure of a document as (version, JSON text), or None
+    def get_index(self, content_hash):
+        with self._connection() as conn:
+            row = conn.execute(
+                'SELECT version, structure FROM syllabus_indexes WHERE content_hash = ?', (content_hash,)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def store_index(self, content_hash, version, structure):
+        with self._connection() as conn, transaction(conn):
+            # Only kept for documents whose pages are cached; it is evicted along with them
+            conn.execute(
+                'INSERT OR REPLACE INTO syllabus_indexes (content_hash, version, structure) '
+                'SELECT content_hash, ?, ? FROM pdf_documents WHERE content_hash = ? AND page_count IS NOT NULL',
+                (version, structure, content_hash)
+            )
+
+    # Evict expired and abandoned documents, then least recently used ones over the document limit
+    def _evict(self, conn, now):
+        stale = [row[0] for row in conn.execute(
+            'SELECT content_hash FROM pdf_documents WHERE created_at < ? OR (page_count IS NULL AND last_used_at < ?)',
+            (now - self.max_age, now - PAGE_CACHE_CLAIM_SECONDS)
+        )]
+        excess = conn.execute('SELECT COUNT(*) FROM pdf_documents').fetchone()[0] - len(stale) - self.max_documents
+        if excess > 0:
+            stale += [row[0] for row in conn.execute(
+                'SELECT content_hash FROM pdf_documents WHERE page_count IS NOT NULL ORDER BY last_used_at ASC LIMIT ?',
+                (excess,)
+            ) if row[0] not in stale]
+        for content_hash in stale:
+            conn.execute('DELETE FROM pdf_pages WHERE content_hash = ?', (content_hash,))
+            conn.execute('DELETE FROM syllabus_indexes WHERE content_hash = ?', (content_hash,))
+            conn.execute('DELETE FROM pdf_documents WHERE content_hash = ?', (content_hash,))
+        if stale:
+            with self._lock:
+                self.evictions += len(stale)
+            logging.info(f"Evicted {len(stale)} documents from the page cache.")
+
+    def stats(self):
+        with self._connection() as conn:
+            documents, pages = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(page_count), 0) FROM pdf_documents WHERE page_count IS NOT NULL'
+            ).fetchone()
+            text_bytes = conn.execute('SELECT COALESCE(SUM(size), 0) FROM pdf_documents').fetchone()[0]
+            indexes = conn.execute('SELECT COUNT(*) FROM syllabus_indexes').fetchone()[0]
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'documents': documents,
+                'pages': pages,
+                'characters': text_bytes,
+                'indexes': indexes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'max_documents': self.max_documents,
+            }
+
+
+page_cache = PageCache()
+metrics.callback(
+    'qpg_page_cache_lookups_total', 'Page cache lookups by result.',
+    lambda: [(('hit',), page_cache.hits), (('miss',), page_cache.misses)],
+    labels=('result',), kind='counter'
+)
+
+
+# Function: Extract a Range of Pages (runs in a worker process; opens the file itself)
+def extract_page_range(filepath, start, stop):
+    with open(filepath, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        return [(page_number + 1, reader.pages[page_number].extract_text() or '') for page_number in range(start, stop)]
+
+
+# Function: Yield (page number, text) Lazily Straight from the PDF
+def _extract_pages(filepath, workers):
+    with open(filepath, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        page_count = len(reader.pages)
+        if workers <= 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+            for page_number, page in enumerate(reader.pages, start=1):
+                yield page_number, page.extract_text() or ''
+            return
+
+    # Large documents: page ranges go to worker processes; results are yielded in page order,
+    # with at most two ranges per worker in flight so memory stays bounded
+    pool = _get_extract_pool(workers)
+    ranges = [(start, min(start + PDF_PAGES_PER_TASK, page_count)) for start in range(0, page_count, PDF_PAGES_PER_TASK)]
+    pending = []
+    for start, stop in ranges:
+        pending.append(pool.submit(extract_page_range, filepath, start, stop))
+        if len(pending) >= workers * 2:
+            yield from pending.pop(0).result()
+    for future in pending:
+        yield from future.result()
+
+
+# Function: Yield (page number, text) for a PDF, from the page cache when its content hash is known
+def iter_pdf_pages(filepath, content_hash=None, workers=None):
+    workers = PDF_WORKERS if workers is None else workers
+    if content_hash is None:
+        for page in _extract_pages(filepath, workers):
+            PAGES_READ.inc(source='pdf')
+            yield page
+        return
+
+    page_count = page_cache.lookup(content_hash)
+    if page_count is not None:
+        PAGES_READ.inc(page_count, source='cache')
+        yield from page_cache.iter_pages(content_hash, page_count)
+        return
+
+    # Pages are stored in batches as they are extracted; the document only counts as cached once complete.
+    # While another request is extracting the same document, this one reads the PDF without storing it
+    if not page_cache.begin(content_hash):
+        logging.info(f"Document {content_hash[:12]} is already being cached; extracting without storing.")
+        for page in _extract_pages(filepath, workers):
+            PAGES_READ.inc(source='pdf')
+            yield page
+        return
+    batch = []
+    page_count = 0
+    for page_number, text in _extract_pages(filepath, workers):
+        PAGES_READ.inc(source='pdf')
+        batch.append((page_number, text))
+        page_count = page_number
+        if len(batch) >= PAGE_BATCH_SIZE:
+            page_cache.store_pages(content_hash, batch)
+            batch = []
+        yield page_number, text
+    if batch:
+        page_cache.store_pages(content_hash, batch)
+    page_cache.complete(content_hash, page_count)
+
+
+# Function: Join Page Texts, One Line Break after Each Page That Has Text
+# Returns the text and (page number, offset in the text) for every page, in order
+def join_pages(pages):
+    parts = []
+    page_offsets = []
+    length = 0
+    for page_number, page_text in pages:
+        page_offsets.append((page_number, length))
+        if page_text:
+            parts.append(page_text)
+            parts.append('\n')
+            length += len(page_text) + 1
+        else:
+            logging.warning(f"No text found on page {page_number}.")
+    return ''.join(parts), page_offsets
+
+
+# Function: Full Text of a PDF
+def extract_text(filepath, content_hash=None):
+    text, _ = join_pages(iter_pdf_pages(filepath, content_hash))
+    logging.debug("Extracted text from %s.", filepath)
+    return text
+
+
+# PyPDF2 text extraction is CPU-bound, so large documents are split across processes.
+# The pool is created once and reused, like the paper rendering pool.
+def _get_extract_pool(workers):
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None or _extract_pool._max_workers != workers:
+            if _extract_pool is not None:
+                _extract_pool.shutdown(wait=False)
+            _extract_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            logging.info(f"Started PDF extraction pool with {workers} worker processes.")
+        return _extract_pool
@@ -0,0 +1,323 @@
+import os
+import re
+import io
+import json
+import time
+import random
+import pstats
+import cProfile
+import logging
+import secrets
+import sysconfig
+import threading
+import tracemalloc
+
+from metrics import metrics
+
+# Profiling Configuration
+PROFILING_ENABLED = os.environ.get('QPG_PROFILING', '0') != '0'
+PROFILE_DIR = os.environ.get('QPG_PROFILE_DIR', 'data/profiles')
+PROFILE_TOKEN = os.environ.get('QPG_PROFILE_TOKEN', '')  # Admin token for on-demand profiles and /profiles; none disables both
+PROFILE_SAMPLE_RATE = float(os.environ.get('QPG_PROFILE_SAMPLE_RATE', 0))  # Share of requests profiled without being asked
+PROFILE_MAX_KEPT = int(os.environ.get('QPG_PROFILE_MAX_KEPT', 50))
+PROFILE_TRACEMALLOC_FRAMES = int(os.environ.get('QPG_PROFILE_TRACEMALLOC_FRAMES', 10))
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_QUERY_FLAG = 'profile'
+# Never sampled: profile downloads, metrics scrapes and job status polls
+UNSAMPLED_PATH_PATTERN = re.compile(r'^/(?:profiles|metrics|jobs/|static/)')
+PROFILES_PATH_PATTERN = re.compile(r'^/profiles(?:/|$)')
+PROFILE_ID_PATTERN = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{6}$')
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+
+PROFILES_CAPTURED = metrics.counter('qpg_profiles_captured_total', 'CPU and allocation profiles captured.', ('trigger',))
+
+# Profiles in flight that use tracemalloc; it is traced only while at least one is
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started = False
+
+
+class ProfileNotFound(Exception):
+    pass
+
+
+def _start_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            _tracing_started = True
+        if _tracing_users == 0:
+            tracemalloc.reset_peak()
+        _tracing_users += 1
+
+
+def _stop_tracing():
+    global _tracing_users, _tracing_started
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _tracing_started:
+            tracemalloc.stop()
+            _tracing_started = False
+
+
+# Project files relative to the working directory, libraries from their package directory
+def _short_path(filename):
+    if filename.startswith('<'):
+        return filename
+    for marker in ('site-packages', 'dist-packages'):
+        _, found, rest = filename.rpartition(os.sep + marker + os.sep)
+        if found:
+            return rest
+    relative = os.path.relpath(filename)
+    if not relative.startswith('..'):
+        return relative
+    stdlib = sysconfig.get_paths()['stdlib'] + os.sep
+    return filename[len(stdlib):] if filename.startswith(stdlib) else filename
+
+
+def _function_name(key):
+    filename, line, function = key
+    if filename == '~':
+        # Built-ins have no file: '<built-in method time.sleep>'
+        return function
+    return f"{_short_path(filename)}:{line}({function})"
+
+
+def _top_functions(stats, sort_index, limit):
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][sort_index], reverse=True)[:limit]
+    return [
+        {
+            'function': _function_name(key),
+            'calls': calls,
+            'primitive_calls': primitive_calls,
+            'own_seconds': round(own, 6),
+            'cumulative_seconds': round(cumulative, 6),
+        }
+        for key, (primitive_calls, calls, own, cumulative, _) in rows
+    ]
+
+
+def _allocation_filters():
+    return [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, cProfile.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ]
+
+
+def _location(traceback):
+    frame = traceback[0]
+    return f"{_short_path(frame.filename)}:{frame.lineno}"
+
+
+def profile_path(profile_id, kind):
+    if not PROFILE_ID_PATTERN.match(profile_id or ''):
+        raise ProfileNotFound(f"No profile '{profile_id}'.")
+    extension = {'meta': 'json', 'cpu': 'prof', 'memory': 'tracemalloc'}[kind]
+    return os.path.join(PROFILE_DIR, f"{profile_id}.{extension}")
+
+
+# Profile: cProfile and tracemalloc Capture of One Request or Job, Saved Under PROFILE_DIR
+# cProfile sees the thread that starts it: a request's handler or a job's worker. Per-unit
+# fan-out threads and rendering processes are not included
+class Profile:
+    def __init__(self, trigger, **details):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}"
+        self.trigger = trigger
+        self.details = details
+        self._profiler = None
+        self._started = None
+
+    @property
+    def running(self):
+        return self._profiler is not None
+
+    # Raises ValueError when another profiler is already active (Python 3.12+ allows one per process)
+    def start(self):
+        _start_tracing()
+        self._started = time.perf_counter()
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            _stop_tracing()
+            raise
+        self._profiler = profiler
+
+    # Stop profiling and write the CPU profile, the allocation snapshot and a JSON summary
+    def stop(self, **details):
+        self._profiler.disable()
+        duration = time.perf_counter() - self._started
+        try:
+            snapshot = tracemalloc.take_snapshot().filter_traces(_allocation_filters())
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            _stop_tracing()
+        profiler, self._profiler = self._profiler, None
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(profile_path(self.id, 'cpu'))
+        snapshot.dump(profile_path(self.id, 'memory'))
+        stats = pstats.Stats(profiler, stream=io.StringIO())
+        allocations = snapshot.statistics('lineno')
+        summary = {
+            'id': self.id,
+            'trigger': self.trigger,
+            'created_at': time.time(),
+            'duration_seconds': round(duration, 6),
+            **self.details,
+            **details,
+            'cpu': {
+                'total_calls': stats.total_calls,
+                'total_seconds': round(stats.total_tt, 6),
+                'by_cumulative': _top_functions(stats, 3, TOP_FUNCTIONS),
+                'by_own_time': _top_functions(stats, 2, TOP_FUNCTIONS),
+            },
+            'memory': {
+                'peak_kib': round(peak / 1024, 1),
+                'retained_kib': round(sum(stat.size for stat in allocations) / 1024, 1),
+                'top_allocations': [
+                    {'location': _location(stat.traceback), 'size_kib': round(stat.size / 1024, 1), 'count': stat.count}
+                    for stat in allocations[:TOP_ALLOCATIONS]
+                ],
+            },
+        }
+        with open(profile_path(self.id, 'meta'), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        PROFILES_CAPTURED.inc(trigger=self.trigger)
+        logging.info(f"Saved {self.trigger} profile {self.id} ({duration:.3f} s): {self.details.get('target', '')}")
+        prune_profiles()
+        return summary
+
+    # Wrap a job function so the job runs under a profile of its own, started on the job's worker thread
+    def follow(self, func):
+        def profiled_job(job, *args, **kwargs):
+            self.details.setdefault('job_id', job.id)
+            self.details.setdefault('job_kind', job.kind)
+            try:
+                self.start()
+            except ValueError as e:
+                logging.warning(f"Job {job.id} runs without profile {self.id}: {e}")
+                return func(job, *args, **kwargs)
+            status = 'failed'
+            try:
+                result = func(job, *args, **kwargs)
+                status = 'succeeded'
+                return result
+            finally:
+                try:
+                    self.stop(status=status, timings=dict(job.timings))
+                except Exception:
+                    logging.exception(f"Could not save profile {self.id}.")
+        return profiled_job
+
+
+def _token_matches(value):
+    return bool(PROFILE_TOKEN and value) and secrets.compare_digest(value.encode(), PROFILE_TOKEN.encode())
+
+
+# Function: Check the Admin Token, Sent as the X-Profile Header or ?profile=
+def profile_access_allowed(headers, args):
+    return _token_matches(headers.get(PROFILE_HEADER) or args.get(PROFILE_QUERY_FLAG))
+
+
+# Function: Decide Whether a Request Is Profiled; returns the trigger or None
+# On demand a request is only profiled when it carries the admin token; the /profiles endpoints never are
+def profile_trigger(headers, args, path):
+    if not PROFILING_ENABLED or PROFILES_PATH_PATTERN.match(path):
+        return None
+    requested, trigger = headers.get(PROFILE_HEADER), 'header'
+    if not requested:
+        requested, trigger = args.get(PROFILE_QUERY_FLAG), 'query'
+    if requested:
+        return trigger if _token_matches(requested) else None
+    if PROFILE_SAMPLE_RATE > 0 and not UNSAMPLED_PATH_PATTERN.match(path) and random.random() < PROFILE_SAMPLE_RATE:
+        return 'sample'
+    return None
+
+
+def list_profiles(limit=50):
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, filename), encoding='utf-8') as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        # The list carries the headline numbers; the full summary is at /profiles/<id>
+        summary['cpu'] = {'total_seconds': summary['cpu']['total_seconds'], 'total_calls': summary['cpu']['total_calls']}
+        summary['memory'] = {'peak_kib': summary['memory']['peak_kib'], 'retained_kib': summary['memory']['retained_kib']}
+        profiles.append(summary)
+        if len(profiles) >= limit:
+            break
+    return profiles
+
+
+def load_profile(profile_id):
+    try:
+        with open(profile_path(profile_id, 'meta'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise ProfileNotFound(f"No profile '{profile_id}'.")
+
+
+# Function: Compare Two Profiles Function by Function and Allocation Site by Allocation Site
+def compare_profiles(base_id, other_id, limit=TOP_FUNCTIONS):
+    summaries = [load_profile(base_id), load_profile(other_id)]
+    base_stats, other_stats = (pstats.Stats(profile_path(profile_id, 'cpu'), stream=io.StringIO()).stats for profile_id in (base_id, other_id))
+
+    functions = []
+    for key in set(base_stats) | set(other_stats):
+        _, base_calls, base_own, base_cumulative, _ = base_stats.get(key, (0, 0, 0.0, 0.0, None))
+        _, other_calls, other_own, other_cumulative, _ = other_stats.get(key, (0, 0, 0.0, 0.0, None))
+        functions.append({
+            'function': _function_name(key),
+            'calls': [base_calls, other_calls],
+            'cumulative_seconds': [round(base_cumulative, 6), round(other_cumulative, 6)],
+            'cumulative_change': round(other_cumulative - base_cumulative, 6),
+            'own_change': round(other_own - base_own, 6),
+        })
+    functions.sort(key=lambda row: abs(row['cumulative_change']), reverse=True)
+
+    base_snapshot = tracemalloc.Snapshot.load(profile_path(base_id, 'memory'))
+    other_snapshot = tracemalloc.Snapshot.load(profile_path(other_id, 'memory'))
+    allocations = [
+        {
+            'location': _location(stat.traceback),
+            'size_kib': round(stat.size / 1024, 1),
+            'size_change_kib': round(stat.size_diff / 1024, 1),
+            'count_change': stat.count_diff,
+        }
+        for stat in other_snapshot.compare_to(base_snapshot, 'lineno')[:TOP_ALLOCATIONS]
+    ]
+
+    return {
+        'base': {key: summaries[0].get(key) for key in ('id', 'target', 'duration_seconds', 'created_at')},
+        'other': {key: summaries[1].get(key) for key in ('id', 'target', 'duration_seconds', 'created_at')},
+        'duration_change_seconds': round(summaries[1]['duration_seconds'] - summaries[0]['duration_seconds'], 6),
+        'peak_change_kib': round(summaries[1]['memory']['peak_kib'] - summaries[0]['memory']['peak_kib'], 1),
+        'functions': functions[:limit],
+        'allocations': allocations,
+    }
+
+
+# Keep the newest PROFILE_MAX_KEPT profiles
+def prune_profiles():
+    if PROFILE_MAX_KEPT <= 0 or not os.path.isdir(PROFILE_DIR):
+        return
+    profile_ids = sorted(filename[:-5] for filename in os.listdir(PROFILE_DIR) if filename.endswith('.json'))
+    for profile_id in profile_ids[:-PROFILE_MAX_KEPT]:
+        for kind in ('meta', 'cpu', 'memory'):
+            try:
+                os.unlink(profile_path(profile_id, kind))
+            except (FileNotFoundError, ProfileNotFound):
+                pass
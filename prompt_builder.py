@@ -0,0 +1,198 @@
+import os
+import re
+import logging
+from collections import Counter
+
+from ollama_client import ollama_client, OLLAMA_NUM_CTX
+from syllabus_index import UNIT_LINE_PATTERN, CHARACTERS_PER_TOKEN, estimate_tokens
+from metrics import metrics
+
+# Prompt Budget Configuration
+CONTEXT_WINDOW = int(os.environ.get('QPG_CONTEXT_WINDOW', OLLAMA_NUM_CTX or 8192))  # Largest num_ctx a request may use
+MIN_CONTEXT = int(os.environ.get('QPG_MIN_CONTEXT', 2048))
+TOKENS_PER_QUESTION = int(os.environ.get('QPG_TOKENS_PER_QUESTION', 64))  # Output allowance per generated question line
+TRIM_BOILERPLATE = os.environ.get('QPG_TRIM_BOILERPLATE', '1') != '0'
+
+# Sections that never yield questions; they run until the next unit heading
+BOILERPLATE_HEADING_PATTERN = re.compile(
+    r'^(?:text\s*-?\s*books?|reference\s*books?|references|suggested\s+readings?|further\s+readings?|'
+    r'recommended\s+books?|bibliography|web\s+(?:links|resources|references)|e-?\s*resources|online\s+resources)\b',
+    re.IGNORECASE
+)
+PAGE_NUMBER_PATTERN = re.compile(r'^(?:page\s*)?\d+(?:\s*(?:of|/)\s*\d+)?$', re.IGNORECASE)
+# A short line on at least half the pages (and three times or more) is a running header or footer
+REPEATED_LINE_MIN = 3
+REPEATED_LINE_MAX_LENGTH = 100
+# Share of the text budget the course header before the first unit may take
+PREAMBLE_SHARE = 0.1
+# Allowance for unit headings and numbering in the output, per unit
+TOKENS_PER_UNIT_HEADING = 8
+
+PROMPT_TOKENS = metrics.histogram(
+    'qpg_prompt_tokens', 'Estimated tokens per prompt sent to the model.',
+    buckets=(256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+)
+PROMPTS_TRUNCATED = metrics.counter('qpg_prompts_truncated_total', 'Prompts whose syllabus text was shortened to fit the context window.')
+
+
+# PromptSource: A Syllabus's Unit Texts with Boilerplate Removed, Prepared Once per Job
+class PromptSource:
+    def __init__(self, preamble, unit_texts, removed_tokens=0):
+        self.preamble = preamble
+        self.unit_texts = unit_texts
+        self.removed_tokens = removed_tokens
+
+
+# PromptPlan: The Prompt, the Syllabus Text It Carries, and the Options Sized for It
+class PromptPlan:
+    def __init__(self, prompt, text, options, prompt_tokens, truncated_units=()):
+        self.prompt = prompt
+        self.text = text
+        self.options = options
+        self.prompt_tokens = prompt_tokens
+        self.truncated_units = list(truncated_units)
+
+    def to_dict(self):
+        return {
+            'prompt_tokens': self.prompt_tokens,
+            'num_ctx': self.options.get('num_ctx'),
+            'num_predict': self.options.get('num_predict'),
+            'truncated_units': self.truncated_units,
+        }
+
+
+def _repeated_lines(text, page_count):
+    if page_count < REPEATED_LINE_MIN:
+        return set()
+    counts = Counter(
+        stripped for stripped in (line.strip() for line in text.splitlines())
+        if stripped and len(stripped) <= REPEATED_LINE_MAX_LENGTH and not UNIT_LINE_PATTERN.match(stripped)
+    )
+    threshold = max(REPEATED_LINE_MIN, page_count // 2)
+    return {line for line, count in counts.items() if count >= threshold}
+
+
+# Function: Drop Page Numbers, Running Headers/Footers and Reference Sections from a Text
+def strip_boilerplate(text, repeated=frozenset()):
+    lines = []
+    skipping = False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if UNIT_LINE_PATTERN.match(stripped):
+            skipping = False
+        elif BOILERPLATE_HEADING_PATTERN.match(stripped):
+            skipping = True
+        if skipping or PAGE_NUMBER_PATTERN.match(stripped) or stripped in repeated:
+            continue
+        # Runs of blank lines collapse to one
+        if not stripped and (not lines or not lines[-1].strip()):
+            continue
+        lines.append(line)
+    return '\n'.join(lines).strip('\n')
+
+
+# Function: Prepare a Syllabus Index's Unit Texts for Prompting
+def prepare_syllabus(syllabus, trim=None):
+    trim = TRIM_BOILERPLATE if trim is None else trim
+    unit_texts = syllabus.unit_texts()
+    if not trim:
+        return PromptSource(syllabus.preamble, unit_texts)
+
+    repeated = _repeated_lines(syllabus.text, syllabus.page_count)
+    preamble = strip_boilerplate(syllabus.preamble, repeated)
+    cleaned = {unit_number: strip_boilerplate(text, repeated) for unit_number, text in unit_texts.items()}
+    removed = syllabus.tokens - estimate_tokens(preamble) - sum(estimate_tokens(text) for text in cleaned.values())
+    if removed > 0:
+        logging.info(f"Removed about {removed} tokens of boilerplate from the syllabus.")
+    return PromptSource(preamble, cleaned, max(removed, 0))
+
+
+# Function: Keep Whole Lines of a Text up to a Token Budget
+def fit_lines(text, budget):
+    if estimate_tokens(text) <= budget:
+        return text
+    kept = []
+    used = 0
+    for line in text.splitlines():
+        cost = estimate_tokens(line + '\n')
+        if used + cost > budget:
+            # Text extracted without line breaks is cut at a word boundary instead of dropped
+            if not kept and budget > 0:
+                kept.append(line[:budget * CHARACTERS_PER_TOKEN].rsplit(' ', 1)[0])
+            break
+        kept.append(line)
+        used += cost
+    return '\n'.join(kept)
+
+
+# Function: Pack Unit Texts into a Token Budget
+# Units that fit their fair share keep everything; what they leave over is shared among the
+# rest, which are cut at line boundaries (a unit always keeps its heading line)
+def pack_units(unit_texts, budget):
+    costs = {unit_number: estimate_tokens(text) for unit_number, text in unit_texts.items()}
+    if sum(costs.values()) <= budget:
+        return dict(unit_texts), []
+
+    remaining = max(budget, 0)
+    open_units = sorted(costs, key=costs.get)
+    shares = {}
+    while open_units:
+        share = remaining // len(open_units)
+        unit_number = open_units[0]
+        if costs[unit_number] > share:
+            break
+        shares[unit_number] = costs[unit_number]
+        remaining -= costs[unit_number]
+        open_units.pop(0)
+    for unit_number in open_units:
+        shares[unit_number] = remaining // len(open_units)
+
+    packed = {}
+    for unit_number, text in unit_texts.items():
+        if unit_number in open_units:
+            heading, _, body = text.partition('\n')
+            body = fit_lines(body, shares[unit_number] - estimate_tokens(heading + '\n'))
+            packed[unit_number] = f"{heading}\n{body}" if body else heading
+        else:
+            packed[unit_number] = text
+    return packed, [unit_number for unit_number in unit_texts if unit_number in open_units]
+
+
+# Function: Context Window and Output Length for a Prompt
+# num_ctx is rounded up to a power of two: Ollama reloads the model whenever num_ctx changes,
+# so a few sizes are reused instead of a new one per request
+def generation_options(prompt_tokens, num_predict):
+    needed = prompt_tokens + num_predict
+    num_ctx = MIN_CONTEXT
+    while num_ctx < needed and num_ctx < CONTEXT_WINDOW:
+        num_ctx *= 2
+    options = {'num_ctx': min(num_ctx, CONTEXT_WINDOW), 'num_predict': num_predict}
+    # Options set explicitly on the Ollama client (OLLAMA_NUM_CTX, OLLAMA_NUM_PREDICT) win
+    options.update(ollama_client.options)
+    return options
+
+
+# Function: Build a Generation Prompt Whose Syllabus Text Fits the Context Window
+# instructions: the system or repair prompt; units_text: the 'Units' section;
+# unit_texts: unit number -> text to send; questions: questions the model is asked to write
+def build_prompt(instructions, units_text, unit_texts, questions, preamble='', separator='\n'):
+    num_predict = questions * TOKENS_PER_QUESTION + len(unit_texts) * TOKENS_PER_UNIT_HEADING
+    frame = f"{instructions}\n\nUnits:\n{units_text}\n\nText:\n"
+    budget = CONTEXT_WINDOW - num_predict - estimate_tokens(frame)
+    if budget <= 0:
+        logging.warning(f"The prompt instructions alone exceed the {CONTEXT_WINDOW}-token context window.")
+
+    preamble = fit_lines(preamble, int(max(budget, 0) * PREAMBLE_SHARE)) if preamble else ''
+    packed, truncated = pack_units(unit_texts, budget - estimate_tokens(preamble))
+    if truncated:
+        logging.warning(f"Syllabus text of {truncated} was shortened to fit the {CONTEXT_WINDOW}-token context window.")
+
+    text = separator.join(part for part in [preamble, *packed.values()] if part)
+    prompt = frame + text
+    prompt_tokens = estimate_tokens(prompt)
+    plan = PromptPlan(prompt, text, generation_options(prompt_tokens, num_predict), prompt_tokens, truncated)
+    PROMPT_TOKENS.observe(prompt_tokens)
+    if truncated:
+        PROMPTS_TRUNCATED.inc()
+    logging.debug("Built prompt: %s", plan.to_dict())
+    return plan
@@ -0,0 +1,720 @@
+import os
+import re
+import json
+import time
+import logging
+
+from db import get_pool, transaction
+from near_duplicates import NearDuplicateIndex, DEDUP_MODE
+
+# Question Bank Configuration
+DATABASE = os.environ.get('QPG_DATABASE', 'data/questions.db')
+DEFAULT_COURSE = os.environ.get('QPG_DEFAULT_COURSE', 'Data Communications')
+
+# Retention and compaction policies; 0 disables a policy
+BANK_RETENTION_DAYS = float(os.environ.get('QPG_BANK_RETENTION_DAYS', 0))  # Drop superseded syllabus versions unused for this long
+BANK_KEEP_VERSIONS = int(os.environ.get('QPG_BANK_KEEP_VERSIONS', 0))  # Syllabus versions kept per course
+BANK_MAX_PER_SLOT = int(os.environ.get('QPG_BANK_MAX_PER_SLOT', 0))  # Newest questions kept per (unit, marks)
+FAILED_RUN_RETENTION_SECONDS = 7 * 24 * 3600
+
+# Bumped whenever the schema changes; stored in PRAGMA user_version
+SCHEMA_VERSION = 6
+
+UNIT_NUMBER_PATTERN = re.compile(r'Unit\s+(\d+)', re.IGNORECASE)
+CO_PATTERN = re.compile(r'\[CO:(\d+)\]')
+BT_PATTERN = re.compile(r'\[BT:(\d+)\]')
+CO_BT_TAGS_PATTERN = re.compile(r'\s*\[CO:\d+\]\s*\[BT:\d+\]')
+
+# Statements reused verbatim so each pooled connection prepares them once (sqlite3 statement cache)
+INSERT_QUESTION = (
+    'INSERT OR IGNORE INTO questions (course_id, unit_id, text, co, bt, marks, model, run_id, created_at, cluster_id) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+)
+
+SCHEMA_V1 = [
+    '''
+    CREATE TABLE IF NOT EXISTS courses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        created_at REAL NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS syllabus_documents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        course_id INTEGER NOT NULL REFERENCES courses (id),
+        filename TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        UNIQUE (course_id, content_hash)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS units (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        course_id INTEGER NOT NULL REFERENCES courses (id),
+        document_id INTEGER NOT NULL REFERENCES syllabus_documents (id),
+        number INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        UNIQUE (document_id, number)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS questions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        course_id INTEGER NOT NULL REFERENCES courses (id),
+        unit_id INTEGER NOT NULL REFERENCES units (id),
+        text TEXT NOT NULL,
+        co INTEGER,
+        bt INTEGER,
+        marks INTEGER NOT NULL,
+        model TEXT,
+        run_id TEXT,
+        created_at REAL NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_questions_course_unit_marks ON questions (course_id, unit_id, marks)',
+    'CREATE INDEX IF NOT EXISTS idx_questions_course_co_bt ON questions (course_id, co, bt)',
+]
+
+SCHEMA_V2 = [
+    '''
+    CREATE TABLE IF NOT EXISTS generation_runs (
+        id TEXT PRIMARY KEY,
+        course_id INTEGER NOT NULL REFERENCES courses (id),
+        document_id INTEGER NOT NULL REFERENCES syllabus_documents (id),
+        model TEXT,
+        mode TEXT,
+        status TEXT NOT NULL,
+        question_count INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        started_at REAL NOT NULL,
+        finished_at REAL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_generation_runs_document ON generation_runs (document_id, status, finished_at)',
+    'CREATE INDEX IF NOT EXISTS idx_questions_run ON questions (run_id)',
+    # Re-running a syllabus (e.g. from the generation cache) must not duplicate questions
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_questions_unit_marks_text ON questions (unit_id, marks, text)',
+]
+
+# Near-duplicate index: a question's cluster_id points at the cluster's first question (NULL for that one)
+SCHEMA_V3 = [
+    'ALTER TABLE questions ADD COLUMN cluster_id INTEGER',
+    'CREATE INDEX IF NOT EXISTS idx_questions_cluster ON questions (cluster_id)',
+    '''
+    CREATE TABLE IF NOT EXISTS question_signatures (
+        question_id INTEGER PRIMARY KEY REFERENCES questions (id) ON DELETE CASCADE,
+        signature BLOB NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS question_lsh (
+        unit_id INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        question_id INTEGER NOT NULL REFERENCES questions (id) ON DELETE CASCADE
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_question_lsh_bucket ON question_lsh (unit_id, bucket)',
+    'CREATE INDEX IF NOT EXISTS idx_question_lsh_question ON question_lsh (question_id)',
+]
+
+# Paper blueprints stored by name, and the blueprint each generation run was made for
+SCHEMA_V4 = [
+    '''
+    CREATE TABLE IF NOT EXISTS blueprints (
+        name TEXT PRIMARY KEY,
+        definition TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    ''',
+    'ALTER TABLE generation_runs ADD COLUMN blueprint TEXT',
+]
+
+# Uploaded files by the name they were uploaded under; the bytes are stored once per content hash (upload_store)
+SCHEMA_V5 = [
+    '''
+    CREATE TABLE IF NOT EXISTS uploads (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        filename TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_uploads_content_hash ON uploads (content_hash)',
+    'CREATE INDEX IF NOT EXISTS idx_uploads_created ON uploads (created_at)',
+]
+
+# Every question a run produced, including those already in the bank (questions.run_id names only the first run)
+SCHEMA_V6 = [
+    '''
+    CREATE TABLE IF NOT EXISTS run_questions (
+        run_id TEXT NOT NULL REFERENCES generation_runs (id) ON DELETE CASCADE,
+        question_id INTEGER NOT NULL REFERENCES questions (id) ON DELETE CASCADE,
+        PRIMARY KEY (run_id, question_id)
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_run_questions_question ON run_questions (question_id)',
+]
+
+# Link a stored question to a run by its slot and text (the unique index), whether the run inserted it or not
+LINK_RUN_QUESTION = (
+    'INSERT OR IGNORE INTO run_questions (run_id, question_id) '
+    'SELECT ?, id FROM questions WHERE unit_id = ? AND marks = ? AND text = ?'
+)
+
+
+def _pool():
+    return get_pool(DATABASE)
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+# Function: Create the Schema, Migrating Older Layouts Step by Step
+def init_db():
+    os.makedirs(os.path.dirname(DATABASE) or '.', exist_ok=True)
+    logging.debug("Ensured that the data directory exists.")
+    with _pool().connection() as conn:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < SCHEMA_VERSION:
+            # BEGIN IMMEDIATE so two processes starting at once cannot both migrate
+            with transaction(conn):
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                for target, migrate in ((1, _migrate_to_v1), (2, _migrate_to_v2), (3, _migrate_to_v3), (4, _migrate_to_v4),
+                                        (5, _migrate_to_v5), (6, _migrate_to_v6)):
+                    if version < target:
+                        migrate(conn)
+                conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            logging.info(f"Question bank schema migrated from version {version} to {SCHEMA_VERSION}.")
+    logging.info("Database initialized successfully.")
+
+
+# Version 1: normalized courses/documents/units/questions, replacing the single (unit, question, marks) table
+def _migrate_to_v1(conn):
+    legacy_rows = _detach_legacy_tables(conn)
+    for statement in SCHEMA_V1:
+        conn.execute(statement)
+    if legacy_rows:
+        _import_legacy_questions(conn, legacy_rows)
+
+
+# Version 2: generation runs as records, and an append-only bank without duplicate questions
+def _migrate_to_v2(conn):
+    conn.execute('''
+        DELETE FROM questions WHERE id NOT IN (
+            SELECT MIN(id) FROM questions GROUP BY unit_id, marks, text
+        )
+    ''')
+    for statement in SCHEMA_V2:
+        conn.execute(statement)
+    # Backfill a run record for every run id already present in the bank
+    conn.execute('''
+        INSERT OR IGNORE INTO generation_runs
+            (id, course_id, document_id, model, status, question_count, started_at, finished_at)
+        SELECT q.run_id, q.course_id, u.document_id, MAX(q.model), 'succeeded', COUNT(*), MIN(q.created_at), MAX(q.created_at)
+        FROM questions q JOIN units u ON u.id = q.unit_id
+        WHERE q.run_id IS NOT NULL
+        GROUP BY q.run_id
+    ''')
+
+
+# Version 3: MinHash signatures and LSH buckets for near-duplicate detection, built for existing questions
+def _migrate_to_v3(conn):
+    for statement in SCHEMA_V3:
+        conn.execute(statement)
+    _reindex_near_duplicates(conn)
+
+
+# Version 4: stored blueprints; existing runs keep a NULL blueprint (the default)
+def _migrate_to_v4(conn):
+    for statement in SCHEMA_V4:
+        conn.execute(statement)
+
+
+# Version 5: upload records; files uploaded before this were saved under their own names and are not tracked
+def _migrate_to_v5(conn):
+    for statement in SCHEMA_V5:
+        conn.execute(statement)
+
+
+# Version 6: run membership, backfilled from the run that first stored each question
+def _migrate_to_v6(conn):
+    for statement in SCHEMA_V6:
+        conn.execute(statement)
+    conn.execute('''
+        INSERT OR IGNORE INTO run_questions (run_id, question_id)
+        SELECT q.run_id, q.id FROM questions q JOIN generation_runs r ON r.id = q.run_id
+    ''')
+
+
+# The original schema kept only (unit, question, marks) with CO/BT tags inside the text
+def _detach_legacy_tables(conn):
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    legacy_rows = []
+    if 'questions' in tables and 'course_id' not in _columns(conn, 'questions'):
+        legacy_rows = conn.execute('SELECT unit, question, marks FROM questions ORDER BY id').fetchall()
+        conn.execute('DROP TABLE questions')
+    if 'units' in tables and 'course_id' not in _columns(conn, 'units'):
+        # An unused table from an earlier prototype; keep it out of the way rather than dropping it
+        conn.execute('ALTER TABLE units RENAME TO legacy_units')
+    return legacy_rows
+
+
+def _import_legacy_questions(conn, legacy_rows):
+    now = time.time()
+    course_id = _get_or_create_course(conn, DEFAULT_COURSE, now)
+    document_id = _get_or_create_document(conn, course_id, 'legacy', 'legacy', now)
+    unit_ids = {}
+    rows = []
+    for unit, question, marks in legacy_rows:
+        if unit not in unit_ids:
+            number_match = UNIT_NUMBER_PATTERN.search(unit)
+            number = int(number_match.group(1)) if number_match else len(unit_ids) + 1
+            unit_ids[unit] = _get_or_create_unit(conn, course_id, document_id, number, unit.rstrip(':'))
+        co, bt, text = split_co_bt(question)
+        rows.append((course_id, unit_ids[unit], text, co, bt, int(marks), None, None, now))
+    # Written against the v1 table; cluster_id only exists from v3 on
+    conn.executemany(
+        'INSERT INTO questions (course_id, unit_id, text, co, bt, marks, model, run_id, created_at) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        rows
+    )
+    logging.info(f"Imported {len(rows)} questions from the previous schema.")
+
+
+# Function: Split '[CO:x] [BT:y]' Tags Off a Question Text
+def split_co_bt(question_text):
+    co_match = CO_PATTERN.search(question_text)
+    bt_match = BT_PATTERN.search(question_text)
+    co = int(co_match.group(1)) if co_match else None
+    bt = int(bt_match.group(1)) if bt_match else None
+    return co, bt, CO_BT_TAGS_PATTERN.sub('', question_text).strip()
+
+
+def _get_or_create_course(conn, name, now):
+    conn.execute('INSERT OR IGNORE INTO courses (name, created_at) VALUES (?, ?)', (name, now))
+    return conn.execute('SELECT id FROM courses WHERE name = ?', (name,)).fetchone()[0]
+
+
+def _get_or_create_document(conn, course_id, filename, content_hash, now):
+    conn.execute(
+        'INSERT OR IGNORE INTO syllabus_documents (course_id, filename, content_hash, created_at) VALUES (?, ?, ?, ?)',
+        (course_id, filename, content_hash, now)
+    )
+    return conn.execute(
+        'SELECT id FROM syllabus_documents WHERE course_id = ? AND content_hash = ?', (course_id, content_hash)
+    ).fetchone()[0]
+
+
+def _get_or_create_unit(conn, course_id, document_id, number, title):
+    conn.execute(
+        'INSERT OR IGNORE INTO units (course_id, document_id, number, title) VALUES (?, ?, ?, ?)',
+        (course_id, document_id, number, title)
+    )
+    return conn.execute(
+        'SELECT id FROM units WHERE document_id = ? AND number = ?', (document_id, number)
+    ).fetchone()[0]
+
+
+# Function: Record a Generation Run for a Course and Syllabus Version
+def start_run(run_id, course, filename, content_hash, model=None, mode=None, blueprint=None):
+    now = time.time()
+    with _pool().connection() as conn, transaction(conn):
+        course_id = _get_or_create_course(conn, course, now)
+        document_id = _get_or_create_document(conn, course_id, filename, content_hash, now)
+        conn.execute(
+            'INSERT INTO generation_runs (id, course_id, document_id, model, mode, blueprint, status, started_at) '
+            "VALUES (?, ?, ?, ?, ?, ?, 'running', ?)",
+            (run_id, course_id, document_id, model, mode, blueprint, now)
+        )
+    logging.info(f"Started generation run {run_id} for course '{course}'.")
+
+
+# Function: Mark a Generation Run as Failed
+def fail_run(run_id, error):
+    with _pool().connection() as conn:
+        conn.execute(
+            "UPDATE generation_runs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+            (str(error)[:500], time.time(), run_id)
+        )
+
+
+# Function: Append a Run's Questions to the Bank and Mark the Run as Succeeded
+def store_questions(unit_questions, run_id):
+    now = time.time()
+    with _pool().connection() as conn, transaction(conn):
+        course_id, document_id, model = conn.execute(
+            'SELECT course_id, document_id, model FROM generation_runs WHERE id = ?', (run_id,)
+        ).fetchone()
+        rows = []
+        unit_ids = []
+        for position, (unit, marks_dict) in enumerate(unit_questions.items(), start=1):
+            number_match = UNIT_NUMBER_PATTERN.search(unit)
+            number = int(number_match.group(1)) if number_match else position
+            unit_id = _get_or_create_unit(conn, course_id, document_id, number, unit)
+            unit_ids.append(unit_id)
+            for mark, questions in marks_dict.items():
+                for question_data in questions:
+                    co, bt = question_data.get('co'), question_data.get('bt')
+                    text = question_data['text']
+                    if co is None or bt is None:
+                        co, bt, text = split_co_bt(text)
+                    else:
+                        text = CO_BT_TAGS_PATTERN.sub('', text).strip()
+                    rows.append([course_id, unit_id, text, co, bt, int(mark), model, run_id, now, None])
+
+        added, near_duplicates, matched = _insert_questions(conn, rows)
+        conn.executemany(LINK_RUN_QUESTION, [(run_id, row[1], row[5], row[2]) for row in rows])
+        conn.executemany('INSERT OR IGNORE INTO run_questions (run_id, question_id) VALUES (?, ?)',
+                         [(run_id, question_id) for question_id in matched])
+        if BANK_MAX_PER_SLOT > 0:
+            _trim_slots(conn, unit_ids, BANK_MAX_PER_SLOT)
+        conn.execute(
+            "UPDATE generation_runs SET status = 'succeeded', question_count = ?, finished_at = ? WHERE id = ?",
+            (added, now, run_id)
+        )
+    logging.info(
+        f"Run {run_id} added {added} new questions ({len(rows) - added} skipped, {near_duplicates} near-duplicates "
+        f"{'rejected' if DEDUP_MODE == 'reject' else 'clustered'})."
+    )
+    return added
+
+
+# Insert question rows, checking each against the near-duplicate index first
+# Returns (added, near duplicates, ids of the stored questions that rejected near-duplicates matched)
+def _insert_questions(conn, rows):
+    if DEDUP_MODE == 'off':
+        before = conn.total_changes
+        conn.executemany(INSERT_QUESTION, rows)
+        return conn.total_changes - before, 0, []
+
+    index = NearDuplicateIndex(conn)
+    added = near_duplicates = 0
+    matched = []
+    for row in rows:
+        unit_id, text, marks = row[1], row[2], row[5]
+        signature, match = index.find(unit_id, marks, text)
+        if match:
+            near_duplicates += 1
+            if DEDUP_MODE == 'reject':
+                matched.append(match[0])
+                continue
+            row[9] = match[1]  # Join the matched question's cluster
+        cursor = conn.execute(INSERT_QUESTION, row)
+        if cursor.rowcount:
+            added += 1
+            index.add(unit_id, marks, cursor.lastrowid, row[9], signature)
+    index.flush()
+    return added, near_duplicates, matched
+
+
+# Rebuild signatures, LSH buckets and clusters for every stored question
+def _reindex_near_duplicates(conn):
+    conn.execute('DELETE FROM question_lsh')
+    conn.execute('DELETE FROM question_signatures')
+    conn.execute('UPDATE questions SET cluster_id = NULL')
+    index = NearDuplicateIndex(conn)
+    clustered = []
+    rows = conn.execute('SELECT id, unit_id, marks, text FROM questions ORDER BY id').fetchall()
+    near_duplicates = 0
+    for position, (question_id, unit_id, marks, text) in enumerate(rows, start=1):
+        signature, match = index.find(unit_id, marks, text)
+        cluster_id = match[1] if match else None
+        if cluster_id:
+            clustered.append((cluster_id, question_id))
+        index.add(unit_id, marks, question_id, cluster_id, signature)
+        if position % 1000 == 0:
+            # Write in chunks so a large bank is not held in memory
+            conn.executemany('UPDATE questions SET cluster_id = ? WHERE id = ?', clustered)
+            index.flush()
+            near_duplicates += len(clustered)
+            clustered = []
+    conn.executemany('UPDATE questions SET cluster_id = ? WHERE id = ?', clustered)
+    index.flush()
+    near_duplicates += len(clustered)
+    logging.info(f"Indexed {len(rows)} questions for near-duplicate detection; {near_duplicates} are near-duplicates.")
+    return {'indexed': len(rows), 'near_duplicates': near_duplicates}
+
+
+# When a cluster's first question is deleted, promote its oldest remaining member
+def _repair_clusters(conn):
+    conn.execute('''
+        UPDATE questions
+        SET cluster_id = (SELECT MIN(m.id) FROM questions m WHERE m.cluster_id = questions.cluster_id)
+        WHERE cluster_id IS NOT NULL AND cluster_id NOT IN (SELECT id FROM questions)
+    ''')
+    conn.execute('UPDATE questions SET cluster_id = NULL WHERE cluster_id = id')
+
+
+# Keep only the newest questions in each (unit, marks) slot
+def _trim_slots(conn, unit_ids, keep):
+    placeholders = ', '.join('?' for _ in unit_ids)
+    conn.execute(f'''
+        DELETE FROM questions WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY unit_id, marks ORDER BY id DESC) AS position
+                FROM questions WHERE unit_id IN ({placeholders})
+            ) WHERE position > ?
+        )
+    ''', (*unit_ids, keep))
+    _repair_clusters(conn)
+
+
+# Resolve a paper scope to (course id, syllabus document id); the newest successful run decides the defaults
+# Without a run or course the scope is the default course, never whichever course generated last
+def _resolve_scope(conn, course=None, syllabus=None, run_id=None):
+    if run_id:
+        row = conn.execute('SELECT course_id, document_id FROM generation_runs WHERE id = ?', (run_id,)).fetchone()
+        return row
+    query = (
+        'SELECT d.course_id, d.id FROM syllabus_documents d JOIN courses c ON c.id = d.course_id '
+        'LEFT JOIN generation_runs r ON r.document_id = d.id AND r.status = \'succeeded\' '
+        'WHERE c.name = ? AND EXISTS (SELECT 1 FROM units u WHERE u.document_id = d.id)'
+    )
+    params = [course or DEFAULT_COURSE]
+    if syllabus:
+        # A syllabus version is named by its document id or a prefix of its content hash
+        prefix = re.sub(r'([\\%_])', r'\\\1', str(syllabus))
+        query += " AND (CAST(d.id AS TEXT) = ? OR d.content_hash LIKE ? ESCAPE '\\')"
+        params.extend([str(syllabus), f"{prefix}%"])
+    query += ' GROUP BY d.id ORDER BY MAX(COALESCE(r.finished_at, d.created_at)) DESC LIMIT 1'
+    return conn.execute(query, params).fetchone()
+
+
+# Function: Questions for One Course/Syllabus Version (or Run), Grouped by Unit and Marks
+def get_questions_by_unit(course=None, syllabus=None, run_id=None, marks=(4, 6), distinct=True):
+    with _pool().connection() as conn:
+        scope = _resolve_scope(conn, course, syllabus, run_id)
+        if scope is None:
+            return {}
+        course_id, document_id = scope
+        marks_placeholders = ', '.join('?' for _ in marks)
+        query = (
+            'SELECT u.title, q.id, q.text, q.co, q.bt, q.marks, u.number, '
+            'ROW_NUMBER() OVER (PARTITION BY COALESCE(q.cluster_id, q.id) ORDER BY q.id) AS cluster_position '
+            'FROM units u JOIN questions q ON q.course_id = u.course_id AND q.unit_id = u.id '
+            f'WHERE u.document_id = ? AND q.marks IN ({marks_placeholders})'
+        )
+        params = [document_id, *marks]
+        if run_id:
+            query += ' AND q.id IN (SELECT question_id FROM run_questions WHERE run_id = ?)'
+            params.append(run_id)
+        query = f'SELECT title, id, text, co, bt, marks FROM ({query})'
+        if distinct:
+            # One question per near-duplicate cluster among the scope's questions (the oldest), so paraphrases
+            # never share a paper's pool; the cluster's first question may belong to another run
+            query += ' WHERE cluster_position = 1'
+        query += ' ORDER BY number, id'
+        rows = conn.execute(query, params).fetchall()
+
+    unit_questions = {}
+    for title, question_id, text, co, bt, question_marks in rows:
+        if title not in unit_questions:
+            unit_questions[title] = {str(m): [] for m in marks}
+        unit_questions[title][str(question_marks)].append(
+            {'id': question_id, 'text': text, 'co': co, 'bt': bt, 'marks': question_marks}
+        )
+    logging.debug("Retrieved %d questions grouped into %d units.", len(rows), len(unit_questions))
+    return unit_questions
+
+
+# Function: Course Name and Blueprint of a Paper Scope (the newest successful run's blueprint)
+def describe_scope(course=None, syllabus=None, run_id=None):
+    with _pool().connection() as conn:
+        scope = _resolve_scope(conn, course, syllabus, run_id)
+        if scope is None:
+            return None
+        course_id, document_id = scope
+        name = conn.execute('SELECT name FROM courses WHERE id = ?', (course_id,)).fetchone()[0]
+        query = "SELECT blueprint FROM generation_runs WHERE document_id = ? AND status = 'succeeded'"
+        params = [document_id]
+        if run_id:
+            query += ' AND id = ?'
+            params.append(run_id)
+        row = conn.execute(query + ' ORDER BY finished_at DESC LIMIT 1', params).fetchone()
+    return {'course': name, 'syllabus': document_id, 'blueprint': row[0] if row else None}
+
+
+# Function: Near-Duplicate Clusters (two or more questions) in One Scope
+def get_duplicate_clusters(course=None, syllabus=None, run_id=None):
+    with _pool().connection() as conn:
+        scope = _resolve_scope(conn, course, syllabus, run_id)
+        if scope is None:
+            return []
+        document_id = scope[1]
+        rows = conn.execute('''
+            SELECT COALESCE(q.cluster_id, q.id) AS cluster, u.title, q.marks, q.id, q.text, q.run_id
+            FROM units u JOIN questions q ON q.course_id = u.course_id AND q.unit_id = u.id
+            WHERE u.document_id = ? AND (
+                q.cluster_id IS NOT NULL
+                OR EXISTS (SELECT 1 FROM questions m WHERE m.cluster_id = q.id)
+            )
+            ORDER BY u.number, cluster, q.id
+        ''', (document_id,)).fetchall()
+
+    clusters = {}
+    for cluster_id, title, question_marks, question_id, text, question_run_id in rows:
+        cluster = clusters.setdefault(cluster_id, {'cluster_id': cluster_id, 'unit': title, 'marks': question_marks, 'questions': []})
+        cluster['questions'].append({'id': question_id, 'text': text, 'run_id': question_run_id})
+    return list(clusters.values())
+
+
+# Function: Rebuild the Near-Duplicate Index (e.g. after changing the threshold or enabling dedup)
+def reindex_near_duplicates():
+    with _pool().connection() as conn, transaction(conn):
+        return _reindex_near_duplicates(conn)
+
+
+# Function: Stored Blueprint Definition (parsed JSON) or None
+def get_stored_blueprint(name):
+    with _pool().connection() as conn:
+        row = conn.execute('SELECT definition FROM blueprints WHERE name = ?', (name,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def list_stored_blueprints():
+    with _pool().connection() as conn:
+        return [name for (name,) in conn.execute('SELECT name FROM blueprints ORDER BY name')]
+
+
+# Function: Insert or Replace a Blueprint Definition (JSON text)
+def store_blueprint(name, definition):
+    now = time.time()
+    with _pool().connection() as conn, transaction(conn):
+        conn.execute('''
+            INSERT INTO blueprints (name, definition, created_at, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET definition = excluded.definition, updated_at = excluded.updated_at
+        ''', (name, definition, now, now))
+
+
+# Function: Record an Upload of a Stored Blob under Its User-Visible Name; Returns the Upload Id
+def record_upload(filename, content_hash, size):
+    with _pool().connection() as conn, transaction(conn):
+        cursor = conn.execute(
+            'INSERT INTO uploads (filename, content_hash, size, created_at) VALUES (?, ?, ?, ?)',
+            (filename, content_hash, size, time.time())
+        )
+        return cursor.lastrowid
+
+
+def list_uploads(limit=50):
+    with _pool().connection() as conn:
+        rows = conn.execute(
+            'SELECT id, filename, content_hash, size, created_at FROM uploads ORDER BY id DESC LIMIT ?', (limit,)
+        ).fetchall()
+    return [dict(zip(('upload_id', 'filename', 'content_hash', 'size', 'created_at'), row)) for row in rows]
+
+
+# Function: Drop Upload Records Older than a Cutoff; Returns Content Hashes Still Referenced
+# A blob stays referenced while a recent upload or a syllabus version in the bank points at it
+def expire_uploads(before):
+    with _pool().connection() as conn:
+        with transaction(conn):
+            expired = conn.execute('DELETE FROM uploads WHERE created_at < ?', (before,)).rowcount
+        referenced = {row[0] for row in conn.execute(
+            'SELECT content_hash FROM uploads UNION SELECT content_hash FROM syllabus_documents'
+        )}
+    if expired:
+        logging.info(f"Expired {expired} upload records.")
+    return referenced
+
+
+# Function: Courses, Syllabus Versions and Recent Runs in the Bank
+def get_bank_summary(run_limit=20):
+    with _pool().connection() as conn:
+        documents = conn.execute('''
+            SELECT c.name, d.id, d.filename, d.content_hash, d.created_at,
+                   (SELECT COUNT(*) FROM units u JOIN questions q ON q.unit_id = u.id WHERE u.document_id = d.id),
+                   (SELECT COUNT(*) FROM generation_runs r WHERE r.document_id = d.id)
+            FROM syllabus_documents d JOIN courses c ON c.id = d.course_id
+            ORDER BY c.name, d.created_at
+        ''').fetchall()
+        runs = conn.execute('''
+            SELECT r.id, c.name, r.document_id, r.model, r.mode, r.blueprint, r.status, r.question_count, r.error, r.started_at, r.finished_at
+            FROM generation_runs r JOIN courses c ON c.id = r.course_id
+            ORDER BY r.started_at DESC LIMIT ?
+        ''', (run_limit,)).fetchall()
+
+    courses = {}
+    for course, document_id, filename, content_hash, created_at, question_count, run_count in documents:
+        courses.setdefault(course, []).append({
+            'syllabus': document_id,
+            'filename': filename,
+            'content_hash': content_hash,
+            'created_at': created_at,
+            'questions': question_count,
+            'runs': run_count,
+        })
+    return {
+        'courses': courses,
+        'runs': [
+            dict(zip(('run_id', 'course', 'syllabus', 'model', 'mode', 'blueprint', 'status', 'questions', 'error', 'started_at', 'finished_at'), run))
+            for run in runs
+        ],
+    }
+
+
+# Function: Apply Retention Policies and Remove Orphaned Rows
+def compact_bank(retention_days=BANK_RETENTION_DAYS, keep_versions=BANK_KEEP_VERSIONS,
+                 max_per_slot=BANK_MAX_PER_SLOT, vacuum=False):
+    now = time.time()
+    with _pool().connection() as conn:
+        with transaction(conn):
+            before = conn.total_changes
+
+            # Rank each course's stored syllabus versions by their latest successful run (newest first)
+            versions = conn.execute('''
+                SELECT d.id, d.course_id, MAX(COALESCE(r.finished_at, d.created_at)) AS last_used
+                FROM syllabus_documents d
+                LEFT JOIN generation_runs r ON r.document_id = d.id AND r.status = 'succeeded'
+                WHERE EXISTS (SELECT 1 FROM units u WHERE u.document_id = d.id)
+                GROUP BY d.id
+                ORDER BY d.course_id, last_used DESC
+            ''').fetchall()
+            expired = []
+            rank = {}
+            for document_id, course_id, last_used in versions:
+                rank[course_id] = rank.get(course_id, 0) + 1
+                if rank[course_id] == 1:
+                    continue  # A course's current syllabus version is never expired
+                if keep_versions > 0 and rank[course_id] > keep_versions:
+                    expired.append(document_id)
+                elif retention_days > 0 and now - last_used > retention_days * 86400:
+                    expired.append(document_id)
+
+            for document_id in expired:
+                conn.execute('DELETE FROM questions WHERE unit_id IN (SELECT id FROM units WHERE document_id = ?)', (document_id,))
+                conn.execute('DELETE FROM units WHERE document_id = ?', (document_id,))
+                conn.execute('DELETE FROM generation_runs WHERE document_id = ?', (document_id,))
+                conn.execute('DELETE FROM syllabus_documents WHERE id = ?', (document_id,))
+
+            if max_per_slot > 0:
+                unit_ids = [row[0] for row in conn.execute('SELECT id FROM units')]
+                if unit_ids:
+                    _trim_slots(conn, unit_ids, max_per_slot)
+
+            # Failed runs only matter for troubleshooting; runs stuck in 'running' belong to a crashed worker
+            conn.execute(
+                "DELETE FROM generation_runs WHERE status != 'succeeded' AND started_at < ?",
+                (now - FAILED_RUN_RETENTION_SECONDS,)
+            )
+            _repair_clusters(conn)
+            conn.execute('DELETE FROM units WHERE id NOT IN (SELECT DISTINCT unit_id FROM questions)')
+            conn.execute('''
+                DELETE FROM syllabus_documents
+                WHERE id NOT IN (SELECT document_id FROM units) AND id NOT IN (SELECT document_id FROM generation_runs)
+            ''')
+            conn.execute('''
+                DELETE FROM courses
+                WHERE id NOT IN (SELECT course_id FROM syllabus_documents)
+            ''')
+            removed = conn.total_changes - before
+        conn.execute('PRAGMA optimize')
+        if vacuum:
+            conn.execute('VACUUM')
+    logging.info(f"Compacted question bank: {len(expired)} syllabus versions expired, {removed} rows removed.")
+    return {'expired_versions': len(expired), 'rows_removed': removed}
@@ -0,0 +1,158 @@
+import re
+import logging
+
+from log_config import LogSampler
+
+# Marks values accepted when no blueprint narrows them down
+VALID_MARKS = ('4', '6')
+
+# Consecutive non-empty lines that match neither a unit title nor a question before the output is treated as off-format
+OFF_FORMAT_LINE_LIMIT = 12
+
+UNIT_TITLE_PATTERN = re.compile(r'^Unit\s+\d+:$', re.IGNORECASE)
+QUESTION_PATTERN = re.compile(
+    r'^(\d+)\.\s*(.+?)\s*\[CO:(\d+)\]\s*\[BT:(\d+)\]\s*\((\d+)\s*marks\)\.?$',
+    re.IGNORECASE
+)
+DIGITS_PATTERN = re.compile(r'\d+')
+
+# Accepted and skipped questions are logged per row; at DEBUG only a sample of them is logged
+log_question = LogSampler('question_parser')
+
+
+# QuestionStreamParser: Line-Buffered Parser Fed with Tokens as They Stream In
+class QuestionStreamParser:
+    def __init__(self, units, quotas=None, off_format_limit=OFF_FORMAT_LINE_LIMIT, on_warning=None, marks=VALID_MARKS):
+        # quotas maps unit number -> {marks: count}; questions beyond a quota are dropped
+        self.units = units
+        self.quotas = quotas
+        self.marks = tuple(marks)
+        self.off_format_limit = off_format_limit
+        self.on_warning = on_warning
+        self.unit_questions = {unit_num: {marks: [] for marks in self.marks} for unit_num in units.keys()}
+        self.current_unit_number = None
+        self.co_number_expected = None
+        self.off_format_lines = 0
+        self.accepted = 0
+        self._buffer = ''
+
+    # Feed a chunk of generated text; returns the question records completed by it
+    def feed(self, chunk):
+        if '\n' not in chunk:
+            self._buffer += chunk
+            return []
+        lines = (self._buffer + chunk).split('\n')
+        self._buffer = lines.pop()
+        records = []
+        for line in lines:
+            record = self._parse_line(line)
+            if record:
+                records.append(record)
+        return records
+
+    # Flush the final partial line once the stream has ended
+    def close(self):
+        line, self._buffer = self._buffer, ''
+        record = self._parse_line(line)
+        return [record] if record else []
+
+    def is_complete(self):
+        if self.quotas is None:
+            return False
+        return all(
+            len(self.unit_questions[unit_number][marks]) >= count
+            for unit_number, slots in self.quotas.items()
+            for marks, count in slots.items()
+        )
+
+    def is_unit_complete(self, unit_number):
+        if self.quotas is None or unit_number not in self.quotas:
+            return False
+        return all(
+            len(self.unit_questions[unit_number][marks]) >= count
+            for marks, count in self.quotas[unit_number].items()
+        )
+
+    def is_off_format(self):
+        return self.off_format_lines >= self.off_format_limit
+
+    # Map unit numbers back to full unit titles
+    def result(self):
+        mapped_unit_questions = {}
+        for unit_number, questions in self.unit_questions.items():
+            full_title = self.units[unit_number]
+            mapped_unit_questions[full_title] = questions
+        return mapped_unit_questions
+
+    def _warn(self, message):
+        logging.warning(message)
+        if self.on_warning:
+            self.on_warning(message)
+
+    def _parse_line(self, line):
+        line = line.strip()
+        if not line:
+            return None  # Skip empty lines
+
+        # Detect unit titles in the AI-generated text (e.g., 'Unit 1:')
+        if UNIT_TITLE_PATTERN.match(line):
+            self.off_format_lines = 0
+            unit_number = line.split(':')[0].strip()
+            if unit_number in self.units:
+                self.current_unit_number = unit_number
+                self.co_number_expected = int(DIGITS_PATTERN.search(unit_number).group())
+                logging.debug("Detected current unit: %s, expected CO number: %s", self.current_unit_number, self.co_number_expected)
+            else:
+                self._warn(f"Unknown unit detected: {unit_number}")
+            return None  # Skip unit titles
+
+        if not self.current_unit_number:
+            self.off_format_lines += 1
+            self._warn(f"Question found before any unit title: {line}")
+            return None  # Skip questions before any unit is detected
+
+        # Extract question and marks using regex
+        match = QUESTION_PATTERN.match(line)
+        if not match:
+            self.off_format_lines += 1
+            self._warn(f"Line does not match expected question format: {line}")
+            return None
+        self.off_format_lines = 0
+
+        question_number = int(match.group(1).strip())
+        question_text = match.group(2).strip()
+        co_number = int(match.group(3).strip())
+        bt_number = int(match.group(4).strip())
+        marks = match.group(5).strip()
+        if marks not in self.marks:
+            self._warn(f"Unexpected marks value: {marks} in line: {line}")
+            return None
+        if co_number != self.co_number_expected:
+            self._warn(f"CO number {co_number} does not match expected CO number {self.co_number_expected} for unit {self.current_unit_number}")
+            return None  # Skip questions with incorrect CO numbers
+        if not (1 <= bt_number <= 6):
+            self._warn(f"BT number {bt_number} is out of expected range (1-6)")
+            return None  # Skip questions with invalid BT numbers
+
+        bucket = self.unit_questions[self.current_unit_number][marks]
+        if self.quotas is not None and len(bucket) >= self.quotas.get(self.current_unit_number, {}).get(marks, 0):
+            if log_question():
+                logging.debug("Quota for %s (%s marks) already filled; skipping question %s.", self.current_unit_number, marks, question_number)
+            return None
+
+        # Include CO and BT in the question text
+        question_text_with_co_bt = f"{question_text} [CO:{co_number}] [BT:{bt_number}]"
+        bucket.append({'text': question_text_with_co_bt, 'marks': marks, 'co': co_number, 'bt': bt_number})
+        self.accepted += 1
+        if log_question():
+            logging.debug("Parsed question %s for %s: %s (%s marks)", question_number, self.current_unit_number, question_text_with_co_bt, marks)
+        return {
+            'unit': self.current_unit_number,
+            'title': self.units[self.current_unit_number],
+            'number': question_number,
+            'text': question_text_with_co_bt,
+            'question': question_text,
+            'co': co_number,
+            'bt': bt_number,
+            'marks': marks,
+        }
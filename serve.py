@@ -0,0 +1,171 @@
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+import threading
+import multiprocessing
+import multiprocessing.connection
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+from config import load_config
+
+# Production Runner: a master process runs startup work once, binds the listening socket and keeps
+# QPG_WORKERS worker processes serving it, each with QPG_THREADS request threads. Jobs, caches and
+# the question bank live in the data directory (SQLite), so any worker can answer for any job.
+# Usage: python serve.py [--host H] [--port N] [--workers N] [--threads N] [--config FILE]
+# Settings are read in main(), after the config file is loaded
+DEFAULT_WORKERS = min(os.cpu_count() or 1, 4)
+DEFAULT_THREADS = 16
+LISTEN_BACKLOG = 1024
+DEFAULT_METRICS_DIR = 'data/metrics'
+RESPAWN_BACKOFF_SECONDS = 1.0  # Workers that exit within this long of starting are restarted after a pause
+
+
+# PooledWSGIServer: Werkzeug's WSGI Server on a Bounded Thread Pool, Sharing the Master's Socket
+# A worker only accepts a connection when one of its threads is free; until then connections wait
+# in the shared listen backlog, where an idle worker picks them up
+class PooledWSGIServer(BaseWSGIServer):
+    def __init__(self, listener, app, threads):
+        host, port = listener.getsockname()[:2]
+        super().__init__(host, port, app, fd=listener.fileno())
+        self.multithread = True
+        # Several processes wait on the socket; the ones that lose the race must not block in accept()
+        self.socket.setblocking(False)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='qpg-http')
+        self._slots = threading.BoundedSemaphore(threads)
+
+    def get_request(self):
+        self._slots.acquire()
+        try:
+            return super().get_request()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def process_request(self, request, client_address):
+        try:
+            self.executor.submit(self._process_request_thread, request, client_address)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+
+# Function: Worker Process Entry Point; serves until SIGTERM or SIGINT
+def run_worker(listener, threads):
+    from app import create_app
+    app = create_app(run_startup=False)
+    server = PooledWSGIServer(listener, app, threads)
+
+    # shutdown() waits for serve_forever() to return, so it cannot be called on the serving thread
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logging.info(f"Worker {os.getpid()} serving with {threads} threads.")
+    # serve_forever() closes the socket on return; requests in progress finish before the worker exits
+    server.serve_forever()
+    server.executor.shutdown(wait=True)
+    logging.info(f"Worker {os.getpid()} stopped.")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run the question paper generator with multiple worker processes.')
+    parser.add_argument('--config', help='Config file of KEY=VALUE settings (default: QPG_CONFIG or qpg.env if present)')
+    parser.add_argument('--host', help='Address to listen on (QPG_HOST, default 0.0.0.0)')
+    parser.add_argument('--port', type=int, help='Port to listen on (QPG_PORT, default 5000)')
+    parser.add_argument('--workers', type=int, help=f'Worker processes (QPG_WORKERS, default {DEFAULT_WORKERS})')
+    parser.add_argument('--threads', type=int, help=f'Request threads per worker (QPG_THREADS, default {DEFAULT_THREADS})')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_config(args.config)
+    host = args.host or os.environ.get('QPG_HOST', '0.0.0.0')
+    port = args.port or int(os.environ.get('QPG_PORT', 5000))
+    workers = max(args.workers or int(os.environ.get('QPG_WORKERS', DEFAULT_WORKERS)), 1)
+    threads = max(args.threads or int(os.environ.get('QPG_THREADS', DEFAULT_THREADS)), 1)
+    shutdown_timeout = float(os.environ.get('QPG_SHUTDOWN_TIMEOUT', 30))
+
+    # PDF extraction and rendering pools are per worker process: share the CPUs out between them
+    cpus_per_worker = str(max((os.cpu_count() or 1) // workers, 1))
+    os.environ.setdefault('QPG_PDF_WORKERS', cpus_per_worker)
+    os.environ.setdefault('QPG_RENDER_WORKERS', cpus_per_worker)
+    # Workers share one socket, so any of them may answer /metrics: they combine their metrics through files here
+    os.environ.setdefault('QPG_METRICS_DIR', DEFAULT_METRICS_DIR)
+
+    from app import startup
+    from jobs import job_queue
+    from metrics import metrics
+    from log_config import configure_logging
+    configure_logging()
+    metrics.clear_shared()
+    startup()
+
+    listener = socket.create_server((host, port), backlog=LISTEN_BACKLOG)
+    # Workers are spawned, not forked: each imports the application afresh, with its own pools and threads
+    context = multiprocessing.get_context('spawn')
+    processes = {}
+    started_at = {}
+
+    def start_worker(number):
+        process = context.Process(target=run_worker, args=(listener, threads), name=f'qpg-worker-{number}')
+        process.start()
+        processes[number] = process
+        started_at[number] = time.monotonic()
+
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for number in range(workers):
+        start_worker(number)
+    logging.info(f"Listening on http://{host}:{port} with {workers} workers x {threads} threads.")
+
+    while not stopping.is_set():
+        multiprocessing.connection.wait([process.sentinel for process in processes.values()], timeout=1)
+        for number, process in list(processes.items()):
+            if process.is_alive() or stopping.is_set():
+                continue
+            logging.warning(f"Worker {process.pid} exited with code {process.exitcode}; starting a new one.")
+            job_queue.recover([process.pid])
+            if time.monotonic() - started_at[number] < RESPAWN_BACKOFF_SECONDS:
+                time.sleep(RESPAWN_BACKOFF_SECONDS)
+            start_worker(number)
+
+    logging.info("Stopping workers.")
+    for process in processes.values():
+        process.terminate()
+    deadline = time.monotonic() + shutdown_timeout
+    for process in processes.values():
+        process.join(max(deadline - time.monotonic(), 0))
+        if process.is_alive():
+            logging.warning(f"Worker {process.pid} did not stop within {shutdown_timeout:.0f}s; killing it.")
+            process.kill()
+            process.join()
+    listener.close()
+    job_queue.recover([process.pid for process in processes.values()])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
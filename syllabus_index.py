@@ -0,0 +1,162 @@
+import re
+import json
+import math
+import bisect
+import logging
+
+from pdf_text import iter_pdf_pages, join_pages, page_cache
+
+# Bump when the stored structure changes so older indexes are rebuilt
+INDEX_VERSION = 1
+
+UNIT_LINE_PATTERN = re.compile(r'^Unit\s+\d+.*', re.IGNORECASE)
+# Topics are listed one per line or separated by commas, semicolons, bullets or spaced dashes
+TOPIC_SEPARATOR_PATTERN = re.compile(r'\s*(?:[,;•▪●]|\s[-–—]\s)\s*')
+LETTER_PATTERN = re.compile(r'[^\W\d_]')
+MAX_TOPIC_LENGTH = 120
+
+# Rough token estimate for LLaMA-family tokenizers on English text
+CHARACTERS_PER_TOKEN = 4
+
+
+# Function: Estimate the Number of Model Tokens in a Text
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARACTERS_PER_TOKEN)
+
+
+# SyllabusIndex: Unit Spans, Titles, Topics, Page Ranges and Token Counts of a Syllabus
+class SyllabusIndex:
+    def __init__(self, text, units, page_count, preamble_end=0):
+        self.text = text
+        # Unit number -> {'title', 'spans': [[start, end], ...], 'pages': [first, last], 'topics', 'tokens'}
+        self.units = units
+        self.page_count = page_count
+        # Text before the first unit (course header)
+        self.preamble_end = preamble_end
+
+    @property
+    def tokens(self):
+        return estimate_tokens(self.text)
+
+    @property
+    def preamble(self):
+        return self.text[:self.preamble_end]
+
+    # Unit number -> full heading line, in syllabus order
+    def unit_titles(self):
+        return {unit_number: unit['title'] for unit_number, unit in self.units.items()}
+
+    # A unit's text, from its heading up to the next unit heading
+    def unit_text(self, unit_number):
+        return '\n'.join(self.text[start:end] for start, end in self.units[unit_number]['spans'])
+
+    def unit_texts(self):
+        return {unit_number: self.unit_text(unit_number) for unit_number in self.units}
+
+    def to_dict(self):
+        return {
+            'page_count': self.page_count,
+            'preamble_end': self.preamble_end,
+            'units': [{'number': unit_number, **unit} for unit_number, unit in self.units.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, text, structure):
+        units = {}
+        for unit in structure['units']:
+            unit = dict(unit)
+            units[unit.pop('number')] = unit
+        return cls(text, units, structure['page_count'], structure.get('preamble_end', 0))
+
+    # Per-unit summary without the text spans, for logs and API responses
+    def summary(self):
+        return {
+            'pages': self.page_count,
+            'tokens': self.tokens,
+            'units': {
+                unit_number: {'pages': unit['pages'], 'topics': len(unit['topics']), 'tokens': unit['tokens']}
+                for unit_number, unit in self.units.items()
+            },
+        }
+
+
+# Function: Split a Unit's Heading Remainder and Body into a Deduplicated Topic List
+def extract_topics(title, body_lines):
+    # PyPDF2 keeps a trailing space where a line was wrapped, so such lines continue on the next one
+    lines = []
+    continued = False
+    for line in body_lines:
+        if continued and lines:
+            lines[-1] = f"{lines[-1]} {line.strip()}"
+        else:
+            lines.append(line.strip())
+        continued = line != line.rstrip()
+
+    topics = []
+    seen = set()
+    _, _, heading_topics = title.partition(':')
+    for line in [heading_topics, *lines]:
+        for topic in TOPIC_SEPARATOR_PATTERN.split(line):
+            topic = topic.strip(' \t.:-')
+            if not topic or len(topic) > MAX_TOPIC_LENGTH or not LETTER_PATTERN.search(topic):
+                continue
+            if topic.lower() not in seen:
+                seen.add(topic.lower())
+                topics.append(topic)
+    return topics
+
+
+# Function: Index a Syllabus in One Pass over Its Lines
+# A unit runs from a line starting with 'Unit <n>' up to the next such line; a unit number
+# seen again continues that unit, and its last heading is kept as the title
+def build_index(text, page_offsets):
+    page_starts = [offset for _, offset in page_offsets]
+
+    def page_at(offset):
+        return page_offsets[max(bisect.bisect_right(page_starts, offset) - 1, 0)][0] if page_offsets else 1
+
+    units = {}
+    bodies = {}
+    current = None
+    preamble_end = None
+    offset = 0
+    for line, content in zip(text.splitlines(keepends=True), text.splitlines()):
+        stripped = content.strip()
+        if UNIT_LINE_PATTERN.match(stripped):
+            if preamble_end is None:
+                preamble_end = offset
+            unit_number = stripped.split(':')[0].strip()
+            current = units.setdefault(unit_number, {'title': stripped, 'spans': []})
+            current['title'] = stripped
+            current['spans'].append([offset, offset + len(content)])
+            bodies.setdefault(unit_number, [])
+        elif current is not None:
+            current['spans'][-1][1] = offset + len(content)
+            bodies[unit_number].append(content)
+        offset += len(line)
+
+    index = SyllabusIndex(text, units, len(page_offsets), preamble_end if preamble_end is not None else len(text))
+    for unit_number, unit in units.items():
+        unit['pages'] = [page_at(unit['spans'][0][0]), page_at(max(unit['spans'][-1][1] - 1, unit['spans'][-1][0]))]
+        unit['topics'] = extract_topics(unit['title'], bodies[unit_number])
+        unit['tokens'] = estimate_tokens(index.unit_text(unit_number))
+    return index
+
+
+# Function: Extract and Index a Syllabus PDF
+# With a content hash, pages come from the page cache and the index is stored next to them,
+# so a syllabus seen before is neither re-parsed nor re-scanned
+def load_syllabus(filepath, content_hash=None):
+    stored = page_cache.get_index(content_hash) if content_hash else None
+    text, page_offsets = join_pages(iter_pdf_pages(filepath, content_hash))
+
+    if stored is not None and stored[0] == INDEX_VERSION:
+        index = SyllabusIndex.from_dict(text, json.loads(stored[1]))
+        logging.debug("Loaded syllabus index for document %s.", content_hash[:12])
+        return index
+
+    index = build_index(text, page_offsets)
+    if content_hash:
+        page_cache.store_index(content_hash, INDEX_VERSION, json.dumps(index.to_dict(), ensure_ascii=False))
+    logging.info(f"Indexed syllabus {filepath}: {index.summary()}")
+    return index
@@ -0,0 +1,168 @@
+import os
+import re
+import time
+import shutil
+import secrets
+import hashlib
+import logging
+import tempfile
+
+from question_bank import record_upload, expire_uploads
+
+# Upload Storage Configuration
+BLOB_DIR = os.environ.get('QPG_BLOB_DIR', 'uploads/blobs')
+UPLOAD_RETENTION_DAYS = float(os.environ.get('QPG_UPLOAD_RETENTION_DAYS', 30))  # Upload records kept this long; 0 keeps them forever
+PAPER_RETENTION_DAYS = float(os.environ.get('QPG_PAPER_RETENTION_DAYS', 7))  # Paper sets older than this are removed; 0 keeps them
+PAPER_DIR = os.environ.get('QPG_PAPER_DIR', 'uploads/papers')  # One directory per generated paper set
+
+UPLOAD_BLOCK_SIZE = 64 * 1024
+# Blobs and partial uploads this recent are never collected: their upload may still be in flight
+GC_GRACE_SECONDS = 3600
+PARTIAL_UPLOAD_PREFIX = '.upload-'
+
+PAPER_FILENAME_PATTERN = re.compile(r'^question_paper_(\d+)\.pdf$')
+PAPER_SET_PATTERN = re.compile(r'^[0-9a-f]{16}$')
+
+
+class UploadError(Exception):
+    pass
+
+
+# StoredUpload: One Upload, Its User-Visible Name and the Content-Addressed Blob Holding Its Bytes
+class StoredUpload:
+    def __init__(self, upload_id, filename, content_hash, size, deduplicated):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.content_hash = content_hash
+        self.size = size
+        self.deduplicated = deduplicated
+
+    @property
+    def path(self):
+        return blob_path(self.content_hash)
+
+    def to_dict(self):
+        return {
+            'upload_id': self.upload_id,
+            'filename': self.filename,
+            'content_hash': self.content_hash,
+            'size': self.size,
+            'deduplicated': self.deduplicated,
+        }
+
+
+def blob_path(content_hash):
+    return os.path.join(BLOB_DIR, content_hash[:2], f"{content_hash}.pdf")
+
+
+# Function: Stream an Upload to Disk While Hashing It, Keeping One Blob per Content Hash
+# Bytes go to a temporary file in the blob directory and are renamed into place, so concurrent
+# uploads of the same name or the same content never overwrite each other's files
+def store_upload(stream, filename):
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=BLOB_DIR, prefix=PARTIAL_UPLOAD_PREFIX, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as temp:
+            for block in iter(lambda: stream.read(UPLOAD_BLOCK_SIZE), b''):
+                digest.update(block)
+                temp.write(block)
+                size += len(block)
+        if not size:
+            raise UploadError('The uploaded file is empty.')
+
+        content_hash = digest.hexdigest()
+        path = blob_path(content_hash)
+        deduplicated = os.path.exists(path)
+        if deduplicated:
+            os.unlink(temp_path)
+            # A fresh mtime keeps the garbage collector's grace period from racing this upload
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+    upload_id = record_upload(filename, content_hash, size)
+    logging.info(
+        f"Stored upload {upload_id} '{filename}' as blob {content_hash[:12]} ({size} bytes"
+        f"{', already stored' if deduplicated else ''})."
+    )
+    return StoredUpload(upload_id, filename, content_hash, size, deduplicated)
+
+
+# Function: Create the Directory for One Request's Paper Set; returns (set id, directory)
+# Every /generate-papers request renders into a set of its own, so concurrent requests never
+# overwrite each other's papers
+def create_paper_set():
+    set_id = secrets.token_hex(8)
+    directory = os.path.join(PAPER_DIR, set_id)
+    os.makedirs(directory)
+    return set_id, directory
+
+
+# Function: Directory of an Existing Paper Set, or None
+def paper_set_dir(set_id):
+    if not PAPER_SET_PATTERN.match(set_id or ''):
+        return None
+    directory = os.path.join(PAPER_DIR, set_id)
+    return directory if os.path.isdir(directory) else None
+
+
+# Function: Remove Unreferenced Blobs, Abandoned Partial Uploads and Stale Generated Papers
+def collect_garbage(paper_dir=None, upload_retention_days=UPLOAD_RETENTION_DAYS, paper_retention_days=PAPER_RETENTION_DAYS):
+    now = time.time()
+    referenced = expire_uploads(now - upload_retention_days * 86400 if upload_retention_days > 0 else 0)
+    result = {'blobs_removed': 0, 'partial_uploads_removed': 0, 'papers_removed': 0, 'bytes_freed': 0, 'blobs': 0, 'blob_bytes': 0}
+
+    if os.path.isdir(BLOB_DIR):
+        for directory, _, filenames in os.walk(BLOB_DIR, topdown=False):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                recent = now - stat.st_mtime < GC_GRACE_SECONDS
+                if filename.startswith(PARTIAL_UPLOAD_PREFIX):
+                    kind = 'partial_uploads_removed'
+                elif filename.endswith('.pdf') and filename[:-4] not in referenced:
+                    kind = 'blobs_removed'
+                else:
+                    kind = None
+                if kind is None or recent:
+                    result['blobs'] += filename.endswith('.pdf')
+                    result['blob_bytes'] += stat.st_size
+                    continue
+                os.unlink(path)
+                result[kind] += 1
+                result['bytes_freed'] += stat.st_size
+            if directory != BLOB_DIR and not os.listdir(directory):
+                os.rmdir(directory)
+
+    # Paper sets are never re-rendered: a set is removed once it is older than the retention window
+    if paper_retention_days > 0 and os.path.isdir(PAPER_DIR):
+        for set_id in os.listdir(PAPER_DIR):
+            directory = os.path.join(PAPER_DIR, set_id)
+            if not PAPER_SET_PATTERN.match(set_id) or now - os.path.getmtime(directory) <= paper_retention_days * 86400:
+                continue
+            for filename in os.listdir(directory):
+                result['bytes_freed'] += os.path.getsize(os.path.join(directory, filename))
+                result['papers_removed'] += PAPER_FILENAME_PATTERN.match(filename) is not None
+            shutil.rmtree(directory, ignore_errors=True)
+
+    # Papers rendered straight into the upload folder before paper sets existed
+    if paper_dir and paper_retention_days > 0 and os.path.isdir(paper_dir):
+        for filename in os.listdir(paper_dir):
+            path = os.path.join(paper_dir, filename)
+            if PAPER_FILENAME_PATTERN.match(filename) and now - os.path.getmtime(path) > paper_retention_days * 86400:
+                result['bytes_freed'] += os.path.getsize(path)
+                os.unlink(path)
+                result['papers_removed'] += 1
+
+    logging.info(f"Upload storage garbage collection: {result}")
+    return result
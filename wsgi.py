@@ -0,0 +1,12 @@
+# WSGI Entry Point for Production Servers, e.g.
+#   gunicorn --workers 4 --threads 16 wsgi:app
+#   waitress-serve --threads 16 wsgi:app
+# Settings come from the environment and the config file (config.py); startup work is safe
+# to run in every worker process (app.startup)
+from config import load_config
+
+load_config()
+
+from app import create_app  # noqa: E402
+
+app = create_app()